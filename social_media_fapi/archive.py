@@ -0,0 +1,266 @@
+"""
+Moves old posts, with their comments and likes, out of the database into compressed archive files.
+
+Each post becomes one JSON line: {"post": {...}, "comments": [...], "likes": [...]}. The lines are
+gzipped in blocks of ARCHIVE_BLOCK_SIZE posts, and the blocks are appended one after the other to a
+file in ARCHIVE_DIR (concatenated gzip members are still a valid .gz file, zcat reads the lot).
+post_archive_index has the block (and the image_url) of every archived post, so GET /post/{id} can still find it by
+decompressing just that block. archived_comment_index and archived_like_index say whose the
+archived comments and likes are, for exports (see export.py).
+
+The user stats don't change: what moved to the archive is kept in archived_user_stats, which
+stats.reconcile() adds to what it counts in the database.
+
+Run it from cron (not from every worker), from the top social_media_fapi directory:
+    python -m social_media_fapi.archive --older-than-days 365
+"""
+import argparse
+import asyncio
+import gzip
+import json
+import logging
+import os
+import pathlib
+import time
+from collections import Counter
+from functools import lru_cache
+from typing import Optional
+
+import sqlalchemy
+
+from social_media_fapi.config import config
+from social_media_fapi.database import (
+    archived_comment_index_table,
+    archived_like_index_table,
+    archived_user_stats_table,
+    comment_table,
+    database,
+    like_table,
+    post_archive_index_table,
+    post_stats_table,
+    post_table,
+)
+from social_media_fapi.stats import increment
+
+logger = logging.getLogger(__name__)
+
+
+def write_blocks(path: pathlib.Path, documents: list[dict], block_size: int) -> tuple[list[tuple], int, int]:
+    """
+    Appends the documents to the file as gzip blocks and makes sure they are on disk.
+    Returns (post_id, offset, length) for each document, and the bytes before and after compression.
+    """
+    entries = []
+    raw_bytes = compressed_bytes = 0
+    with open(path, "ab") as f:
+        for start in range(0, len(documents), block_size):
+            block = documents[start : start + block_size]
+            raw = "".join(json.dumps(document) + "\n" for document in block).encode()
+            compressed = gzip.compress(raw, mtime=0)
+            offset = f.tell()
+            f.write(compressed)
+            entries += [(document["post"]["id"], offset, len(compressed)) for document in block]
+            raw_bytes += len(raw)
+            compressed_bytes += len(compressed)
+        f.flush()
+        # The rows are deleted from the database next, so the archive has to really be written first.
+        os.fsync(f.fileno())
+    return entries, raw_bytes, compressed_bytes
+
+
+# Blocks never change once written, so the popular ones can stay in memory.
+@lru_cache(maxsize=32)
+def read_block(path: str, offset: int, length: int) -> tuple[dict, ...]:
+    with open(path, "rb") as f:
+        f.seek(offset)
+        data = gzip.decompress(f.read(length))
+    return tuple(json.loads(line) for line in data.splitlines())
+
+
+async def find_archived_post(post_id: int, archive_dir: str = None) -> Optional[dict]:
+    """The archived {"post": ..., "comments": ..., "likes": ...} for post_id, None if it isn't archived."""
+    query = post_archive_index_table.select().where(post_archive_index_table.c.post_id == post_id)
+    entry = await database.fetch_one(query)
+    if not entry:
+        return None
+    path = str(pathlib.Path(archive_dir or config.ARCHIVE_DIR) / entry.file)
+    block = await asyncio.to_thread(read_block, path, entry.offset, entry.length)
+    return next(document for document in block if document["post"]["id"] == post_id)
+
+
+def to_documents(posts, comments, likes) -> list[dict]:
+    comments_by_post = {post.id: [] for post in posts}
+    for comment in comments:
+        comment = dict(comment._mapping)
+        del comment["path"]
+        comments_by_post[comment["post_id"]].append(comment)
+    likes_by_post = {post.id: [] for post in posts}
+    for like in likes:
+        likes_by_post[like.post_id].append({"id": like.id, "user_id": like.user_id})
+
+    return [
+        {
+            "post": {
+                "id": post.id,
+                "body": post.body,
+                "user_id": post.user_id,
+                "image_url": post.image_url,
+                "created_at": post.created_at,
+                "likes": len(likes_by_post[post.id]),
+            },
+            "comments": comments_by_post[post.id],
+            "likes": likes_by_post[post.id],
+        }
+        for post in posts
+    ]
+
+
+async def add_archived_user_stats(posts, comments, likes) -> None:
+    counts = {
+        "post_count": Counter(post.user_id for post in posts),
+        "comment_count": Counter(comment.user_id for comment in comments),
+        "like_count": Counter(like.user_id for like in likes),
+    }
+    user_ids = set().union(*counts.values())
+    existing = await database.fetch_all(
+        sqlalchemy.select(archived_user_stats_table.c.user_id).where(
+            archived_user_stats_table.c.user_id.in_(user_ids)
+        )
+    )
+    missing = user_ids - {row.user_id for row in existing}
+    if missing:
+        await database.execute_many(
+            archived_user_stats_table.insert(), [{"user_id": user_id} for user_id in missing]
+        )
+    for user_id in user_ids:
+        amounts = {name: counter[user_id] for name, counter in counts.items() if counter[user_id]}
+        await database.execute(increment(archived_user_stats_table, user_id, **amounts))
+
+
+async def archive_batch(cutoff: int, batch_size: int, block_size: int, path: pathlib.Path) -> dict:
+    query = (
+        post_table.select()
+        .where(post_table.c.created_at < cutoff, post_table.c.deleted_at.is_(None))
+        .order_by(post_table.c.id)
+        .limit(batch_size)
+    )
+    posts = await database.fetch_all(query)
+    if not posts:
+        return {}
+    post_ids = [post.id for post in posts]
+    comments = await database.fetch_all(
+        comment_table.select().where(comment_table.c.post_id.in_(post_ids)).order_by(comment_table.c.path)
+    )
+    likes = await database.fetch_all(like_table.select().where(like_table.c.post_id.in_(post_ids)))
+
+    documents = to_documents(posts, comments, likes)
+    entries, raw_bytes, compressed_bytes = await asyncio.to_thread(write_blocks, path, documents, block_size)
+
+    # If we stop before this commits, the posts are still in the database and get archived again
+    # next time. The copy already in the file is just never looked at.
+    posts_by_id = {post.id: post for post in posts}
+    index_rows = [
+        {
+            "post_id": post_id,
+            "user_id": posts_by_id[post_id].user_id,
+            "file": path.name,
+            "offset": offset,
+            "length": length,
+            "image_url": posts_by_id[post_id].image_url,
+        }
+        for post_id, offset, length in entries
+    ]
+    async with database.transaction():
+        await database.execute_many(post_archive_index_table.insert(), index_rows)
+        if comments:
+            await database.execute_many(
+                archived_comment_index_table.insert(),
+                [{"comment_id": c.id, "post_id": c.post_id, "user_id": c.user_id} for c in comments],
+            )
+        if likes:
+            await database.execute_many(
+                archived_like_index_table.insert(),
+                [{"like_id": like.id, "post_id": like.post_id, "user_id": like.user_id} for like in likes],
+            )
+        await add_archived_user_stats(posts, comments, likes)
+        for table in (like_table, comment_table, post_stats_table):
+            await database.execute(table.delete().where(table.c.post_id.in_(post_ids)))
+        await database.execute(post_table.delete().where(post_table.c.id.in_(post_ids)))
+
+    return {
+        "posts": len(posts),
+        "comments": len(comments),
+        "likes": len(likes),
+        "raw_bytes": raw_bytes,
+        "compressed_bytes": compressed_bytes,
+    }
+
+
+async def sqlite_space() -> Optional[dict]:
+    """The size of the sqlite database and how much of it is free pages, None for other databases."""
+    if database.url.dialect != "sqlite":
+        return None
+    page_size = await database.fetch_val("PRAGMA page_size")
+    return {
+        "size": await database.fetch_val("PRAGMA page_count") * page_size,
+        "free": await database.fetch_val("PRAGMA freelist_count") * page_size,
+    }
+
+
+async def archive_posts(
+    older_than_days: int,
+    batch_size: int = 1000,
+    block_size: int = None,
+    archive_dir: str = None,
+    vacuum: bool = False,
+) -> dict:
+    """Archives every post older than older_than_days, batch_size posts per transaction. Returns a report."""
+    cutoff = int(time.time()) - older_than_days * 24 * 60 * 60
+    directory = pathlib.Path(archive_dir or config.ARCHIVE_DIR)
+    await asyncio.to_thread(directory.mkdir, parents=True, exist_ok=True)
+    path = directory / f"posts-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}.jsonl.gz"
+
+    space_before = await sqlite_space()
+    totals = Counter()
+    while batch := await archive_batch(cutoff, batch_size, block_size or config.ARCHIVE_BLOCK_SIZE, path):
+        totals.update(batch)
+        logger.info("Archived %s posts so far", totals["posts"])
+    if vacuum and space_before:
+        # Gives the free pages back to the filesystem, it rewrites the whole database file.
+        await database.execute("VACUUM")
+    space_after = await sqlite_space()
+
+    report = {"file": str(path) if totals else None, **totals}
+    if totals["raw_bytes"]:
+        report["compression_ratio"] = round(totals["raw_bytes"] / totals["compressed_bytes"], 1)
+    if space_before:
+        report["database_bytes_before"] = space_before["size"]
+        report["database_bytes_after"] = space_after["size"]
+        # The pages the archived rows were using. Free pages are reused by new rows, VACUUM is what shrinks the file.
+        used_before = space_before["size"] - space_before["free"]
+        report["reclaimed_bytes"] = used_before - (space_after["size"] - space_after["free"])
+    return report
+
+
+async def main(args) -> None:
+    await database.connect()
+    try:
+        report = await archive_posts(
+            args.older_than_days, batch_size=args.batch_size, archive_dir=args.archive_dir, vacuum=args.vacuum
+        )
+    finally:
+        await database.disconnect()
+    for name, value in report.items():
+        print(f"{name:22} {value:,}" if isinstance(value, int) else f"{name:22} {value}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--older-than-days", type=int, default=config.ARCHIVE_AFTER_DAYS)
+    parser.add_argument("--batch-size", type=int, default=1000, help="Posts per transaction")
+    parser.add_argument("--archive-dir", default=config.ARCHIVE_DIR)
+    parser.add_argument("--vacuum", action="store_true", help="Shrink the sqlite file afterwards")
+    args = parser.parse_args()
+    if args.older_than_days is None:
+        parser.error("set --older-than-days or ARCHIVE_AFTER_DAYS")
+    asyncio.run(main(args))
@@ -0,0 +1,75 @@
+"""
+Bytes on the wire and server CPU per request of GET /post for each response encoding,
+and of conditional requests (If-None-Match) that get a 304.
+
+The requests are sent one at a time in-process, so the CPU time per request is the app's
+(plus the small cost of the client, which doesn't decompress: the raw bytes are counted).
+
+Run from the top social_media_fapi directory:
+    python -m social_media_fapi.benchmarks.bench_compression --posts 1000 --requests 200
+"""
+import argparse
+import asyncio
+import time
+
+from social_media_fapi.benchmarks.common import seed_database, setup_environment
+
+setup_environment()
+
+from httpx import ASGITransport, AsyncClient  # noqa: E402
+
+from social_media_fapi.compression import ENCODINGS  # noqa: E402
+from social_media_fapi.database import database  # noqa: E402
+from social_media_fapi.main import app  # noqa: E402
+
+
+async def measure(client: AsyncClient, requests: int, headers: dict) -> dict:
+    wire_bytes = 0
+    status = None
+    cpu_start = time.process_time()
+    start = time.perf_counter()
+    for _ in range(requests):
+        async with client.stream("GET", "/post", headers=headers) as response:
+            wire_bytes += sum([len(chunk) async for chunk in response.aiter_raw()])
+            status = response.status_code
+    elapsed = time.perf_counter() - start
+    cpu = time.process_time() - cpu_start
+    return {
+        "status": status,
+        "bytes": wire_bytes // requests,
+        "cpu_ms": round(cpu / requests * 1000, 3),
+        "rps": round(requests / elapsed, 1),
+    }
+
+
+async def main(args):
+    seed_database(users=args.users, posts=args.posts, comments=0, likes=args.likes)
+    await database.connect()
+
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://bench") as client:
+        results = {"identity": await measure(client, args.requests, {"Accept-Encoding": "identity"})}
+        for encoding in ENCODINGS:
+            results[encoding] = await measure(client, args.requests, {"Accept-Encoding": encoding})
+
+        etag = (await client.get("/post", headers={"Accept-Encoding": "identity"})).headers["etag"]
+        results["304"] = await measure(
+            client, args.requests, {"Accept-Encoding": "identity", "If-None-Match": etag}
+        )
+    await database.disconnect()
+
+    identity = results["identity"]["bytes"]
+    for name, result in results.items():
+        print(
+            f"{name:9} {result['status']}  {result['bytes']:>10,} bytes ({result['bytes'] / identity:6.1%})  "
+            f"{result['cpu_ms']:7.2f}ms CPU/request  {result['rps']:8.1f} requests/sec"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--posts", type=int, default=1000)
+    parser.add_argument("--likes", type=int, default=5000)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,129 @@
+"""
+Fan-out of events to many connected clients.
+
+--transport bus       subscribers are tasks reading straight from the event bus (measures the bus itself)
+--transport websocket subscribers are real WebSocket clients of a uvicorn server on localhost
+
+Run from the top social_media_fapi directory:
+    python -m social_media_fapi.benchmarks.bench_events --clients 10000 --events 20
+    python -m social_media_fapi.benchmarks.bench_events --transport websocket --clients 10000
+
+10k sockets needs a high open files limit (ulimit -n 30000).
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import threading
+import time
+
+from social_media_fapi.benchmarks.common import setup_environment
+
+setup_environment()
+
+from social_media_fapi.events import EventBus, bus, post_topic  # noqa: E402
+
+TOPIC = post_topic(1)
+
+
+def report(latencies: list[float], deliveries: int, elapsed: float, dropped: int) -> None:
+    percentiles = statistics.quantiles(latencies, n=100)
+    print(f"deliveries:        {deliveries:,} ({deliveries / elapsed:,.0f}/sec)")
+    print(f"dropped clients:   {dropped}")
+    print(
+        f"delivery latency:  p50 {percentiles[49] * 1000:.2f}ms  "
+        f"p95 {percentiles[94] * 1000:.2f}ms  p99 {percentiles[98] * 1000:.2f}ms"
+    )
+
+
+async def bench_bus(args) -> None:
+    event_bus = EventBus(buffer_size=args.buffer)
+    latencies = []
+
+    async def client():
+        subscription = event_bus.subscribe(TOPIC)
+        for _ in range(args.events):
+            message = await subscription.get()
+            if message is None:
+                return
+            latencies.append(time.perf_counter() - json.loads(message)["sent_at"])
+
+    clients = [asyncio.create_task(client()) for _ in range(args.clients)]
+    await asyncio.sleep(0)
+
+    start = time.perf_counter()
+    for _ in range(args.events):
+        # The clients work out the latency from the send time in the event.
+        event_bus.publish(TOPIC, {"sent_at": time.perf_counter()})
+        await asyncio.sleep(args.interval)
+    await asyncio.gather(*clients)
+    report(latencies, len(latencies), time.perf_counter() - start, event_bus.dropped)
+
+
+async def bench_websocket(args) -> None:
+    import uvicorn
+    import websockets
+
+    from social_media_fapi.main import app
+
+    server = uvicorn.Server(
+        uvicorn.Config(app, port=args.port, log_level="warning", ws_max_queue=args.buffer)
+    )
+    server_loop = None
+
+    def run_server():
+        async def serve():
+            nonlocal server_loop
+            server_loop = asyncio.get_running_loop()
+            await server.serve()
+
+        asyncio.run(serve())
+
+    thread = threading.Thread(target=run_server)
+    thread.start()
+    while not server.started:
+        await asyncio.sleep(0.05)
+
+    latencies = []
+    connected = 0
+    all_connected = asyncio.Event()
+
+    async def client():
+        nonlocal connected
+        async with websockets.connect(f"ws://127.0.0.1:{args.port}/ws/post/1", max_queue=None) as websocket:
+            connected += 1
+            if connected == args.clients:
+                all_connected.set()
+            for _ in range(args.events):
+                message = await websocket.recv()
+                latencies.append(time.perf_counter() - json.loads(message)["sent_at"])
+
+    clients = [asyncio.create_task(client()) for _ in range(args.clients)]
+    await all_connected.wait()
+    # Wait until every socket has subscribed on the server side.
+    while bus.subscriber_count(TOPIC) < args.clients:
+        await asyncio.sleep(0.05)
+    print(f"{args.clients} clients connected")
+
+    start = time.perf_counter()
+    try:
+        for _ in range(args.events):
+            server_loop.call_soon_threadsafe(bus.publish, TOPIC, {"sent_at": time.perf_counter()})
+            await asyncio.sleep(args.interval)
+        await asyncio.gather(*clients, return_exceptions=True)
+    finally:
+        server.should_exit = True
+        thread.join()
+    report(latencies, len(latencies), time.perf_counter() - start, bus.dropped)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--transport", choices=["bus", "websocket"], default="bus")
+    parser.add_argument("--clients", type=int, default=10000)
+    parser.add_argument("--events", type=int, default=20)
+    parser.add_argument("--interval", type=float, default=0.05, help="Seconds between events")
+    parser.add_argument("--buffer", type=int, default=100, help="Events buffered per client")
+    parser.add_argument("--port", type=int, default=8766)
+    args = parser.parse_args()
+    asyncio.run(bench_bus(args) if args.transport == "bus" else bench_websocket(args))
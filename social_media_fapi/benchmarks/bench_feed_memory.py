@@ -0,0 +1,84 @@
+"""
+Memory and time per row of the GET /post feed, the way it was built before and the way it is now:
+
+    records  fetch_all gives a Record per row, each becomes a UserPostWithLikes (from_attributes),
+             then a dict, and JSONResponse encodes the list of dicts.
+    tuples   fetch_tuples gives the driver's tuples, and RowEncoder writes the JSON straight from them.
+
+tracemalloc counts the bytes allocated at the peak (everything alive at once) while building the
+response body, per row. Both give the same JSON, which is checked first.
+
+Run from the top social_media_fapi directory:
+    python -m social_media_fapi.benchmarks.bench_feed_memory --posts 10000
+"""
+import argparse
+import asyncio
+import json
+import time
+import tracemalloc
+
+from social_media_fapi.benchmarks.common import seed_database, setup_environment
+
+setup_environment()
+
+import sqlalchemy  # noqa: E402
+from fastapi.responses import JSONResponse  # noqa: E402
+from pydantic import TypeAdapter  # noqa: E402
+
+from social_media_fapi.database import database, post_table  # noqa: E402
+from social_media_fapi.models.post import UserPostWithLikes  # noqa: E402
+from social_media_fapi.routers.post import feed_encoder, select_feed, select_post_and_likes  # noqa: E402
+
+feed_adapter = TypeAdapter(list[UserPostWithLikes])
+
+
+async def records_body() -> bytes:
+    records = await database.fetch_all(select_post_and_likes.order_by(post_table.c.id.desc()))
+    posts = feed_adapter.validate_python(records, from_attributes=True)
+    return JSONResponse(feed_adapter.dump_python(posts, mode="json")).body
+
+
+async def tuples_body() -> bytes:
+    rows = await database.fetch_tuples(select_feed.order_by(post_table.c.id.desc()))
+    return feed_encoder.encode(rows)
+
+
+async def measure(build, rows: int, repeat: int) -> dict:
+    tracemalloc.start()
+    await build()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        await build()
+    elapsed = (time.perf_counter() - start) / repeat
+    return {"peak_bytes_per_row": peak // rows, "ms": round(elapsed * 1000, 1)}
+
+
+async def main(args):
+    seed_database(users=args.users, posts=args.posts, comments=0, likes=args.likes)
+    await database.connect()
+    rows = await database.fetch_val(sqlalchemy.select(sqlalchemy.func.count()).select_from(post_table))
+
+    assert json.loads(await records_body()) == json.loads(await tuples_body()), "The two ways give different JSON"
+    results = {
+        "records": await measure(records_body, rows, args.repeat),
+        "tuples": await measure(tuples_body, rows, args.repeat),
+    }
+    await database.disconnect()
+
+    print(f"{rows:,} rows")
+    for name, result in results.items():
+        print(f"{name:8} {result['peak_bytes_per_row']:>8,} bytes/row at peak  {result['ms']:8.1f}ms per response")
+    saved = 1 - results["tuples"]["peak_bytes_per_row"] / results["records"]["peak_bytes_per_row"]
+    print(f"tuples use {saved:.0%} less memory at peak")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--posts", type=int, default=10000)
+    parser.add_argument("--likes", type=int, default=20000)
+    parser.add_argument("--repeat", type=int, default=5, help="Responses timed per way")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,47 @@
+"""
+Tokens verified per second: jose.jwt.decode (what security.py used to call on every request)
+against JWTKeys.decode with the keys parsed once.
+
+Run from the top social_media_fapi directory:
+    python -m social_media_fapi.benchmarks.bench_jwt --tokens 20000
+"""
+import argparse
+import tempfile
+import time
+
+from jose import jwt
+
+from social_media_fapi.jwt_keys import JWTKeys, generate_key
+
+
+def per_second(function, tokens: list[str]) -> float:
+    start = time.perf_counter()
+    for token in tokens:
+        function(token)
+    return len(tokens) / (time.perf_counter() - start)
+
+
+def bench(name: str, keys: JWTKeys, jose_key, count: int) -> None:
+    claims = {"sub": "user@example.com", "type": "access", "exp": time.time() + 3600}
+    # Different tokens (different jti), like real traffic.
+    tokens = [keys.encode({**claims, "jti": str(i)}) for i in range(count)]
+    algorithms = [keys.algorithm]
+
+    jose_rate = per_second(lambda token: jwt.decode(token, jose_key, algorithms=algorithms), tokens)
+    keys_rate = per_second(keys.decode, tokens)
+    print(f"{name:6} jose.jwt.decode {jose_rate:10,.0f}/sec   JWTKeys.decode {keys_rate:10,.0f}/sec   x{keys_rate / jose_rate:.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tokens", type=int, default=20000)
+    args = parser.parse_args()
+
+    bench("HS256", JWTKeys("HS256", secret_key="benchmark-secret"), "benchmark-secret", args.tokens)
+
+    with tempfile.TemporaryDirectory() as keys_dir:
+        generate_key(keys_dir, "bench")
+        keys = JWTKeys("ES256", keys_dir=keys_dir, active_kid="bench")
+        public_jwk = keys.jwks()["keys"][0]
+        # ES256 is much slower to verify, so fewer tokens.
+        bench("ES256", keys, public_jwk, args.tokens // 20)
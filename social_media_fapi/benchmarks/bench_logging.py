@@ -0,0 +1,49 @@
+"""
+Requests/sec of GET /post with logging switched off and on.
+
+Run from the top social_media_fapi directory:
+    python -m social_media_fapi.benchmarks.bench_logging --requests 2000 --concurrency 20
+"""
+import argparse
+import asyncio
+import logging
+
+from social_media_fapi.benchmarks.common import run_requests, seed_database, setup_environment
+
+setup_environment()
+
+from httpx import ASGITransport, AsyncClient  # noqa: E402
+
+from social_media_fapi.database import database  # noqa: E402
+from social_media_fapi.logging_conf import configure_logging, stop_logging  # noqa: E402
+from social_media_fapi.main import app  # noqa: E402
+
+
+async def main(args):
+    seed_database(users=1, posts=args.posts, comments=0, likes=0)
+    await database.connect()
+
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://bench") as client:
+        logging.disable(logging.CRITICAL)
+        off = await run_requests(client, "GET", "/post", args.requests, args.concurrency)
+        logging.disable(logging.NOTSET)
+
+        configure_logging()
+        logging.getLogger("social_media_fapi").setLevel(args.level)
+        on = await run_requests(client, "GET", "/post", args.requests, args.concurrency)
+        stop_logging()
+
+    await database.disconnect()
+
+    print(f"logging off: {off['rps']:8.1f} requests/sec")
+    print(f"logging on ({args.level}): {on['rps']:8.1f} requests/sec")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--posts", type=int, default=50)
+    parser.add_argument("--level", default="DEBUG")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,109 @@
+"""
+Registrations per second with the confirmation email going to the stand-in mail server (mail_sink.py),
+for each mail transport and each --latency of mail delivery.
+
+    mailgun  the HTTP API (a new connection for every email), at a local mail_sink HTTP server
+    smtp     pooled SMTP connections (SMTP_POOL_SIZE) to a local mail_sink SMTP server
+
+The requests go to the app in-process, and httpx's ASGITransport waits for the background tasks
+before returning the response. So the times are for the registration and its email together,
+which is the time a worker is busy with it.
+
+Run from the top social_media_fapi directory:
+    python -m social_media_fapi.benchmarks.bench_registration --registrations 200 --latency 0 0.1 0.5
+"""
+import argparse
+import asyncio
+import socket
+import statistics
+import time
+
+from social_media_fapi.benchmarks.common import seed_database, setup_environment
+
+setup_environment()
+
+import uvicorn  # noqa: E402
+from httpx import ASGITransport, AsyncClient  # noqa: E402
+
+from social_media_fapi import mail  # noqa: E402
+from social_media_fapi.config import config  # noqa: E402
+from social_media_fapi.database import database  # noqa: E402
+from social_media_fapi.mail_sink import MailSink  # noqa: E402
+from social_media_fapi.main import app  # noqa: E402
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+async def register_users(client: AsyncClient, start: int, total: int, concurrency: int) -> dict:
+    numbers = iter(range(start, start + total))
+    latencies = []
+
+    async def worker():
+        for number in numbers:
+            request_start = time.perf_counter()
+            response = await client.post("/register", json={"email": f"new{number}@example.com", "password": "1234"})
+            latencies.append(time.perf_counter() - request_start)
+            response.raise_for_status()
+
+    start_time = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start_time
+    percentiles = statistics.quantiles(latencies, n=100)
+    return {
+        "rps": round(total / elapsed, 1),
+        "p50_ms": round(percentiles[49] * 1000, 1),
+        "p95_ms": round(percentiles[94] * 1000, 1),
+    }
+
+
+async def main(args):
+    seed_database(users=1, posts=0, comments=0, likes=0)
+    await database.connect()
+
+    sink = MailSink()
+    smtp_server = await sink.start_smtp(port=0)
+    http_port = free_port()
+    http_server = uvicorn.Server(uvicorn.Config(sink.http_app(), port=http_port, log_level="warning"))
+    http_task = asyncio.create_task(http_server.serve())
+    while not http_server.started:
+        await asyncio.sleep(0.01)
+
+    config.MAILGUN_BASE_URL = f"http://127.0.0.1:{http_port}/v3"
+    config.MAILGUN_DOMAIN = "example.com"
+    config.MAILGUN_API_KEY = "bench"  # The sink doesn't check it.
+    config.SMTP_HOST = "127.0.0.1"
+    config.SMTP_PORT = smtp_server.sockets[0].getsockname()[1]
+    config.SMTP_STARTTLS = False
+
+    registered = 0
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://bench") as client:
+        for latency in args.latency:
+            sink.latency = latency
+            for transport in ("mailgun", "smtp"):
+                config.MAIL_TRANSPORT = transport
+                mail.smtp_pool.cache_clear()
+                result = await register_users(client, registered, args.registrations, args.concurrency)
+                registered += args.registrations
+                print(
+                    f"latency {latency:5.2f}s  {transport:8} {result['rps']:8.1f} registrations/sec  "
+                    f"p50 {result['p50_ms']:8.1f}ms  p95 {result['p95_ms']:8.1f}ms"
+                )
+                await mail.smtp_pool().close()
+
+    print(dict(sink.counts))
+    http_server.should_exit = True
+    await http_task
+    smtp_server.close()
+    await database.disconnect()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--registrations", type=int, default=200, help="Per transport and latency")
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--latency", type=float, nargs="+", default=[0.0, 0.1, 0.5])
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,153 @@
+"""
+Throughput and latency of the main routes: GET /post, POST /post, POST /token and POST /upload.
+
+The app can be driven in-process (httpx ASGITransport, no network) or through a real
+uvicorn server on localhost. Each run is saved as JSON in the results directory and
+compared with the previous run, exiting with status 1 if a route regressed.
+
+Run from the top social_media_fapi directory:
+    python -m social_media_fapi.benchmarks.bench_routes --mode inprocess --posts 10000 --likes 50000
+    python -m social_media_fapi.benchmarks.bench_routes --mode uvicorn --concurrency 50
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import pathlib
+import sys
+import threading
+
+from social_media_fapi.benchmarks.common import (
+    BENCH_EMAIL,
+    BENCH_PASSWORD,
+    run_requests,
+    seed_database,
+    setup_environment,
+)
+
+setup_environment()
+
+import uvicorn  # noqa: E402
+from httpx import ASGITransport, AsyncClient  # noqa: E402
+
+from social_media_fapi.database import database  # noqa: E402
+from social_media_fapi.main import app  # noqa: E402
+from social_media_fapi.routers import upload  # noqa: E402
+
+
+async def fake_b2_upload_file(local_file: str, file_name: str, **kwargs) -> str:
+    # Stand-in for B2 so we measure our upload handling and not the network to Backblaze.
+    return f"https://example.com/{file_name}"
+
+
+async def benchmark_routes(client: AsyncClient, args) -> dict:
+    response = await client.post("/token", json={"email": BENCH_EMAIL, "password": BENCH_PASSWORD})
+    response.raise_for_status()
+    headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+    # A PNG signature first, POST /upload turns away files it doesn't recognise.
+    upload_bytes = b"\x89PNG\r\n\x1a\n" + b"\0" * max(args.upload_size - 8, 0)
+
+    routes = {
+        "GET /post": ("GET", "/post", {}),
+        "POST /post": ("POST", "/post", {"json": {"body": "Benchmark post"}, "headers": headers}),
+        "POST /token": ("POST", "/token", {"json": {"email": BENCH_EMAIL, "password": BENCH_PASSWORD}}),
+        "POST /upload": ("POST", "/upload", {"files": {"file": ("bench.png", upload_bytes)}, "headers": headers}),
+    }
+
+    results = {}
+    for name in args.routes:
+        method, url, kwargs = routes[name]
+        results[name] = await run_requests(client, method, url, args.requests, args.concurrency, **kwargs)
+        print(f"{name:14} {results[name]}")
+    return results
+
+
+async def run_in_process(args) -> dict:
+    await database.connect()
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://bench") as client:
+        results = await benchmark_routes(client, args)
+    await database.disconnect()
+    return results
+
+
+async def run_uvicorn(args) -> dict:
+    # The server runs its own event loop in a thread, so the clients and the app don't compete for one loop.
+    server = uvicorn.Server(
+        uvicorn.Config(app, host="127.0.0.1", port=args.port, log_level="warning", access_log=False)
+    )
+    thread = threading.Thread(target=server.run)
+    thread.start()
+    while not server.started:
+        await asyncio.sleep(0.05)
+
+    try:
+        async with AsyncClient(base_url=f"http://127.0.0.1:{args.port}", timeout=60) as client:
+            return await benchmark_routes(client, args)
+    finally:
+        server.should_exit = True
+        thread.join()
+
+
+def compare(previous: dict, current: dict, max_regression: float) -> bool:
+    """Print the change per route and return False if any route got worse than max_regression."""
+    ok = True
+    for name, result in current["routes"].items():
+        before = previous["routes"].get(name)
+        if not before:
+            continue
+        rps_change = result["rps"] / before["rps"] - 1
+        p95_change = result["p95_ms"] / before["p95_ms"] - 1 if before["p95_ms"] else 0
+        regressed = rps_change < -max_regression or p95_change > max_regression
+        ok = ok and not regressed
+        print(
+            f"{name:14} rps {rps_change:+7.1%}  p95 {p95_change:+7.1%}"
+            + ("  REGRESSION" if regressed else "")
+        )
+    return ok
+
+
+def main(args) -> int:
+    print(f"Seeding {args.users} users, {args.posts} posts, {args.comments} comments, {args.likes} likes")
+    seed_database(args.users, args.posts, args.comments, args.likes)
+    upload.b2_upload_file = fake_b2_upload_file
+
+    runner = run_uvicorn if args.mode == "uvicorn" else run_in_process
+    current = {
+        "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "mode": args.mode,
+        "concurrency": args.concurrency,
+        "seed": {"users": args.users, "posts": args.posts, "comments": args.comments, "likes": args.likes},
+        "routes": asyncio.run(runner(args)),
+    }
+
+    results_dir = pathlib.Path(args.results_dir)
+    results_dir.mkdir(parents=True, exist_ok=True)
+    previous_runs = sorted(results_dir.glob(f"{args.mode}-*.json"))
+    result_file = results_dir / f"{args.mode}-{current['timestamp'].replace(':', '')}.json"
+    result_file.write_text(json.dumps(current, indent=2))
+    print(f"Saved results to {result_file}")
+
+    baseline = pathlib.Path(args.compare) if args.compare else (previous_runs[-1] if previous_runs else None)
+    if baseline is None:
+        return 0
+    print(f"Compared with {baseline}")
+    return 0 if compare(json.loads(baseline.read_text()), current, args.max_regression) else 1
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mode", choices=["inprocess", "uvicorn"], default="inprocess")
+    parser.add_argument("--routes", nargs="+", default=["GET /post", "POST /post", "POST /token", "POST /upload"])
+    parser.add_argument("--requests", type=int, default=500, help="Requests per route")
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--posts", type=int, default=1000)
+    parser.add_argument("--comments", type=int, default=2000)
+    parser.add_argument("--likes", type=int, default=5000)
+    parser.add_argument("--upload-size", type=int, default=64 * 1024, help="Bytes per uploaded file")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--results-dir", default="benchmark_results")
+    parser.add_argument("--compare", help="Result file to compare with, defaults to the previous run")
+    parser.add_argument("--max-regression", type=float, default=0.10, help="Allowed change, 0.10 is 10%%")
+    sys.exit(main(parser.parse_args()))
@@ -0,0 +1,63 @@
+"""
+Shared helpers for the benchmark scripts.
+
+The benchmarks run against their own sqlite database (not the test one) so the numbers
+are not affected by force_rollback. Call setup_environment() BEFORE importing anything
+from social_media_fapi, as the config is read when the modules are first imported.
+"""
+import asyncio
+import os
+import statistics
+import time
+
+BENCH_EMAIL = "user1@example.com"
+BENCH_PASSWORD = "bench-password"
+
+
+def setup_environment(database_file: str = "bench.db") -> None:
+    os.environ["ENV_STATE"] = "test"
+    os.environ["TEST_DATABASE_URL"] = f"sqlite:///{database_file}"
+    os.environ["TEST_DB_FORCE_ROLL_BACK"] = "false"
+    os.environ.setdefault("TEST_SECRET_KEY", "benchmark-secret")
+    os.environ.setdefault("TEST_ALGORITHM", "HS256")
+
+
+def seed_database(users: int, posts: int, comments: int, likes: int) -> None:
+    """
+    Empty the benchmark database and fill it with skewed synthetic data (see social_media_fapi.seed).
+    Every user is confirmed and has BENCH_PASSWORD, so BENCH_EMAIL can log in.
+    """
+    from social_media_fapi.database import engine
+    from social_media_fapi.seed import seed
+
+    seed(engine, users, posts, comments, likes, password=BENCH_PASSWORD, random_seed=0, show_progress=False)
+
+
+async def run_requests(client, method: str, url: str, total: int, concurrency: int, **kwargs) -> dict:
+    """
+    Send `total` requests using `concurrency` clients.
+    Returns the requests per second and the p50/p95/p99 latencies in milliseconds.
+    """
+    remaining = iter(range(total))
+    latencies = []
+
+    async def worker():
+        for _ in remaining:
+            start = time.perf_counter()
+            response = await client.request(method, url, **kwargs)
+            latencies.append(time.perf_counter() - start)
+            response.raise_for_status()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+
+    # quantiles(n=100) gives the 1st to 99th percentiles.
+    percentiles = statistics.quantiles(latencies, n=100) if len(latencies) > 1 else latencies * 99
+    return {
+        "requests": total,
+        "rps": round(total / elapsed, 1),
+        "p50_ms": round(percentiles[49] * 1000, 2),
+        "p95_ms": round(percentiles[94] * 1000, 2),
+        "p99_ms": round(percentiles[98] * 1000, 2),
+    }
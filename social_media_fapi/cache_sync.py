@@ -0,0 +1,88 @@
+"""
+Keep the in-process caches (lru_cache etc.) of all the workers consistent.
+
+Every worker is its own process with its own caches, so clearing a cache in one worker does nothing
+for the others. Instead a generation number is kept in a small file (CACHE_SYNC_FILE) shared by
+the workers on the machine. Bumping it makes every worker run the registered cache clearing callbacks
+on its next check.
+
+The first thing a worker does then is reload its config (see config.reload_config), so after an edit
+of the .env file the caches are rebuilt with the new settings, without a restart.
+
+To reload the config and invalidate the caches of all the running workers:
+    python -m social_media_fapi.cache_sync
+"""
+import asyncio
+import logging
+import os
+import pathlib
+from typing import Callable
+
+from social_media_fapi.config import config, reload_config
+
+logger = logging.getLogger(__name__)
+
+_callbacks: list[Callable[[], None]] = []
+
+
+def register(callback: Callable[[], None]) -> Callable[[], None]:
+    """Register a function (e.g. some_cached_function.cache_clear) to call when the caches are invalidated."""
+    _callbacks.append(callback)
+    return callback
+
+
+# First, so the callbacks registered after it rebuild their caches with the new settings.
+register(reload_config)
+
+
+def invalidate_local() -> None:
+    for callback in _callbacks:
+        try:
+            callback()
+        except Exception:
+            logger.exception("Cache invalidation callback %s failed", callback)
+
+
+def read_generation(path: pathlib.Path) -> int:
+    try:
+        return int(path.read_text() or 0)
+    except (FileNotFoundError, ValueError):
+        return 0
+
+
+def bump(path: str | None = None) -> int:
+    """Increase the generation, so every worker clears its caches."""
+    path = pathlib.Path(path or config.CACHE_SYNC_FILE)
+    generation = read_generation(path) + 1
+    # Write to a temporary file then rename, so a worker never reads a half written number.
+    temp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    temp_path.write_text(str(generation))
+    os.replace(temp_path, path)
+    return generation
+
+
+async def watch(path: str | None = None, interval: float | None = None) -> None:
+    """Runs for the life of the worker (see main.lifespan), clearing the caches when the generation changes."""
+    path = pathlib.Path(path or config.CACHE_SYNC_FILE)
+    interval = interval or config.CACHE_SYNC_INTERVAL
+    generation = read_generation(path)
+    last_mtime = None
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            mtime = path.stat().st_mtime_ns
+        except FileNotFoundError:
+            continue
+        # Checking the modified time first means we only read the file when it has changed.
+        if mtime == last_mtime:
+            continue
+        last_mtime = mtime
+        new_generation = read_generation(path)
+        if new_generation != generation:
+            logger.info("Cache generation changed to %s, clearing caches", new_generation)
+            generation = new_generation
+            invalidate_local()
+
+
+if __name__ == "__main__":
+    print(f"Cache generation is now {bump()}")
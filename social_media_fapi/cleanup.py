@@ -0,0 +1,127 @@
+"""
+Removes what belonged to deleted posts: their comments, likes and image. And direct uploads that
+weren't completed in time, see direct_uploads.py
+
+DELETE /post/{id} only sets deleted_at, so the request stays fast however popular the post was.
+This runs in the background (see main.lifespan) and deletes the rows in chunks of CLEANUP_BATCH_SIZE,
+each in its own short transaction, so it never holds a write lock for long.
+"""
+import asyncio
+import logging
+import time
+from collections import Counter
+
+import sqlalchemy
+
+from social_media_fapi.config import config
+from social_media_fapi.database import (
+    comment_table,
+    database,
+    generated_image_table,
+    like_table,
+    post_archive_index_table,
+    post_table,
+    user_stats_table,
+)
+from social_media_fapi.direct_uploads import delete_expired_uploads
+from social_media_fapi.post_media import delete_stored
+from social_media_fapi.stats import increment
+
+logger = logging.getLogger(__name__)
+
+
+async def delete_in_batches(table: sqlalchemy.Table, post_id: int, count_column: str, batch_size: int) -> int:
+    """Deletes the post's rows from table, taking them off the authors' user_stats. Returns the rows deleted."""
+    deleted = 0
+    while True:
+        chunk = sqlalchemy.select(table.c.id).where(table.c.post_id == post_id).limit(batch_size)
+        if table is comment_table:
+            # Deepest first, so a reply never outlives the comment it replies to.
+            chunk = chunk.order_by(comment_table.c.depth.desc())
+        async with database.transaction():
+            # RETURNING gives us the rows this statement deleted, so if two workers clean the
+            # same post the counts still only go down once.
+            rows = await database.fetch_all(
+                table.delete().where(table.c.id.in_(chunk.scalar_subquery())).returning(table.c.user_id)
+            )
+            for user_id, count in Counter(row.user_id for row in rows).items():
+                await database.execute(increment(user_stats_table, user_id, **{count_column: -count}))
+        deleted += len(rows)
+        if len(rows) < batch_size:
+            return deleted
+        # Let the requests waiting on the database in between chunks.
+        await asyncio.sleep(0)
+
+
+async def image_in_use(post) -> bool:
+    """
+    Whether another post (archived ones too), or the cache of generated images, still has the post's image.
+    Posts with the same prompt share one generated image, see image_generation.py
+    """
+    other_post = sqlalchemy.select(post_table.c.id).where(
+        post_table.c.image_url == post.image_url, post_table.c.id != post.id, post_table.c.purged_at.is_(None)
+    )
+    if await database.fetch_one(other_post.limit(1)):
+        return True
+    archived_post = sqlalchemy.select(post_archive_index_table.c.post_id).where(
+        post_archive_index_table.c.image_url == post.image_url
+    )
+    if await database.fetch_one(archived_post.limit(1)):
+        return True
+    cached = await database.fetch_one(
+        generated_image_table.select().where(generated_image_table.c.image_url == post.image_url)
+    )
+    if cached and cached.created_at > time.time() - config.IMAGE_CACHE_TTL:
+        return True
+    if cached:
+        # Expired, nothing will hand this image out again.
+        await database.execute(
+            generated_image_table.delete().where(generated_image_table.c.prompt_key == cached.prompt_key)
+        )
+    return False
+
+
+async def purge_post(post, batch_size: int) -> None:
+    comments = await delete_in_batches(comment_table, post.id, "comment_count", batch_size)
+    likes = await delete_in_batches(like_table, post.id, "like_count", batch_size)
+    if post.image_url and not await image_in_use(post):
+        # If this fails the post isn't marked purged, so it's tried again on the next run.
+        await delete_stored(post.image_url)
+    if post.thumbnail_url:
+        # Only posts with their own media have one, it's never shared.
+        await delete_stored(post.thumbnail_url)
+    await database.execute(
+        post_table.update()
+        .where(post_table.c.id == post.id)
+        .values(purged_at=int(time.time()), body=None, image_url=None, thumbnail_url=None)
+    )
+    logger.info("Purged post %s: %s comments, %s likes", post.id, comments, likes)
+
+
+async def purge_deleted_posts(batch_size: int, max_posts: int = 100) -> int:
+    """Cleans up to max_posts deleted posts, returns how many were done."""
+    query = (
+        post_table.select()
+        .where(post_table.c.deleted_at.is_not(None), post_table.c.purged_at.is_(None))
+        .order_by(post_table.c.deleted_at)
+        .limit(max_posts)
+    )
+    purged = 0
+    for post in await database.fetch_all(query):
+        try:
+            await purge_post(post, batch_size)
+            purged += 1
+        except Exception:
+            logger.exception("Could not purge post %s", post.id)
+    return purged
+
+
+async def watch_cleanup(interval: float, batch_size: int):
+    # Runs for the life of the worker (see main.lifespan).
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await purge_deleted_posts(batch_size)
+            await delete_expired_uploads()
+        except Exception:
+            logger.exception("Could not clean up deleted posts")
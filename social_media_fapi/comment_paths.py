@@ -0,0 +1,25 @@
+"""
+Materialized paths for comment threads.
+
+Every comment stores the ids of its ancestors and itself, zero padded so they sort as strings:
+    0000000001/                        a comment on the post
+    0000000001/0000000004/             a reply to it
+    0000000001/0000000004/0000000009/  a reply to the reply
+
+Ordering a post's comments by path gives the threads depth first, oldest reply first. A whole
+subtree is a range of paths, so with the (post_id, path) index it's one index range scan.
+"""
+SEGMENT_WIDTH = 10
+SEPARATOR = "/"
+
+
+def comment_path(comment_id: int, parent_path: str = "") -> str:
+    return f"{parent_path}{comment_id:0{SEGMENT_WIDTH}d}{SEPARATOR}"
+
+
+def subtree_bounds(path: str) -> tuple[str, str]:
+    """
+    The (lower, upper) paths of the comment's replies, all of them at any depth: lower < path < upper.
+    "0" is the character after "/", so no path starting with this prefix sorts past the upper bound.
+    """
+    return path, path[:-1] + chr(ord(SEPARATOR) + 1)
@@ -0,0 +1,232 @@
+"""
+Compresses responses with the best encoding the client accepts: zstd, br (brotli) or gzip.
+
+zstd and brotli are only offered when the zstandard / brotli packages are installed, gzip always is.
+Responses smaller than minimum_size, already encoded, or of a type that doesn't compress (images,
+zips) go out as they are. The level depends on the content type, see LEVELS. Streamed responses are
+compressed chunk by chunk and flushed after each chunk, so the client isn't kept waiting.
+
+A compressed response is a different representation, so a strong ETag gets the encoding added
+("abc" becomes "abc-gzip"), and the suffix is taken off again in If-None-Match before the request
+reaches the app. The routes only ever see their own ETags.
+"""
+import re
+import zlib
+from typing import Optional
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover
+    zstandard = None
+
+# In order of preference when the client accepts several equally.
+ENCODINGS = [name for name, module in (("zstd", zstandard), ("br", brotli), ("gzip", zlib)) if module]
+
+# Compression level per content type (the longest matching prefix wins). The API responses are made
+# per request, so the levels are the fast end of each range, not the smallest output.
+LEVELS = {
+    "application/json": {"zstd": 3, "br": 4, "gzip": 6},
+    "application/x-ndjson": {"zstd": 1, "br": 1, "gzip": 1},
+    "text/": {"zstd": 3, "br": 5, "gzip": 6},
+    "image/svg+xml": {"zstd": 9, "br": 9, "gzip": 9},
+}
+
+# Streaming responses that must not be held back by a compressor (server-sent events).
+NOT_COMPRESSED = ("text/event-stream",)
+
+
+class GzipCompressor:
+    def __init__(self, level: int) -> None:
+        # wbits 31 is the gzip container, not raw zlib.
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.compress(data) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        return self._compressor.flush(zlib.Z_FINISH)
+
+
+class BrotliCompressor:
+    def __init__(self, level: int) -> None:
+        self._compressor = brotli.Compressor(quality=level)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.process(data) + self._compressor.flush()
+
+    def finish(self) -> bytes:
+        return self._compressor.finish()
+
+
+class ZstdCompressor:
+    def __init__(self, level: int) -> None:
+        self._compressor = zstandard.ZstdCompressor(level=level).compressobj()
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.compress(data) + self._compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+    def finish(self) -> bytes:
+        return self._compressor.flush()
+
+
+COMPRESSORS = {"gzip": GzipCompressor, "br": BrotliCompressor, "zstd": ZstdCompressor}
+
+
+def compress(data: bytes, encoding: str, level: int) -> bytes:
+    """Compresses a whole body in one go."""
+    if encoding == "gzip":
+        return zlib.compress(data, level, wbits=31)
+    if encoding == "br":
+        return brotli.compress(data, quality=level)
+    return zstandard.ZstdCompressor(level=level).compress(data)
+
+
+def negotiate(accept_encoding: str, available: list[str] = ENCODINGS) -> Optional[str]:
+    """The encoding to use for an Accept-Encoding header, None for no compression."""
+    weights = {}
+    for part in accept_encoding.lower().split(","):
+        name, _, params = part.strip().partition(";")
+        match = re.search(r"q=([0-9.]+)", params)
+        try:
+            weights[name.strip()] = float(match.group(1)) if match else 1.0
+        except ValueError:
+            continue
+    best = None
+    for encoding in available:
+        weight = weights.get(encoding, weights.get("*", 0.0))
+        # available is in order of preference, so only a higher weight beats an earlier encoding.
+        if weight > 0 and (best is None or weight > best[1]):
+            best = (encoding, weight)
+    return best[0] if best else None
+
+
+def levels_for(content_type: str) -> Optional[dict]:
+    content_type = content_type.split(";")[0].strip().lower()
+    if content_type in NOT_COMPRESSED:
+        return None
+    matches = [prefix for prefix in LEVELS if content_type.startswith(prefix)]
+    return LEVELS[max(matches, key=len)] if matches else None
+
+
+ETAG_SUFFIX = re.compile(r'-(%s)"' % "|".join(COMPRESSORS))
+
+
+def add_etag_suffix(headers: MutableHeaders, encoding: str) -> None:
+    etag = headers.get("etag")
+    if etag and not etag.startswith("W/") and etag.endswith('"'):
+        headers["ETag"] = f'{etag[:-1]}-{encoding}"'
+
+
+def strip_etag_suffixes(scope: Scope) -> tuple[Scope, Optional[str]]:
+    """Takes our encoding suffixes off the ETags in If-None-Match, returns the new scope and the suffix."""
+    value = Headers(scope=scope).get("if-none-match")
+    match = value and ETAG_SUFFIX.search(value)
+    if not match:
+        return scope, None
+    headers = [(name, value) for name, value in scope["headers"] if name != b"if-none-match"]
+    headers.append((b"if-none-match", ETAG_SUFFIX.sub('"', value).encode("latin-1")))
+    return {**scope, "headers": headers}, match.group(1)
+
+
+class CompressionMiddleware:
+    def __init__(self, app: ASGIApp, minimum_size: int = 1000) -> None:
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        encoding = negotiate(Headers(scope=scope).get("accept-encoding", ""))
+        # Give the app back its own ETags, see the module docstring.
+        scope, etag_encoding = strip_etag_suffixes(scope)
+        responder = CompressionResponder(self.app, encoding, etag_encoding, self.minimum_size)
+        await responder(scope, receive, send)
+
+
+class CompressionResponder:
+    def __init__(
+        self, app: ASGIApp, encoding: Optional[str], etag_encoding: Optional[str], minimum_size: int
+    ) -> None:
+        self.app = app
+        self.encoding = encoding
+        self.etag_encoding = etag_encoding
+        self.minimum_size = minimum_size
+        self.send: Send = None
+        self.start_message: Message = None
+        self.compressor = None
+        self.passthrough = False
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        self.send = send
+        await self.app(scope, receive, self.send_wrapper)
+
+    async def send_wrapper(self, message: Message) -> None:
+        if message["type"] == "http.response.start":
+            # Hold on to it until we see the first part of the body and know whether to compress.
+            self.start_message = message
+            return
+        if message["type"] != "http.response.body":
+            await self.send(message)
+            return
+
+        if self.compressor:
+            await self.send_streaming(message)
+            return
+        if self.passthrough:
+            await self.send(message)
+            return
+
+        headers = MutableHeaders(scope=self.start_message)
+        levels = levels_for(headers.get("content-type", ""))
+        if levels:
+            headers.add_vary_header("Accept-Encoding")
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+
+        if (
+            self.encoding is None
+            or levels is None
+            or self.start_message["status"] < 200
+            or self.start_message["status"] in (204, 304)
+            or "content-encoding" in headers
+            or (not more_body and len(body) < self.minimum_size)
+        ):
+            self.passthrough = True
+            if self.start_message["status"] == 304 and self.etag_encoding:
+                # Not modified: the ETag has to be the one the client has, which was of a compressed response.
+                add_etag_suffix(headers, self.etag_encoding)
+            await self.send(self.start_message)
+            await self.send(message)
+            return
+
+        level = levels[self.encoding]
+        headers["Content-Encoding"] = self.encoding
+        add_etag_suffix(headers, self.encoding)
+        if not more_body:
+            body = compress(body, self.encoding, level)
+            headers["Content-Length"] = str(len(body))
+            await self.send(self.start_message)
+            await self.send({"type": "http.response.body", "body": body})
+            return
+
+        # The size isn't known up front, so the response is sent chunked.
+        del headers["Content-Length"]
+        self.compressor = COMPRESSORS[self.encoding](level)
+        await self.send(self.start_message)
+        await self.send_streaming(message)
+
+    async def send_streaming(self, message: Message) -> None:
+        body = self.compressor.compress(message.get("body", b""))
+        if not message.get("more_body", False):
+            body += self.compressor.finish()
+        await self.send({**message, "body": body})
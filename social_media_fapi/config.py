@@ -1,8 +1,11 @@
+import logging
 from functools import lru_cache  # lru - least recently used cache
-from typing import Optional
+from typing import Any, Callable, Optional
 
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
+logger = logging.getLogger(__name__)
+
 
 class BaseConfig(BaseSettings):
     ENV_STATE: Optional[str] = None
@@ -22,7 +25,98 @@ class GlobalConfig(BaseConfig):
     B2_KEY_ID: Optional[str] = None
     B2_APPLICATION_KEY: Optional[str] = None
     B2_BUCKET_NAME: Optional[str] = None
+    # Threads for B2 calls (uploads mostly), and how often to authorise again. Tokens last 24 hours.
+    B2_UPLOAD_THREADS: int = 4
+    B2_AUTH_REFRESH_INTERVAL: int = 12 * 60 * 60
+    # Seconds a client has to upload a file straight to storage and complete it, see direct_uploads.py
+    UPLOAD_AUTHORIZATION_TTL: int = 15 * 60
+    # POST /upload turns away bigger files (413), and types it doesn't recognise by their first bytes (415).
+    UPLOAD_MAX_BYTES: int = 20 * 1024 * 1024
+    UPLOAD_ALLOWED_TYPES: list[str] = ["image/png", "image/jpeg", "image/gif", "image/webp", "video/mp4"]
+    # Longest side of the thumbnails of images sent with a post, made when Pillow is installed.
+    THUMBNAIL_SIZE: int = 320
     DEEPAI_API_KEY: Optional[str] = None
+    LOG_QUEUE_SIZE: int = 10000
+    # Level of our own loggers, None is DEBUG in dev and INFO otherwise.
+    LOG_LEVEL: Optional[str] = None
+    # When more than LOG_SAMPLE_HIGH_WATER records are waiting, only LOG_SAMPLE_RATE of DEBUG/INFO logs are kept.
+    LOG_SAMPLE_RATE: float = 1.0
+    LOG_SAMPLE_HIGH_WATER: int = 1000
+    # Queries slower than this are written to slow_queries.log with their EXPLAIN plan. None turns it off.
+    SLOW_QUERY_MS: Optional[float] = 200
+    SLOW_QUERY_EXPLAIN: bool = True
+    # Used by serve.py, WEB_CONCURRENCY is the number of worker processes (None means one per CPU).
+    HOST: str = "127.0.0.1"
+    PORT: int = 8000
+    WEB_CONCURRENCY: Optional[int] = None
+    UVICORN_LOOP: str = "uvloop"
+    UVICORN_HTTP: str = "httptools"
+    UVICORN_BACKLOG: int = 2048
+    UVICORN_LIMIT_CONCURRENCY: Optional[int] = None
+    UVICORN_LIMIT_MAX_REQUESTS: Optional[int] = None
+    UVICORN_TIMEOUT_KEEP_ALIVE: int = 5
+    UVICORN_TIMEOUT_GRACEFUL_SHUTDOWN: Optional[int] = 30
+    UVICORN_ACCESS_LOG: bool = False
+    # The workers check this file for a new cache generation every CACHE_SYNC_INTERVAL seconds.
+    CACHE_SYNC_FILE: str = ".cache_generation"
+    CACHE_SYNC_INTERVAL: float = 2.0
+    # Events buffered per WebSocket/SSE connection before it is dropped as a slow consumer.
+    EVENT_BUFFER_SIZE: int = 100
+    SSE_PING_INTERVAL: float = 15.0
+    # How often each worker loads the tokens revoked by the other workers.
+    TOKEN_DENYLIST_SYNC_INTERVAL: float = 5.0
+    # Only for asymmetric ALGORITHMs (ES256/RS256): the directory of <kid>.pem private keys and the one to sign with.
+    JWT_KEYS_DIR: Optional[str] = None
+    JWT_ACTIVE_KID: Optional[str] = None
+    # The first scheme hashes new passwords, the others are only accepted (and upgraded on login).
+    # argon2 needs argon2-cffi installed. See passwords.py
+    PASSWORD_SCHEMES: list[str] = ["bcrypt"]
+    # When set, the costs below are replaced by ones calibrated at startup so a hash takes about this long.
+    PASSWORD_HASH_TARGET_MS: Optional[float] = None
+    BCRYPT_ROUNDS: int = 12
+    ARGON2_TIME_COST: int = 3
+    ARGON2_MEMORY_COST: int = 65536  # KiB
+    # Replies to replies... stop at this depth, 0 is a comment on the post.
+    MAX_COMMENT_DEPTH: int = 8
+    # Seconds between recounting the stats tables from the source tables, 0 turns it off.
+    STATS_RECONCILE_INTERVAL: float = 3600.0
+    # Seconds between runs of the cleaner of deleted posts, and the rows it deletes per statement.
+    CLEANUP_INTERVAL: float = 30.0
+    CLEANUP_BATCH_SIZE: int = 500
+    # Posts older than this many days are moved out of the database by archive.py, None keeps them all.
+    ARCHIVE_AFTER_DAYS: Optional[int] = None
+    ARCHIVE_DIR: str = "archive"
+    # Posts per gzip block in the archive files, a lookup decompresses one block.
+    ARCHIVE_BLOCK_SIZE: int = 100
+    # Responses smaller than this (bytes) aren't worth compressing. See compression.py
+    COMPRESSION_MINIMUM_SIZE: int = 1000
+    # Image generations running at once per worker (the rest wait their turn), and how long a prompt's
+    # image is reused for. IMAGE_CACHE_SIZE prompts are also kept in memory. See image_generation.py
+    IMAGE_GENERATION_CONCURRENCY: int = 4
+    IMAGE_CACHE_TTL: int = 7 * 24 * 60 * 60
+    IMAGE_CACHE_SIZE: int = 1000
+    # "deepai" or "local" (placeholder images drawn here, for load tests without the network). See image_providers.py
+    IMAGE_PROVIDER: str = "deepai"
+    IMAGE_PROVIDER_TIMEOUT: float = 60.0
+    # Calls per image: another starts when one fails, or after IMAGE_HEDGE_AFTER seconds without an answer.
+    IMAGE_PROVIDER_ATTEMPTS: int = 2
+    IMAGE_HEDGE_AFTER: Optional[float] = None
+    LOCAL_IMAGE_WORKERS: int = 2
+    LOCAL_IMAGE_DELAY: float = 0.0
+    # Files we store ourselves (the local image provider) are written here and served at MEDIA_URL.
+    MEDIA_DIR: str = "media"
+    MEDIA_URL: str = "/media"
+    # "mailgun" (their HTTP API) or "smtp" (pooled connections to SMTP_HOST, see mail.py).
+    # MAILGUN_BASE_URL can point at the stand-in server in mail_sink.py
+    MAIL_TRANSPORT: str = "mailgun"
+    MAILGUN_BASE_URL: str = "https://api.mailgun.net/v3"
+    SMTP_HOST: str = "localhost"
+    SMTP_PORT: int = 587
+    SMTP_USERNAME: Optional[str] = None
+    SMTP_PASSWORD: Optional[str] = None
+    SMTP_STARTTLS: bool = True
+    SMTP_POOL_SIZE: int = 4
+    SMTP_TIMEOUT: float = 30.0
 
 
 class DevConfig(GlobalConfig):
@@ -36,6 +130,8 @@ class ProdConfig(GlobalConfig):
 class TestConfig(GlobalConfig):
     DATABASE_URL: str = "sqlite:///test.db"
     DB_FORCE_ROLL_BACK: bool = True
+    # The cheapest bcrypt allows, the tests don't need slow hashes.
+    BCRYPT_ROUNDS: int = 4
     model_config = SettingsConfigDict(env_prefix="TEST_", extra="ignore")
 
 
@@ -50,3 +146,42 @@ def get_config(env_state: str):
 # BaseConfig().ENV_STATE
 
 config = get_config(BaseConfig().ENV_STATE)
+
+
+# What was changed by a reload: setting name -> (old value, new value).
+Changes = dict[str, tuple[Any, Any]]
+
+_subscribers: list[Callable[[Changes], None]] = []
+
+
+def on_reload(callback: Callable[[Changes], None]) -> Callable[[Changes], None]:
+    """
+    Register a function to call with the changes after the config is reloaded. For the things that
+    keep their own copy of a setting (a filter, a cache size...) so they don't read config every time.
+    """
+    _subscribers.append(callback)
+    return callback
+
+
+def reload_config() -> Changes:
+    """
+    Read the settings again (the .env file and the environment) into the config every module imported.
+
+    The new settings are all read and validated before any is changed, so a bad value leaves the old
+    config as it was. They then go in with one dict update and no await in between, so a request never
+    sees half the old settings and half the new. Things built from the config at startup (the database,
+    the middleware, the workers) keep what they had until a restart.
+    """
+    fresh = type(config)()
+    old, new = config.model_dump(), fresh.model_dump()
+    changed = {name: (old[name], new[name]) for name in new if old[name] != new[name]}
+    if not changed:
+        return changed
+    config.__dict__.update(fresh.__dict__)
+    logger.info("Config reloaded, changed: %s", ", ".join(changed))
+    for callback in _subscribers:
+        try:
+            callback(changed)
+        except Exception:
+            logger.exception("Config reload callback %s failed", callback)
+    return changed
@@ -1,6 +1,8 @@
-import databases
 import sqlalchemy
+from sqlalchemy.dialects import postgresql, sqlite
+
 from social_media_fapi.config import config
+from social_media_fapi.slow_query import SlowQueryDatabase
 
 metadata = sqlalchemy.MetaData()
 
@@ -10,8 +12,18 @@ post_table = sqlalchemy.Table(
   metadata,
   sqlalchemy.Column("id", sqlalchemy.Integer, primary_key=True),
   sqlalchemy.Column("body", sqlalchemy.String),
-  sqlalchemy.Column("user_id", sqlalchemy.ForeignKey("users.id"), nullable=False),
-  sqlalchemy.Column("image_url", sqlalchemy.String),
+  sqlalchemy.Column("user_id", sqlalchemy.ForeignKey("users.id"), nullable=False, index=True),
+  sqlalchemy.Column("image_url", sqlalchemy.String, index=True),  # Indexed for cleanup.image_in_use
+  # For media sent with the post: pending until it's stored, then ready (or failed). See post_media.py
+  sqlalchemy.Column("media_status", sqlalchemy.String),
+  sqlalchemy.Column("thumbnail_url", sqlalchemy.String),
+  sqlalchemy.Column("created_at", sqlalchemy.Integer, index=True),  # Unix time, used by archive.py
+  # Unix time with fractions, set whenever what the feed shows of the post changes. See routers.post.feed_etag
+  sqlalchemy.Column("updated_at", sqlalchemy.Float, index=True),
+  # Unix times. A deleted post is hidden straight away, its comments, likes and image are removed
+  # later by cleanup.py which then sets purged_at. The row is kept as a tombstone.
+  sqlalchemy.Column("deleted_at", sqlalchemy.Integer, index=True),
+  sqlalchemy.Column("purged_at", sqlalchemy.Integer),
 )
 
 user_table = sqlalchemy.Table(
@@ -29,23 +41,134 @@ comment_table = sqlalchemy.Table(
   sqlalchemy.Column("id", sqlalchemy.Integer, primary_key=True),
   sqlalchemy.Column("body", sqlalchemy.String),
   sqlalchemy.Column("post_id", sqlalchemy.ForeignKey("posts.id"), nullable=False),
-  sqlalchemy.Column("user_id", sqlalchemy.ForeignKey("users.id"), nullable=False),
+  sqlalchemy.Column("user_id", sqlalchemy.ForeignKey("users.id"), nullable=False, index=True),
+  # Replies: see comment_paths.py for what the path looks like.
+  sqlalchemy.Column("parent_id", sqlalchemy.ForeignKey("comments.id"), index=True),
+  sqlalchemy.Column("path", sqlalchemy.String, nullable=False),
+  sqlalchemy.Column("depth", sqlalchemy.Integer, nullable=False, default=0),
+  # A post's threads, or one subtree of them, are a range scan of this index.
+  sqlalchemy.Index("ix_comments_post_id_path", "post_id", "path"),
 )
 
 like_table = sqlalchemy.Table(
   "likes",
   metadata,
   sqlalchemy.Column("id", sqlalchemy.Integer, primary_key=True),
-  sqlalchemy.Column("post_id", sqlalchemy.ForeignKey("posts.id"), nullable=False),
-  sqlalchemy.Column("user_id", sqlalchemy.ForeignKey("users.id"), nullable=False),
+  sqlalchemy.Column("post_id", sqlalchemy.ForeignKey("posts.id"), nullable=False, index=True),
+  sqlalchemy.Column("user_id", sqlalchemy.ForeignKey("users.id"), nullable=False, index=True),
 ) 
 
+# Counts kept up to date by the write routes, so they don't need a COUNT(*) per request. See stats.py
+user_stats_table = sqlalchemy.Table(
+  "user_stats",
+  metadata,
+  sqlalchemy.Column("user_id", sqlalchemy.ForeignKey("users.id"), primary_key=True),
+  sqlalchemy.Column("post_count", sqlalchemy.Integer, nullable=False, server_default="0"),
+  sqlalchemy.Column("comment_count", sqlalchemy.Integer, nullable=False, server_default="0"),
+  sqlalchemy.Column("like_count", sqlalchemy.Integer, nullable=False, server_default="0"),  # Likes given.
+)
+
+post_stats_table = sqlalchemy.Table(
+  "post_stats",
+  metadata,
+  sqlalchemy.Column("post_id", sqlalchemy.ForeignKey("posts.id"), primary_key=True),
+  sqlalchemy.Column("comment_count", sqlalchemy.Integer, nullable=False, server_default="0"),
+  sqlalchemy.Column("like_count", sqlalchemy.Integer, nullable=False, server_default="0"),
+)
+
+# Where each archived post is: a gzip member of `length` bytes at `offset` in ARCHIVE_DIR/file. See archive.py
+post_archive_index_table = sqlalchemy.Table(
+  "post_archive_index",
+  metadata,
+  sqlalchemy.Column("post_id", sqlalchemy.Integer, primary_key=True),
+  sqlalchemy.Column("user_id", sqlalchemy.ForeignKey("users.id"), nullable=False, index=True),
+  sqlalchemy.Column("file", sqlalchemy.String, nullable=False),
+  sqlalchemy.Column("offset", sqlalchemy.Integer, nullable=False),
+  sqlalchemy.Column("length", sqlalchemy.Integer, nullable=False),
+  # So cleanup.image_in_use sees the images that archived posts still point to.
+  sqlalchemy.Column("image_url", sqlalchemy.String, index=True),
+)
+
+# Who wrote the comments and likes of archived posts (which can be anyone's posts), for their exports.
+archived_comment_index_table = sqlalchemy.Table(
+  "archived_comment_index",
+  metadata,
+  sqlalchemy.Column("comment_id", sqlalchemy.Integer, primary_key=True),
+  sqlalchemy.Column("post_id", sqlalchemy.ForeignKey("post_archive_index.post_id"), nullable=False),
+  sqlalchemy.Column("user_id", sqlalchemy.ForeignKey("users.id"), nullable=False, index=True),
+)
+
+archived_like_index_table = sqlalchemy.Table(
+  "archived_like_index",
+  metadata,
+  sqlalchemy.Column("like_id", sqlalchemy.Integer, primary_key=True),
+  sqlalchemy.Column("post_id", sqlalchemy.ForeignKey("post_archive_index.post_id"), nullable=False),
+  sqlalchemy.Column("user_id", sqlalchemy.ForeignKey("users.id"), nullable=False, index=True),
+)
+
+# The part of each user's stats that moved to the archive, so stats.reconcile() can still add it up.
+archived_user_stats_table = sqlalchemy.Table(
+  "archived_user_stats",
+  metadata,
+  sqlalchemy.Column("user_id", sqlalchemy.ForeignKey("users.id"), primary_key=True),
+  sqlalchemy.Column("post_count", sqlalchemy.Integer, nullable=False, server_default="0"),
+  sqlalchemy.Column("comment_count", sqlalchemy.Integer, nullable=False, server_default="0"),
+  sqlalchemy.Column("like_count", sqlalchemy.Integer, nullable=False, server_default="0"),
+)
+
+# Access/refresh tokens that were revoked before they expired, see security.TokenDenylist.
+revoked_token_table = sqlalchemy.Table(
+  "revoked_tokens",
+  metadata,
+  sqlalchemy.Column("id", sqlalchemy.Integer, primary_key=True),
+  sqlalchemy.Column("jti", sqlalchemy.String, unique=True, nullable=False),
+  sqlalchemy.Column("expires_at", sqlalchemy.Integer, nullable=False, index=True),
+)
+
+# The images generated for each prompt, so the same prompt isn't sent to DeepAI again. See image_generation.py
+generated_image_table = sqlalchemy.Table(
+  "generated_images",
+  metadata,
+  sqlalchemy.Column("prompt_key", sqlalchemy.String, primary_key=True),
+  sqlalchemy.Column("prompt", sqlalchemy.String, nullable=False),
+  sqlalchemy.Column("image_url", sqlalchemy.String, nullable=False, index=True),
+  sqlalchemy.Column("created_at", sqlalchemy.Integer, nullable=False),
+)
+
+# Files clients upload straight to storage, see direct_uploads.py. file_url is set once it's there.
+upload_table = sqlalchemy.Table(
+  "uploads",
+  metadata,
+  sqlalchemy.Column("id", sqlalchemy.String, primary_key=True),
+  sqlalchemy.Column("user_id", sqlalchemy.ForeignKey("users.id"), nullable=False, index=True),
+  sqlalchemy.Column("file_name", sqlalchemy.String, nullable=False),  # The name in storage.
+  sqlalchemy.Column("content_type", sqlalchemy.String, nullable=False),
+  sqlalchemy.Column("storage", sqlalchemy.String, nullable=False),  # b2 or local
+  sqlalchemy.Column("token", sqlalchemy.String),  # Only for local storage, B2 gives its own.
+  sqlalchemy.Column("expires_at", sqlalchemy.Integer, nullable=False, index=True),
+  sqlalchemy.Column("completed_at", sqlalchemy.Integer),
+  sqlalchemy.Column("size", sqlalchemy.Integer),
+  sqlalchemy.Column("file_url", sqlalchemy.String),
+  sqlalchemy.Column("post_id", sqlalchemy.ForeignKey("posts.id")),
+)
+
 # Only need this connect_args={"check_same_thread": False for SqlLite, it allows us to connect from multiple different threads.
 engine = sqlalchemy.create_engine(
     config.DATABASE_URL, connect_args={"check_same_thread": False}
 )
 
 metadata.create_all(engine)
-database = databases.Database(
-  config.DATABASE_URL, force_rollback=config.DB_FORCE_ROLL_BACK
+database = SlowQueryDatabase(
+  config.DATABASE_URL,
+  force_rollback=config.DB_FORCE_ROLL_BACK,
+  slow_query_ms=config.SLOW_QUERY_MS,
+  explain=config.SLOW_QUERY_EXPLAIN,
 )
+
+# The INSERTs with ON CONFLICT (on_conflict_do_nothing / on_conflict_do_update) of the databases we run on.
+_CONFLICT_INSERTS = {"sqlite": sqlite.insert, "postgresql": postgresql.insert}
+
+
+def insert_on_conflict(table: sqlalchemy.Table):
+    """table.insert() for the configured database, with on_conflict_do_nothing() and on_conflict_do_update()."""
+    return _CONFLICT_INSERTS[database.url.dialect](table)
@@ -0,0 +1,211 @@
+"""
+Uploads that go from the client straight to storage, so the bytes don't pass through our workers
+(they do with POST /upload, see routers/upload.py):
+
+    1. POST /upload/authorize with the file's name and type, one of UPLOAD_ALLOWED_TYPES. We note the
+       upload and answer with where to send the file: upload_url, the method and the headers to send with it.
+    2. The client sends the file there. It can also send X-Bz-Content-Sha1, the sha1 of the file, to have
+       it checked (B2 does that itself).
+    3. POST /upload/complete with the upload_id, and a post_id to make it the post's image. We check the
+       file is there, no bigger than UPLOAD_MAX_BYTES and of the type authorised, and answer with its
+       file_url. A file that isn't is deleted.
+
+The file is named by us, with the extension of its type, never with the client's name for it.
+
+Storage is B2 when B2_KEY_ID is set. A B2 upload URL works for 24 hours and for any name in the bucket,
+so it's completing the upload that we limit to UPLOAD_AUTHORIZATION_TTL seconds, and only B2's record of
+the size and type can be checked then. Uploads that weren't completed in time are deleted by cleanup.py.
+
+Without B2 it's the local stand-in: a PUT to /upload/local/<upload_id> with the token we gave, saved to
+MEDIA_DIR and served at MEDIA_URL. Those bytes do go through the app (and through an UploadValidator, see
+streaming_upload.py, so the type is the one its first bytes say), it's for development and load tests.
+"""
+import asyncio
+import logging
+import os
+import pathlib
+import secrets
+import time
+import uuid
+from typing import AsyncIterator, Callable, Optional
+from urllib.parse import quote
+
+import aiofiles
+
+from social_media_fapi.config import config
+from social_media_fapi.database import database, post_table, upload_table
+from social_media_fapi.events import FEED_TOPIC, bus, post_topic
+from social_media_fapi.libs.b2 import b2_client, b2_delete_file_by_url
+from social_media_fapi.streaming_upload import EXTENSIONS, UploadValidator
+
+logger = logging.getLogger(__name__)
+
+
+def storage() -> str:
+    return "b2" if config.B2_KEY_ID else "local"
+
+
+def object_name(user_id: int, content_type: str, prefix: str = "uploads", stem: str = "file") -> str:
+    # Nothing in it comes from the client, and the extension (which the type is served as) is the type's.
+    return f"{prefix}/{user_id}/{uuid.uuid4().hex}/{stem}{EXTENSIONS.get(content_type, '')}"
+
+
+def local_path(name: str) -> pathlib.Path:
+    return pathlib.Path(config.MEDIA_DIR) / name
+
+
+def local_url(name: str) -> str:
+    return f"{config.MEDIA_URL.rstrip('/')}/{name}"
+
+
+async def find_upload(upload_id: str):
+    return await database.fetch_one(upload_table.select().where(upload_table.c.id == upload_id))
+
+
+async def authorize_upload(
+    user_id: int, file_name: str, content_type: str, local_upload_url: Callable[[str], str]
+) -> dict:
+    """Notes the upload, returns where and how the client sends the file. local_upload_url gives our PUT route."""
+    upload = {
+        "id": uuid.uuid4().hex,
+        "user_id": user_id,
+        "file_name": object_name(user_id, content_type),
+        "content_type": content_type,
+        "storage": storage(),
+        "expires_at": int(time.time()) + config.UPLOAD_AUTHORIZATION_TTL,
+    }
+    if upload["storage"] == "b2":
+        upload_url, token = await b2_client.upload_authorization()
+        method = "POST"
+        headers = {
+            "Authorization": token,
+            "X-Bz-File-Name": quote(upload["file_name"]),
+            "Content-Type": content_type,
+        }
+    else:
+        upload["token"] = secrets.token_urlsafe(32)
+        upload_url = local_upload_url(upload["id"])
+        method = "PUT"
+        headers = {"X-Upload-Token": upload["token"], "Content-Type": content_type}
+    await database.execute(upload_table.insert().values(upload))
+    logger.info(
+        "Authorised upload %s of %s as %s to %s", upload["id"], file_name, upload["file_name"], upload["storage"]
+    )
+    return {
+        "upload_id": upload["id"],
+        "upload_url": upload_url,
+        "method": method,
+        "headers": headers,
+        "expires_at": upload["expires_at"],
+    }
+
+
+def local_upload_allowed(upload, token: Optional[str]) -> bool:
+    return bool(
+        upload
+        and upload.storage == "local"
+        and upload.completed_at is None
+        and upload.expires_at > time.time()
+        and token
+        and secrets.compare_digest(upload.token, token)
+    )
+
+
+async def save_local(name: str, chunks: AsyncIterator[bytes], validator: UploadValidator) -> int:
+    """
+    Writes the chunks to the local storage, each checked by the validator first, returns the size.
+    Nothing is kept if the validator raises.
+    """
+    path = local_path(name)
+    await asyncio.to_thread(path.parent.mkdir, parents=True, exist_ok=True)
+    # Written under another name then renamed, so completing never finds half a file. A name of its
+    # own, two PUTs of the same upload at once mustn't write to the same temp file.
+    temp_path = path.with_name(f"{path.name}.{uuid.uuid4().hex}.tmp")
+    try:
+        async with aiofiles.open(temp_path, "wb") as f:
+            async for chunk in chunks:
+                validator.feed(chunk)
+                await f.write(chunk)
+        validator.finish()
+        await asyncio.to_thread(os.replace, temp_path, path)
+    except BaseException:
+        await asyncio.to_thread(temp_path.unlink, missing_ok=True)
+        raise
+    return validator.size
+
+
+def _local_file(name: str) -> Optional[int]:
+    path = local_path(name)
+    return path.stat().st_size if path.is_file() else None
+
+
+async def stored_file(upload) -> Optional[tuple[str, int, str]]:
+    """The file_url, size and content type of what the client uploaded, None if it isn't there."""
+    if upload.storage == "b2":
+        return await b2_client.file_by_name(upload.file_name)
+    size = await asyncio.to_thread(_local_file, upload.file_name)
+    if size is None:
+        return None
+    # Only saved by save_local if its first bytes were of this type.
+    return local_url(upload.file_name), size, upload.content_type
+
+
+async def delete_stored_file(upload, file_url: str) -> None:
+    if upload.storage == "b2":
+        await b2_delete_file_by_url(file_url)
+    else:
+        await asyncio.to_thread(local_path(upload.file_name).unlink, missing_ok=True)
+
+
+async def reject_upload(upload, file_url: str) -> None:
+    """Deletes the file and the upload, for a file that isn't what was authorised."""
+    await delete_stored_file(upload, file_url)
+    await database.execute(upload_table.delete().where(upload_table.c.id == upload.id))
+
+
+async def complete_upload(upload, file_url: str, size: int, post_id: Optional[int]) -> bool:
+    """Marks it complete, False if another request did that first."""
+    completed = await database.fetch_one(
+        upload_table.update()
+        .where(upload_table.c.id == upload.id, upload_table.c.completed_at.is_(None))
+        .values(completed_at=int(time.time()), file_url=file_url, size=size, post_id=post_id)
+        .returning(upload_table.c.id)
+    )
+    return completed is not None
+
+
+async def set_post_image(post_id: int, image_url: str, **values) -> bool:
+    """Sets a live post's image (and other columns in values) and tells the feed, False if the post was deleted."""
+    updated = await database.fetch_one(
+        post_table.update()
+        .where(post_table.c.id == post_id, post_table.c.deleted_at.is_(None))
+        .values(image_url=image_url, updated_at=time.time(), **values)
+        .returning(post_table.c.id)
+    )
+    if updated is None:
+        return False
+    event = {"type": "post_image_ready", "post_id": post_id, "image_url": image_url, **values}
+    bus.publish(post_topic(post_id), event)
+    bus.publish(FEED_TOPIC, event)
+    return True
+
+
+async def delete_expired_uploads(max_uploads: int = 100) -> int:
+    """Removes uploads that weren't completed in time, and their file if the client sent it anyway."""
+    query = (
+        upload_table.select()
+        .where(upload_table.c.completed_at.is_(None), upload_table.c.expires_at < int(time.time()))
+        .limit(max_uploads)
+    )
+    deleted = 0
+    for upload in await database.fetch_all(query):
+        try:
+            found = await stored_file(upload)
+            if found:
+                await delete_stored_file(upload, found[0])
+        except Exception:
+            logger.exception("Could not delete the file of expired upload %s", upload.id)
+            continue
+        await database.execute(upload_table.delete().where(upload_table.c.id == upload.id))
+        deleted += 1
+    return deleted
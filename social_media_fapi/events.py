@@ -0,0 +1,111 @@
+"""
+In-process publish/subscribe for post, comment and like events.
+
+The write handlers publish to a topic ("feed" for new posts, "post:<id>" for things happening on
+one post) and the WebSocket/SSE endpoints in routers/events.py subscribe to them, so clients
+don't have to keep polling GET /post.
+
+The bus lives in the worker process, so with several workers a client only sees the events
+from the worker its connection is on.
+"""
+import asyncio
+import json
+import logging
+from typing import Any, Optional
+
+from social_media_fapi.config import Changes, config, on_reload
+
+logger = logging.getLogger(__name__)
+
+FEED_TOPIC = "feed"
+
+
+def post_topic(post_id: int) -> str:
+    return f"post:{post_id}"
+
+
+class Subscription:
+    def __init__(self, bus: "EventBus", buffer_size: int) -> None:
+        self.bus = bus
+        self.topics: set[str] = set()
+        # Each connection has its own bounded buffer, so a slow client can't make us hold unlimited events.
+        self.queue: asyncio.Queue[Optional[str]] = asyncio.Queue(maxsize=buffer_size)
+        self.closed = False
+
+    async def get(self) -> Optional[str]:
+        """Wait for the next event (already JSON encoded). None means we were dropped for being too slow."""
+        return await self.queue.get()
+
+    def subscribe(self, topic: str) -> None:
+        self.bus._add(self, topic)
+
+    def unsubscribe(self, topic: str) -> None:
+        self.bus._remove(self, topic)
+
+    def close(self) -> None:
+        for topic in list(self.topics):
+            self.bus._remove(self, topic)
+        self.closed = True
+
+
+class EventBus:
+    def __init__(self, buffer_size: int = 100) -> None:
+        self.buffer_size = buffer_size
+        self._topics: dict[str, set[Subscription]] = {}
+        self.dropped = 0
+
+    def subscribe(self, *topics: str) -> Subscription:
+        subscription = Subscription(self, self.buffer_size)
+        for topic in topics:
+            subscription.subscribe(topic)
+        return subscription
+
+    def publish(self, topic: str, event: dict[str, Any]) -> int:
+        """Send the event to every subscriber of the topic and return how many got it."""
+        subscribers = self._topics.get(topic)
+        if not subscribers:
+            return 0
+        # Encode once, not once per subscriber.
+        message = json.dumps(event, default=str)
+        delivered = 0
+        for subscription in list(subscribers):
+            try:
+                subscription.queue.put_nowait(message)
+                delivered += 1
+            except asyncio.QueueFull:
+                self._drop(subscription)
+        return delivered
+
+    def subscriber_count(self, topic: str) -> int:
+        return len(self._topics.get(topic, ()))
+
+    def _add(self, subscription: Subscription, topic: str) -> None:
+        self._topics.setdefault(topic, set()).add(subscription)
+        subscription.topics.add(topic)
+
+    def _remove(self, subscription: Subscription, topic: str) -> None:
+        subscribers = self._topics.get(topic)
+        if subscribers is not None:
+            subscribers.discard(subscription)
+            if not subscribers:
+                del self._topics[topic]
+        subscription.topics.discard(topic)
+
+    def _drop(self, subscription: Subscription) -> None:
+        # The client isn't keeping up. Rather than slow down every publisher (or grow the buffer forever)
+        # we throw away its buffer and tell it to go away, it can reconnect and re-fetch.
+        logger.warning("Dropping slow event subscriber")
+        self.dropped += 1
+        subscription.close()
+        while not subscription.queue.empty():
+            subscription.queue.get_nowait()
+        subscription.queue.put_nowait(None)
+
+
+bus = EventBus(buffer_size=config.EVENT_BUFFER_SIZE)
+
+
+@on_reload
+def apply_config(changed: Changes) -> None:
+    # Connections made from now on get the new size, the open ones keep theirs.
+    bus.buffer_size = config.EVENT_BUFFER_SIZE
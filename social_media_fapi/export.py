@@ -0,0 +1,223 @@
+"""
+A user's data as a zip, streamed to the client while it's being made (see GET /user/me/export).
+
+    posts.ndjson     their posts, archived ones included
+    comments.ndjson  their comments, archived ones (on archived posts) included
+    likes.ndjson     their likes, archived ones included
+    images/          the images of their posts, archived ones included
+    export.json      counts, and the images that couldn't be downloaded
+
+Images we store ourselves (under MEDIA_URL) are read from MEDIA_DIR, the others are downloaded.
+
+The rows are read in keyset pages (WHERE id > last id) rather than one cursor held open for the
+whole download, which with sqlite would block writers for as long as a slow client takes. The zip is
+written to a sink that's emptied every CHUNK_SIZE bytes, so memory use doesn't depend on how much
+the user has posted.
+"""
+import contextlib
+import json
+import logging
+import mimetypes
+import pathlib
+import zipfile
+from typing import AsyncIterator
+from urllib.parse import urlparse
+
+import aiofiles
+import httpx
+import sqlalchemy
+
+from social_media_fapi import archive
+from social_media_fapi.config import config
+from social_media_fapi.database import (
+    archived_comment_index_table,
+    archived_like_index_table,
+    comment_table,
+    database,
+    like_table,
+    post_archive_index_table,
+    post_table,
+)
+from social_media_fapi.tls import ssl_context
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 64 * 1024
+PAGE_SIZE = 500
+
+
+class ZipSink:
+    """
+    What the zip is written to. It has no seek() or tell(), so zipfile writes the sizes after each
+    entry instead of going back to fill them in, and we can send everything as soon as it's written.
+    """
+
+    def __init__(self) -> None:
+        self._chunks: list[bytes] = []
+        self.size = 0
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        self.size += len(data)
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def take(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        self.size = 0
+        return data
+
+
+async def keyset_pages(query: sqlalchemy.Select, key: sqlalchemy.Column, page_size: int = PAGE_SIZE):
+    """The rows of query in order of key (which must be unique), fetched page_size at a time."""
+    last = None
+    while True:
+        page = query if last is None else query.where(key > last)
+        rows = await database.fetch_all(page.order_by(key).limit(page_size))
+        for row in rows:
+            yield row
+        if len(rows) < page_size:
+            return
+        last = row._mapping[key.name]
+
+
+async def post_lines(user_id: int):
+    query = post_table.select().where(post_table.c.user_id == user_id, post_table.c.deleted_at.is_(None))
+    async for post in keyset_pages(query, post_table.c.id):
+        yield {"id": post.id, "body": post.body, "image_url": post.image_url, "created_at": post.created_at}
+
+    query = post_archive_index_table.select().where(post_archive_index_table.c.user_id == user_id)
+    async for entry in keyset_pages(query, post_archive_index_table.c.post_id):
+        document = await archive.find_archived_post(entry.post_id)
+        post = {name: document["post"][name] for name in ("id", "body", "image_url", "created_at")}
+        yield {**post, "archived": True}
+
+
+async def comment_lines(user_id: int):
+    query = comment_table.select().where(comment_table.c.user_id == user_id)
+    async for comment in keyset_pages(query, comment_table.c.id):
+        yield {
+            "id": comment.id,
+            "body": comment.body,
+            "post_id": comment.post_id,
+            "parent_id": comment.parent_id,
+        }
+
+    query = archived_comment_index_table.select().where(archived_comment_index_table.c.user_id == user_id)
+    async for entry in keyset_pages(query, archived_comment_index_table.c.comment_id):
+        document = await archive.find_archived_post(entry.post_id)
+        comment = next(comment for comment in document["comments"] if comment["id"] == entry.comment_id)
+        comment = {name: comment[name] for name in ("id", "body", "post_id", "parent_id")}
+        yield {**comment, "archived": True}
+
+
+async def like_lines(user_id: int):
+    query = like_table.select().where(like_table.c.user_id == user_id)
+    async for like in keyset_pages(query, like_table.c.id):
+        yield {"id": like.id, "post_id": like.post_id}
+
+    query = archived_like_index_table.select().where(archived_like_index_table.c.user_id == user_id)
+    async for entry in keyset_pages(query, archived_like_index_table.c.like_id):
+        yield {"id": entry.like_id, "post_id": entry.post_id, "archived": True}
+
+
+async def post_images(user_id: int):
+    """(post id, image url) for each of the user's posts with an image, archived ones last."""
+    query = post_table.select().where(
+        post_table.c.user_id == user_id,
+        post_table.c.deleted_at.is_(None),
+        post_table.c.image_url.is_not(None),
+    )
+    async for post in keyset_pages(query, post_table.c.id):
+        yield post.id, post.image_url
+
+    query = post_archive_index_table.select().where(post_archive_index_table.c.user_id == user_id)
+    async for entry in keyset_pages(query, post_archive_index_table.c.post_id):
+        document = await archive.find_archived_post(entry.post_id)
+        if document["post"]["image_url"]:
+            yield entry.post_id, document["post"]["image_url"]
+
+
+def image_name(post_id: int, url: str, content_type: str | None) -> str:
+    suffix = pathlib.PurePosixPath(urlparse(url).path).suffix
+    if not suffix and content_type:
+        suffix = mimetypes.guess_extension(content_type.split(";")[0].strip()) or ""
+    return f"images/{post_id}{suffix}"
+
+
+def local_media_path(url: str) -> pathlib.Path | None:
+    """The file in MEDIA_DIR of one of our URLs (see direct_uploads.local_url), None for other URLs."""
+    prefix = config.MEDIA_URL.rstrip("/") + "/"
+    if not url.startswith(prefix):
+        return None
+    root = pathlib.Path(config.MEDIA_DIR).resolve()
+    path = (root / url.removeprefix(prefix)).resolve()
+    if not path.is_relative_to(root):
+        raise FileNotFoundError(f"{url} is not in MEDIA_DIR")
+    return path
+
+
+async def file_chunks(f) -> AsyncIterator[bytes]:
+    while chunk := await f.read(CHUNK_SIZE):
+        yield chunk
+
+
+@contextlib.asynccontextmanager
+async def open_image(client: httpx.AsyncClient, url: str):
+    """The content type of the image and an async iterator of its bytes."""
+    path = local_media_path(url)
+    if path is not None:
+        async with aiofiles.open(path, "rb") as f:
+            yield mimetypes.guess_type(path.name)[0], file_chunks(f)
+        return
+    async with client.stream("GET", url) as response:
+        response.raise_for_status()
+        yield response.headers.get("content-type"), response.aiter_bytes(CHUNK_SIZE)
+
+
+async def export_user_data(user_id: int, client: httpx.AsyncClient = None) -> AsyncIterator[bytes]:
+    """The zip of the user's data, in chunks of about CHUNK_SIZE bytes."""
+    sink = ZipSink()
+    counts = {}
+    failed_images = []
+
+    with zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_DEFLATED) as zip_file:
+        for name, lines in (
+            ("posts.ndjson", post_lines(user_id)),
+            ("comments.ndjson", comment_lines(user_id)),
+            ("likes.ndjson", like_lines(user_id)),
+        ):
+            counts[name] = 0
+            # force_zip64 because we can't know the size of an entry before it's written.
+            with zip_file.open(name, "w", force_zip64=True) as entry:
+                async for line in lines:
+                    entry.write(json.dumps(line).encode() + b"\n")
+                    counts[name] += 1
+                    if sink.size >= CHUNK_SIZE:
+                        yield sink.take()
+
+        counts["images"] = 0
+        async with contextlib.AsyncExitStack() as stack:
+            if client is None:
+                client = await stack.enter_async_context(httpx.AsyncClient(verify=ssl_context(), timeout=30))
+            async for post_id, image_url in post_images(user_id):
+                try:
+                    async with open_image(client, image_url) as (content_type, chunks):
+                        info = zipfile.ZipInfo(image_name(post_id, image_url, content_type))
+                        info.compress_type = zipfile.ZIP_STORED  # Images are compressed already.
+                        with zip_file.open(info, "w", force_zip64=True) as entry:
+                            async for chunk in chunks:
+                                entry.write(chunk)
+                                if sink.size >= CHUNK_SIZE:
+                                    yield sink.take()
+                    counts["images"] += 1
+                except (httpx.HTTPError, OSError) as e:
+                    logger.warning("Could not add image %s to the export: %s", image_url, e)
+                    failed_images.append({"post_id": post_id, "image_url": image_url, "error": str(e)})
+
+        manifest = {"user_id": user_id, "counts": counts, "failed_images": failed_images}
+        zip_file.writestr("export.json", json.dumps(manifest, indent=2))
+    yield sink.take()
@@ -0,0 +1,155 @@
+"""
+Generates the images for post prompts at most once per prompt, and never too many at a time.
+
+- Prompts that only differ in case, spacing or trailing punctuation are the same prompt (normalize_prompt).
+- A prompt's image is reused for IMAGE_CACHE_TTL seconds. The recent ones are kept in memory, and all
+  of them in the generated_images table, so the other workers and restarts reuse them too.
+- Identical prompts asked for while one is being generated wait for that one, not a call of their own.
+- At most IMAGE_GENERATION_CONCURRENCY generations run at once in a worker, the rest queue up.
+  stats() says how many are running and waiting, see GET /image-generation/stats
+
+The three settings are copied into the ImageGenerator, and changed there when the config is reloaded.
+"""
+import asyncio
+import hashlib
+import logging
+import re
+import time
+import unicodedata
+from collections import Counter, OrderedDict
+from typing import Awaitable, Callable
+
+from social_media_fapi import cache_sync
+from social_media_fapi.config import Changes, config, on_reload
+from social_media_fapi.database import database, generated_image_table, insert_on_conflict
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_prompt(prompt: str) -> str:
+    prompt = unicodedata.normalize("NFKC", prompt).casefold()
+    return re.sub(r"\s+", " ", prompt).strip().rstrip(".!,;: ")
+
+
+def prompt_key(prompt: str) -> str:
+    # The prompts can be long, the key of the table is a hash of the normalised prompt.
+    return hashlib.sha256(normalize_prompt(prompt).encode()).hexdigest()
+
+
+class ImageGenerator:
+    def __init__(self, concurrency: int, ttl: int, cache_size: int) -> None:
+        self.ttl = ttl
+        self.cache_size = cache_size
+        self.concurrency = concurrency
+        self._semaphore = asyncio.Semaphore(concurrency)
+        # prompt key -> (expires at, image url), the least recently used first.
+        self._cache: OrderedDict[str, tuple[float, str]] = OrderedDict()
+        self._in_flight: dict[str, asyncio.Task] = {}
+        self.waiting = 0
+        self.running = 0
+        self.counts = Counter()
+
+    async def get(self, prompt: str, generate: Callable[[str], Awaitable[str]]) -> str:
+        """The image url for the prompt, from generate(prompt) if there isn't one already."""
+        key = prompt_key(prompt)
+        cached = self._cache.get(key)
+        if cached and cached[0] > time.time():
+            self._cache.move_to_end(key)
+            self.counts["memory_hits"] += 1
+            return cached[1]
+
+        task = self._in_flight.get(key)
+        if task:
+            self.counts["coalesced"] += 1
+        else:
+            task = asyncio.ensure_future(self._resolve(key, prompt, generate))
+            self._in_flight[key] = task
+            task.add_done_callback(lambda _: self._in_flight.pop(key, None))
+        # Shielded, so one caller being cancelled doesn't cancel the generation the others are waiting for.
+        return await asyncio.shield(task)
+
+    async def _resolve(self, key: str, prompt: str, generate: Callable[[str], Awaitable[str]]) -> str:
+        query = generated_image_table.select().where(generated_image_table.c.prompt_key == key)
+        row = await database.fetch_one(query)
+        if row and row.created_at > time.time() - self.ttl:
+            self.counts["database_hits"] += 1
+            self._remember(key, row.image_url, row.created_at + self.ttl)
+            return row.image_url
+
+        image_url = await self._generate(prompt, generate)
+        values = {"prompt": normalize_prompt(prompt), "image_url": image_url, "created_at": int(time.time())}
+        await self._save(key, values)
+        self._remember(key, image_url, values["created_at"] + self.ttl)
+        return image_url
+
+    async def _save(self, key: str, values: dict) -> None:
+        # One statement, no transaction: it's a single row, and a generation finishing mustn't wait
+        # for (or hold up) the writes of the others. If another worker generated the same prompt at
+        # the same time, the newest image wins.
+        await database.execute(
+            insert_on_conflict(generated_image_table)
+            .values(prompt_key=key, **values)
+            .on_conflict_do_update(index_elements=[generated_image_table.c.prompt_key], set_=values)
+        )
+
+    async def _generate(self, prompt: str, generate: Callable[[str], Awaitable[str]]) -> str:
+        # Released on the one we acquired, even if configure() put in another since.
+        semaphore = self._semaphore
+        self.waiting += 1
+        if semaphore.locked():
+            logger.info("Image generation queued, %s waiting and %s running", self.waiting, self.running)
+        try:
+            await semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        self.running += 1
+        try:
+            image_url = await generate(prompt)
+            self.counts["generated"] += 1
+            return image_url
+        except Exception:
+            # Failures aren't cached, the next post with this prompt tries again.
+            self.counts["failed"] += 1
+            raise
+        finally:
+            self.running -= 1
+            semaphore.release()
+
+    def _remember(self, key: str, image_url: str, expires_at: float) -> None:
+        self._cache[key] = (expires_at, image_url)
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def configure(self, concurrency: int, ttl: int, cache_size: int) -> None:
+        self.ttl = ttl
+        self.cache_size = cache_size
+        if concurrency != self.concurrency:
+            # Generations already waiting keep their place on the old semaphore, new ones wait on this one.
+            self.concurrency = concurrency
+            self._semaphore = asyncio.Semaphore(concurrency)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def clear(self) -> None:
+        self._cache.clear()
+
+    def stats(self) -> dict:
+        return {
+            "waiting": self.waiting,
+            "running": self.running,
+            "in_flight": len(self._in_flight),
+            "cached": len(self._cache),
+            **self.counts,
+        }
+
+
+image_generator = ImageGenerator(config.IMAGE_GENERATION_CONCURRENCY, config.IMAGE_CACHE_TTL, config.IMAGE_CACHE_SIZE)
+
+# Each worker process has its own copy of the cache, see cache_sync.py
+cache_sync.register(image_generator.clear)
+
+
+@on_reload
+def apply_config(changed: Changes) -> None:
+    image_generator.configure(config.IMAGE_GENERATION_CONCURRENCY, config.IMAGE_CACHE_TTL, config.IMAGE_CACHE_SIZE)
@@ -0,0 +1,194 @@
+"""
+Where the images for post prompts come from, IMAGE_PROVIDER picks one:
+
+    deepai  the DeepAI cute creature generator (see tasks.py), needs the network and DEEPAI_API_KEY
+    local   a placeholder PNG made from the prompt, so the same prompt always gives the same image.
+            They're drawn on a process pool, written to MEDIA_DIR and served at MEDIA_URL. With
+            LOCAL_IMAGE_DELAY it takes as long as DeepAI would, for load tests without the network.
+
+Every call has IMAGE_PROVIDER_TIMEOUT seconds. generate_hedged() makes up to IMAGE_PROVIDER_ATTEMPTS
+calls: the next one starts when the last failed, or (with IMAGE_HEDGE_AFTER) when it hasn't answered
+after that many seconds, and whichever answers first wins. Each provider keeps its latencies, see stats().
+"""
+import asyncio
+import hashlib
+import os
+import pathlib
+import struct
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from typing import Awaitable, Callable, Optional
+
+from social_media_fapi.config import config
+from social_media_fapi.latency import LatencyStats
+
+
+class ProviderError(Exception):
+    pass
+
+
+class ImageProvider:
+    name = "base"
+    # Images from providers that aren't ours are copied to our storage, see tasks._store_generated_image
+    external = False
+
+    def __init__(self, timeout: float) -> None:
+        self.timeout = timeout
+        self.stats = LatencyStats()
+
+    async def create(self, prompt: str) -> str:
+        """The url of a new image for the prompt."""
+        raise NotImplementedError
+
+    async def generate(self, prompt: str) -> str:
+        start = time.perf_counter()
+        try:
+            image_url = await asyncio.wait_for(self.create(prompt), self.timeout)
+        except asyncio.TimeoutError as e:
+            self.stats.record(time.perf_counter() - start, "timeouts")
+            raise ProviderError(f"{self.name} took longer than {self.timeout}s") from e
+        except asyncio.CancelledError:
+            # Another attempt of a hedged call won, see generate_hedged.
+            self.stats.record(time.perf_counter() - start, "cancelled")
+            raise
+        except Exception:
+            self.stats.record(time.perf_counter() - start, "errors")
+            raise
+        self.stats.record(time.perf_counter() - start, "ok")
+        return image_url
+
+
+class DeepAIProvider(ImageProvider):
+    name = "deepai"
+    external = True
+
+    def __init__(self, timeout: float, call: Callable[[str], Awaitable[str]]) -> None:
+        super().__init__(timeout)
+        self._call = call
+
+    async def create(self, prompt: str) -> str:
+        return await self._call(prompt)
+
+
+def png(width: int, height: int, rows: list[bytes]) -> bytes:
+    """An RGB PNG, rows are the raw pixels of each row (3 bytes a pixel)."""
+
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+    header = struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)
+    # Each row starts with its filter type, 0 is none.
+    data = zlib.compress(b"".join(b"\0" + row for row in rows), 6)
+    return b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header) + chunk(b"IDAT", data) + chunk(b"IEND", b"")
+
+
+def render_placeholder(prompt: str, directory: str, size: int = 256) -> str:
+    """Draws the prompt's image into directory if it isn't there already, returns its file name."""
+    digest = hashlib.sha256(prompt.encode()).digest()
+    name = f"{digest.hex()[:32]}.png"
+    path = pathlib.Path(directory) / name
+    if path.exists():
+        return name
+
+    # Two colours and a stripe width from the hash, blended diagonally.
+    start, end, stripe = digest[0:3], digest[3:6], 8 + digest[6] % 24
+    rows = []
+    for y in range(size):
+        row = bytearray()
+        for x in range(size):
+            mix = (x + y) / (2 * size)
+            shade = 0.85 if (x // stripe + y // stripe) % 2 else 1.0
+            row += bytes(int((a + (b - a) * mix) * shade) for a, b in zip(start, end))
+        rows.append(bytes(row))
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # Written under another name then renamed, so a request never gets half an image.
+    temp_path = path.with_name(f"{name}.{os.getpid()}.tmp")
+    temp_path.write_bytes(png(size, size, rows))
+    os.replace(temp_path, path)
+    return name
+
+
+class LocalImageProvider(ImageProvider):
+    name = "local"
+
+    def __init__(self, timeout: float, media_dir: str, media_url: str, workers: int, delay: float = 0) -> None:
+        super().__init__(timeout)
+        self.directory = str(pathlib.Path(media_dir) / "generated")
+        self.url = f"{media_url.rstrip('/')}/generated"
+        self.workers = workers
+        self.delay = delay
+        self._pool: Optional[ProcessPoolExecutor] = None
+
+    async def create(self, prompt: str) -> str:
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        # Drawing is CPU work, in other processes it doesn't hold up the event loop (or the GIL).
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.workers)
+        loop = asyncio.get_running_loop()
+        name = await loop.run_in_executor(self._pool, render_placeholder, prompt, self.directory)
+        return f"{self.url}/{name}"
+
+    def close(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(cancel_futures=True)
+            self._pool = None
+
+
+providers: dict[str, ImageProvider] = {}
+
+
+def register(provider: ImageProvider) -> ImageProvider:
+    providers[provider.name] = provider
+    return provider
+
+
+def get_provider(name: str = None) -> ImageProvider:
+    name = name or config.IMAGE_PROVIDER
+    try:
+        return providers[name]
+    except KeyError:
+        raise ProviderError(f"Unknown IMAGE_PROVIDER {name!r}, expected one of {sorted(providers)}") from None
+
+
+async def generate_hedged(provider: ImageProvider, prompt: str, attempts: int = 1, hedge_after: float = None) -> str:
+    """provider.generate(prompt), tried up to attempts times. See the module docstring."""
+    pending = set()
+    started = 0
+    error = None
+    try:
+        while True:
+            if started < attempts:
+                pending.add(asyncio.ensure_future(provider.generate(prompt)))
+                started += 1
+                if started > 1:
+                    provider.stats.counts["retries"] += 1
+            elif not pending:
+                raise error
+            wait_for = hedge_after if started < attempts else None
+            done, pending = await asyncio.wait(pending, timeout=wait_for, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    return task.result()
+                error = task.exception()
+            # Round again: a failure, or no answer within hedge_after, starts the next attempt.
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+def stats() -> dict:
+    return {name: provider.stats.summary() for name, provider in providers.items()}
+
+
+local_provider = register(
+    LocalImageProvider(
+        config.IMAGE_PROVIDER_TIMEOUT,
+        config.MEDIA_DIR,
+        config.MEDIA_URL,
+        config.LOCAL_IMAGE_WORKERS,
+        config.LOCAL_IMAGE_DELAY,
+    )
+)
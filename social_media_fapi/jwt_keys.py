@@ -0,0 +1,131 @@
+"""
+Signing and verifying our JWTs with keys that are parsed once, when the worker starts.
+
+With an HS algorithm (the default) the SECRET_KEY is used. With ES256 (or RS256) the private keys
+are the <kid>.pem files in JWT_KEYS_DIR: new tokens are signed with JWT_ACTIVE_KID and carry it
+in their "kid" header, and tokens signed with any key still in the directory are accepted.
+To rotate, add a new key, make it the active one, and delete the old file once its tokens have expired.
+The public keys are published at /.well-known/jwks.json
+
+To generate a new ES256 key:
+    python -m social_media_fapi.jwt_keys keys/ 2025-01
+"""
+import binascii
+import json
+import pathlib
+import sys
+import time
+from typing import Any, Optional
+
+from jose import jwk, jwt
+from jose.backends.base import Key
+from jose.exceptions import ExpiredSignatureError, JWTError
+from jose.utils import base64url_decode
+
+
+class JWTKeys:
+    def __init__(
+        self,
+        algorithm: str,
+        secret_key: Optional[str] = None,
+        keys_dir: Optional[str] = None,
+        active_kid: Optional[str] = None,
+    ) -> None:
+        self.algorithm = algorithm
+        self.active_kid = active_kid
+        self._keys: dict[Optional[str], Key] = {}
+
+        if algorithm.startswith("HS"):
+            self._keys[None] = jwk.construct(secret_key, algorithm)
+            self.active_kid = None
+        else:
+            for path in sorted(pathlib.Path(keys_dir).glob("*.pem")):
+                self._keys[path.stem] = jwk.construct(path.read_text(), algorithm)
+            if self.active_kid not in self._keys:
+                raise ValueError(f"JWT_ACTIVE_KID {active_kid!r} is not one of the keys in {keys_dir}")
+
+        self._signing_key = self._keys[self.active_kid]
+        # Verifying only needs the public half (for HS there is only the one key).
+        self._verify_keys = {
+            kid: key if algorithm.startswith("HS") else key.public_key() for kid, key in self._keys.items()
+        }
+        # Nearly every token has one of a handful of headers, so remember which key each one uses.
+        self._header_keys: dict[str, Key] = {}
+
+    def encode(self, claims: dict[str, Any]) -> str:
+        headers = {"kid": self.active_kid} if self.active_kid else None
+        return jwt.encode(claims, self._signing_key, algorithm=self.algorithm, headers=headers)
+
+    def decode(self, token: str) -> dict[str, Any]:
+        """
+        Checks the signature and expiry and returns the claims.
+        Raises the same errors as jose.jwt.decode (JWTError, ExpiredSignatureError).
+        """
+        try:
+            signing_input, signature_segment = token.rsplit(".", 1)
+            header_segment, claims_segment = signing_input.split(".", 1)
+            signature = base64url_decode(signature_segment.encode())
+        except (ValueError, binascii.Error) as e:
+            raise JWTError("Invalid token") from e
+
+        key = self._header_keys.get(header_segment) or self._key_for_header(header_segment)
+        if not key.verify(signing_input.encode(), signature):
+            raise JWTError("Signature verification failed")
+
+        try:
+            claims = json.loads(base64url_decode(claims_segment.encode()))
+        except (ValueError, binascii.Error) as e:
+            raise JWTError("Invalid payload") from e
+        if not isinstance(claims, dict):
+            raise JWTError("Invalid payload")
+
+        expire = claims.get("exp")
+        if expire is not None:
+            if not isinstance(expire, (int, float)):
+                raise JWTError("Expiration Time claim (exp) must be an integer")
+            if expire < time.time():
+                raise ExpiredSignatureError("Signature has expired")
+        return claims
+
+    def _key_for_header(self, header_segment: str) -> Key:
+        try:
+            header = json.loads(base64url_decode(header_segment.encode()))
+        except (ValueError, binascii.Error) as e:
+            raise JWTError("Invalid header") from e
+        if not isinstance(header, dict) or header.get("alg") != self.algorithm:
+            raise JWTError("The specified alg value is not allowed")
+        # Tokens from before a kid was used are checked with the active key.
+        key = self._verify_keys.get(header.get("kid", self.active_kid))
+        if key is None:
+            raise JWTError("Unknown key id")
+        if len(self._header_keys) < 64:
+            self._header_keys[header_segment] = key
+        return key
+
+    def jwks(self) -> dict[str, list]:
+        """The public keys as a JSON Web Key Set. It's empty for HS algorithms, the secret is never published."""
+        if self.algorithm.startswith("HS"):
+            return {"keys": []}
+        return {
+            "keys": [
+                {**key.to_dict(), "kid": kid, "use": "sig", "alg": self.algorithm}
+                for kid, key in self._verify_keys.items()
+            ]
+        }
+
+
+def generate_key(keys_dir: str, kid: str) -> pathlib.Path:
+    """Create a new ES256 (P-256) private key in keys_dir/<kid>.pem"""
+    import ecdsa
+
+    path = pathlib.Path(keys_dir) / f"{kid}.pem"
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(ecdsa.SigningKey.generate(curve=ecdsa.NIST256p).to_pem())
+    path.chmod(0o600)
+    return path
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        sys.exit("Usage: python -m social_media_fapi.jwt_keys <keys_dir> <kid>")
+    print(f"Created {generate_key(sys.argv[1], sys.argv[2])}")
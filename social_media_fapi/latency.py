@@ -0,0 +1,23 @@
+"""Latencies of calls to other services (image providers, B2), for the stats endpoints."""
+import statistics
+from collections import Counter, deque
+
+
+class LatencyStats:
+    def __init__(self, samples: int = 1000) -> None:
+        # Only the recent calls, so the percentiles follow how the service is doing now.
+        self._samples: deque[float] = deque(maxlen=samples)
+        self.counts = Counter()
+
+    def record(self, seconds: float, outcome: str) -> None:
+        self._samples.append(seconds)
+        self.counts["calls"] += 1
+        self.counts[outcome] += 1
+
+    def summary(self) -> dict:
+        summary = dict(self.counts)
+        if len(self._samples) >= 2:
+            percentiles = statistics.quantiles(self._samples, n=100)
+            summary["p50_ms"] = round(percentiles[49] * 1000, 1)
+            summary["p95_ms"] = round(percentiles[94] * 1000, 1)
+        return summary
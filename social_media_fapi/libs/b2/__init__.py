@@ -1,40 +1,183 @@
+"""
+Backblaze B2 from async code. b2sdk is blocking, so its calls run on a thread pool of our own
+(B2_UPLOAD_THREADS), big uploads then can't use up the default pool that asyncio.to_thread shares
+with everything else.
+
+B2 account tokens last 24 hours. The app authorises when it starts (main.warm_up) and again every
+B2_AUTH_REFRESH_INTERVAL in the background (watch_refresh), swapping in the new API object when it's
+ready, so requests never wait for it. Each kind of call keeps its latencies, see B2Client.stats().
+"""
+import asyncio
 import logging
-from functools import lru_cache
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional
+from urllib.parse import parse_qs, urlparse
 
 import b2sdk.v2 as b2
+from b2sdk.v2.exception import FileNotPresent
 
+from social_media_fapi import cache_sync
 from social_media_fapi.config import config
+from social_media_fapi.latency import LatencyStats
 
 logger = logging.getLogger(__name__)
 
 
-@lru_cache()  # This will cache the funtion return value as it never changes. (no params etc)
-def b2_api():
-    logger.debug("Creating and authorising B2 API")
-    info = b2.InMemoryAccountInfo()
-    b2_api = b2.B2Api(info)
+class B2Client:
+    def __init__(self, upload_threads: int) -> None:
+        self.upload_threads = upload_threads
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._api: Optional[b2.B2Api] = None
+        self._bucket: Optional[b2.Bucket] = None
+        self._lock: Optional[asyncio.Lock] = None
+        self.authorized_at: Optional[float] = None
+        self.latency: dict[str, LatencyStats] = {}
+
+    def _run_in_executor(self, fn: Callable, *args):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.upload_threads, thread_name_prefix="b2")
+        return asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    @staticmethod
+    def _authorize() -> tuple[b2.B2Api, b2.Bucket]:
+        info = b2.InMemoryAccountInfo()
+        api = b2.B2Api(info)
+        api.authorize_account("production", config.B2_KEY_ID, config.B2_APPLICATION_KEY)
+        return api, api.get_bucket_by_name(config.B2_BUCKET_NAME)
+
+    async def authorize(self, force: bool = True) -> None:
+        """A new account token. Calls already running keep the old API object, they finish on that."""
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            if not force and self._api is not None:
+                # Another call authorised while this one waited for the lock.
+                return
+            logger.debug("Authorising B2")
+            self._api, self._bucket = await self._call("authorize", self._authorize)
+            self.authorized_at = time.time()
+
+    async def _authorized(self) -> tuple[b2.B2Api, b2.Bucket]:
+        if self._api is None:
+            # Not done at start up (or it failed then), so the first call pays for it.
+            await self.authorize(force=False)
+        return self._api, self._bucket
+
+    async def _call(self, name: str, fn: Callable, *args):
+        stats = self.latency.setdefault(name, LatencyStats())
+        start = time.perf_counter()
+        try:
+            result = await self._run_in_executor(fn, *args)
+        except Exception:
+            stats.record(time.perf_counter() - start, "errors")
+            raise
+        stats.record(time.perf_counter() - start, "ok")
+        return result
+
+    async def upload_file(
+        self, local_file: str, file_name: str, content_type: Optional[str] = None, sha1_sum: Optional[str] = None
+    ) -> str:
+        """With sha1_sum b2sdk doesn't read the file an extra time to work it out, and B2 still checks it."""
+        api, bucket = await self._authorized()
+        logger.debug(f"Uploading {local_file} to B2 as {file_name}")
+        uploaded_file = await self._call(
+            "upload_file",
+            lambda: bucket.upload_local_file(
+                local_file=local_file, file_name=file_name, content_type=content_type, sha1_sum=sha1_sum
+            ),
+        )
+        download_url = api.get_download_url_for_fileid(uploaded_file.id_)
+        logger.debug(f"Uploaded {local_file} to B2 successfully and got download URL {download_url}")
+        return download_url
+
+    async def upload_bytes(self, data: bytes, file_name: str, content_type: str = "b2/x-auto") -> str:
+        api, bucket = await self._authorized()
+        logger.debug(f"Uploading {len(data)} bytes to B2 as {file_name}")
+        uploaded_file = await self._call(
+            "upload_bytes", lambda: bucket.upload_bytes(data, file_name, content_type=content_type)
+        )
+        return api.get_download_url_for_fileid(uploaded_file.id_)
+
+    async def upload_authorization(self) -> tuple[str, str]:
+        """An upload URL and its token, so a client can upload to the bucket without going through us."""
+        api, bucket = await self._authorized()
+        upload = await self._call("get_upload_url", api.session.get_upload_url, bucket.id_)
+        return upload["uploadUrl"], upload["authorizationToken"]
+
+    async def file_by_name(self, file_name: str) -> Optional[tuple[str, int, str]]:
+        """The download URL, size and content type of the file, None if nothing was uploaded with that name."""
+        api, bucket = await self._authorized()
+        try:
+            file_version = await self._call("get_file_info", bucket.get_file_info_by_name, file_name)
+        except FileNotPresent:
+            return None
+        return api.get_download_url_for_fileid(file_version.id_), file_version.size, file_version.content_type
+
+    async def delete_file_by_url(self, url: str) -> bool:
+        file_id = b2_file_id_from_url(url)
+        if file_id is None:
+            return False
+        api, _ = await self._authorized()
+
+        def delete():
+            file_version = api.get_file_info(file_id)
+            logger.debug(f"Deleting {file_version.file_name} from B2")
+            api.delete_file_version(file_id, file_version.file_name)
+
+        await self._call("delete_file", delete)
+        return True
+
+    async def watch_refresh(self, interval: float) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.authorize()
+            except Exception:
+                # The old token is good until it's 24 hours old, and b2sdk authorises again itself after that.
+                logger.exception("Could not refresh the B2 authorisation")
+
+    def reset(self) -> None:
+        # The next call authorises again, e.g. after the keys changed.
+        self._api = self._bucket = None
+
+    def stats(self) -> dict:
+        return {
+            "authorized_at": self.authorized_at,
+            "upload_threads": self.upload_threads,
+            "calls": {name: stats.summary() for name, stats in self.latency.items()},
+        }
+
+    def close(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+b2_client = B2Client(config.B2_UPLOAD_THREADS)
 
-    b2_api.authorize_avccount("production", config.B2_KEY_ID, config.B2_APPLICATION_KEY)
+# Each worker process has its own client, see cache_sync.py
+cache_sync.register(b2_client.reset)
 
-    return b2_api
 
+async def b2_upload_file(
+    local_file: str, file_name: str, content_type: Optional[str] = None, sha1_sum: Optional[str] = None
+) -> str:
+    return await b2_client.upload_file(local_file, file_name, content_type, sha1_sum)
 
-@lru_cache()
-def b2_get_bucket(api: b2.B2Api):
-    return api.get_bucket_by_name(config.B2_BUCKET_NAME)
 
+async def b2_upload_bytes(data: bytes, file_name: str, content_type: str = "b2/x-auto") -> str:
+    return await b2_client.upload_bytes(data, file_name, content_type)
 
-def b2_upload_file(local_file: str, file_name: str) -> str:
-    api = b2_api()
-    logger.debug(f"Uploading {local_file} to B2 as {file_name}")
 
-    uploaded_file = b2_get_bucket(api).upload_local_file(
-        local_file=local_file, file_name=file_name
-    )
+def b2_file_id_from_url(url: str) -> str | None:
+    """The file id in a download URL from b2_upload_file, None if the URL isn't one of ours."""
+    parsed = urlparse(url)
+    if not parsed.path.endswith("/b2_download_file_by_id"):
+        return None
+    return parse_qs(parsed.query).get("fileId", [None])[0]
 
-    download_url = api.get_download_url_for_fileid(uploaded_file.id_)
-    logger.debug(
-        f"Uploading {local_file} to B2 successfully ad got download URL {download_url}"
-    )
 
-    return download_url
+async def b2_delete_file_by_url(url: str) -> bool:
+    """Deletes the file behind a download URL. Returns False if it isn't a B2 file (nothing to delete)."""
+    return await b2_client.delete_file_by_url(url)
@@ -1,7 +1,26 @@
 import logging
+import queue
+import random
 from logging.config import dictConfig
+from logging.handlers import QueueHandler, QueueListener
 
-from social_media_fapi.config import DevConfig, ProdConfig, config
+from asgi_correlation_id import CorrelationIdFilter as BaseCorrelationIdFilter
+
+from social_media_fapi.config import Changes, DevConfig, ProdConfig, config, on_reload
+
+# These loggers have their handlers moved behind a queue, so formatting, file writes and
+# the Logtail network calls happen on a listener thread instead of the event loop.
+QUEUED_LOGGERS = (
+    "uvicorn",
+    "social_media_fapi",
+    "social_media_fapi.slow_query",
+    "databases",
+    "aiosqlite",
+)
+
+_listeners: list[QueueListener] = []
+# Kept so a config reload can change them in place, see apply_config.
+_sampling_filters: list["SamplingFilter"] = []
 
 
 def obfuscated(email: str, obfuscated_length: int) -> str:
@@ -21,79 +40,215 @@ class EmailObfuscationFilter(logging.Filter):
         return True  # True means the log will be saved, False means the log will be rejeted.
 
 
+class CorrelationIdFilter(BaseCorrelationIdFilter):
+    """
+    The correlation id lives in a context variable, which is only set on the event loop.
+    The queue handler stamps it onto the record before it is queued, so on the listener
+    thread we must keep that value rather than overwrite it with the default.
+    """
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if hasattr(record, "correlation_id"):
+            return True
+        return super().filter(record)
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Under high load (the log queue is backing up) only keep a sample of the DEBUG and INFO logs.
+    WARNING and above are always kept.
+    """
+
+    def __init__(
+        self,
+        name: str = "",
+        sample_rate: float = 1.0,
+        high_water: int = 0,
+        log_queue: queue.Queue | None = None,
+    ) -> None:
+        super().__init__(name)
+        self.sample_rate = sample_rate
+        self.high_water = high_water
+        self.log_queue = log_queue
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING or self.sample_rate >= 1.0:
+            return True
+        if self.log_queue is not None and self.log_queue.qsize() < self.high_water:
+            return True
+        return random.random() < self.sample_rate
+
+
+class LazyQueueHandler(QueueHandler):
+    """
+    The standard QueueHandler formats the message before queuing it so the record can be pickled.
+    Our queue never leaves the process, so we queue the record as is and the message
+    (e.g. the SQL of a query) is only rendered by the listener thread.
+    """
+
+    def __init__(self, log_queue: queue.Queue) -> None:
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            # Never block the event loop on logging, drop the record instead.
+            self.dropped += 1
+
+
 handlers = ["default", "rotating_file"]
 if isinstance(config, ProdConfig):  # or whatever "non-dev" means
     handlers.append("logtail")
 
 
+def log_level() -> str:
+    return config.LOG_LEVEL or ("DEBUG" if isinstance(config, DevConfig) else "INFO")
+
+
+def access_log_level() -> str:
+    # A log per request is expensive under load, so it is off unless UVICORN_ACCESS_LOG is set.
+    return "INFO" if config.UVICORN_ACCESS_LOG else "WARNING"
+
+
 def configure_logging() -> None:
-    dictConfig(
-        {
-            "version": 1,
-            "disable_existing_loggers": False,
-            "filters": {
-                "correlation_id": {
-                    "()": "asgi_correlation_id.CorrelationIdFilter",
-                    "uuid_length": 8 if isinstance(config, DevConfig) else 32,
-                    "default_value": "-",
-                    # So the () above acts like the folloiwng:
-                    # filter = asgi_correlation_id.CorrelationIdFilter(uuid_length=8, default_value="-")
-                },
-                "email_obfuscation": {
-                    "()": EmailObfuscationFilter,
-                    "obfuscated_length": 2 if isinstance(config, DevConfig) else 0,
-                },
+    stop_logging()
+    logging_config = {
+        "version": 1,
+        "disable_existing_loggers": False,
+        "filters": {
+            "correlation_id": {
+                "()": CorrelationIdFilter,
+                "uuid_length": 8 if isinstance(config, DevConfig) else 32,
+                "default_value": "-",
+                # So the () above acts like the folloiwng:
+                # filter = asgi_correlation_id.CorrelationIdFilter(uuid_length=8, default_value="-")
+            },
+            "email_obfuscation": {
+                "()": EmailObfuscationFilter,
+                "obfuscated_length": 2 if isinstance(config, DevConfig) else 0,
+            },
+        },
+        "formatters": {
+            "console": {
+                "class": "logging.Formatter",
+                "datefmt": "%Y-%m-%dT%H:%M:%S",
+                "format": "(%(correlation_id)s) %(name)s:%(lineno)d - %(message)s",
+            },
+            "file": {
+                "class": "pythonjsonlogger.jsonlogger.JsonFormatter",
+                "datefmt": "%Y-%m-%dT%H:%M:%S",
+                # "%(asctime)s.%(msec)03dZ  - Is the ISO standard for the date/time.
+                # "format": "%(asctime)s.%(msecs)03dZ | %(levelname)-8s | [%(correlation_id)s] %(name)s:%(lineno)d - %(message)s"  # The -8s means pad with up to 8 characters so it is always 8 characters long.
+                # For the json output all we need are the fields in the format.
+                "format": "%(asctime)s %(msecs)03d %(levelname)-8s %(correlation_id)s %(name)s:%(lineno)d %(message)s",
+            },
+        },
+        "handlers": {
+            "default": {
+                "class": "rich.logging.RichHandler",
+                "level": "DEBUG",
+                "formatter": "console",
+                "filters": ["correlation_id", "email_obfuscation"],
+            },
+            "rotating_file": {
+                "class": "logging.handlers.RotatingFileHandler",
+                "level": "DEBUG",
+                "formatter": "file",
+                "filename": "social_media_fapi.log",
+                "maxBytes": 1024 * 1024 * 1,  # 1MB size
+                "backupCount": 2,  # It will delete the old files when the number of files get to this count.
+                "encoding": "utf8",
+                "filters": ["correlation_id"],
+            },
+            "slow_query_file": {
+                "class": "logging.handlers.RotatingFileHandler",
+                "level": "WARNING",
+                "formatter": "file",
+                "filename": "slow_queries.log",
+                "maxBytes": 1024 * 1024 * 1,  # 1MB size
+                "backupCount": 2,
+                "encoding": "utf8",
+                "filters": ["correlation_id"],
             },
-            "formatters": {
-                "console": {
-                    "class": "logging.Formatter",
-                    "datefmt": "%Y-%m-%dT%H:%M:%S",
-                    "format": "(%(correlation_id)s) %(name)s:%(lineno)d - %(message)s",
-                },
-                "file": {
-                    "class": "pythonjsonlogger.jsonlogger.JsonFormatter",
-                    "datefmt": "%Y-%m-%dT%H:%M:%S",
-                    # "%(asctime)s.%(msec)03dZ  - Is the ISO standard for the date/time.
-                    # "format": "%(asctime)s.%(msecs)03dZ | %(levelname)-8s | [%(correlation_id)s] %(name)s:%(lineno)d - %(message)s"  # The -8s means pad with up to 8 characters so it is always 8 characters long.
-                    # For the json output all we need are the fields in the format.
-                    "format": "%(asctime)s %(msecs)03d %(levelname)-8s %(correlation_id)s %(name)s:%(lineno)d %(message)s",
-                },
+            "logtail": {
+                "class": "logtail.LogtailHandler",
+                "level": "DEBUG",
+                "formatter": "console",
+                "filters": ["correlation_id", "email_obfuscation"],
+                "source_token": config.LOGTAIL_API_KEY,
+                "host": config.LOGTAIL_HOST,
             },
-            "handlers": {
-                "default": {
-                    "class": "rich.logging.RichHandler",
-                    "level": "DEBUG",
-                    "formatter": "console",
-                    "filters": ["correlation_id", "email_obfuscation"],
-                },
-                "rotating_file": {
-                    "class": "logging.handlers.RotatingFileHandler",
-                    "level": "DEBUG",
-                    "formatter": "file",
-                    "filename": "social_media_fapi.log",
-                    "maxBytes": 1024 * 1024 * 1,  # 1MB size
-                    "backupCount": 2,  # It will delete the old files when the number of files get to this count.
-                    "encoding": "utf8",
-                    "filters": ["correlation_id"],
-                },
-                "logtail": {
-                    "class": "logtail.LogtailHandler",
-                    "level": "DEBUG",
-                    "formatter": "console",
-                    "filters": ["correlation_id", "email_obfuscation"],
-                    "source_token": config.LOGTAIL_API_KEY,
-                    "host": config.LOGTAIL_HOST,
-                },
+        },
+        "loggers": {
+            "uvicorn": {"handlers": ["default", "rotating_file"], "level": "INFO"},
+            "uvicorn.access": {"level": access_log_level()},
+            "social_media_fapi": {
+                "handlers": handlers,
+                "level": log_level(),
+                "propagate": False,  # Don't send any loggers up to the root logger # root.social_media_fapi.routers.post
             },
-            "loggers": {
-                "uvicorn": {"handlers": ["default", "rotating_file"], "level": "INFO"},
-                "social_media_fapi": {
-                    "handlers": handlers,
-                    "level": "DEBUG" if isinstance(config, DevConfig) else "INFO",
-                    "propagate": False,  # Don't send any loggers up to the root logger # root.social_media_fapi.routers.post
-                },
-                "databases": {"handlers": ["default"], "level": "WARNING"},
-                "aiosqlite": {"handlers": ["default"], "level": "WARNING"},
+            # The extra fields (statement, param_shapes, plan...) are added to the JSON by the file formatter.
+            "social_media_fapi.slow_query": {
+                "handlers": ["slow_query_file"],
+                "level": "WARNING",
+                "propagate": False,
             },
-        }
+            "databases": {"handlers": ["default"], "level": "WARNING"},
+            "aiosqlite": {"handlers": ["default"], "level": "WARNING"},
+        },
+    }
+    if "logtail" not in handlers:
+        # dictConfig creates every handler listed, and the Logtail one fails without a host.
+        del logging_config["handlers"]["logtail"]
+    dictConfig(logging_config)
+
+    for name in QUEUED_LOGGERS:
+        _queue_logger(logging.getLogger(name))
+
+
+def _queue_logger(logger: logging.Logger) -> None:
+    log_queue = queue.Queue(maxsize=config.LOG_QUEUE_SIZE)
+    handler = LazyQueueHandler(log_queue)
+    # This has to run before the record is queued, the correlation id is not available on the listener thread.
+    sampling_filter = SamplingFilter(
+        sample_rate=config.LOG_SAMPLE_RATE,
+        high_water=config.LOG_SAMPLE_HIGH_WATER,
+        log_queue=log_queue,
     )
+    handler.addFilter(sampling_filter)
+    _sampling_filters.append(sampling_filter)
+    handler.addFilter(
+        CorrelationIdFilter(
+            uuid_length=8 if isinstance(config, DevConfig) else 32, default_value="-"
+        )
+    )
+
+    listener = QueueListener(log_queue, *logger.handlers, respect_handler_level=True)
+    logger.handlers = [handler]
+    listener.start()
+    _listeners.append(listener)
+
+
+def stop_logging() -> None:
+    # Stopping the listener processes anything left in the queue before returning.
+    while _listeners:
+        _listeners.pop().stop()
+    _sampling_filters.clear()
+
+
+@on_reload
+def apply_config(changed: Changes) -> None:
+    """The log settings that can change without configuring logging again (and restarting the listeners)."""
+    if "LOG_SAMPLE_RATE" in changed or "LOG_SAMPLE_HIGH_WATER" in changed:
+        for sampling_filter in _sampling_filters:
+            sampling_filter.sample_rate = config.LOG_SAMPLE_RATE
+            sampling_filter.high_water = config.LOG_SAMPLE_HIGH_WATER
+    if "LOG_LEVEL" in changed:
+        logging.getLogger("social_media_fapi").setLevel(log_level())
+    if "UVICORN_ACCESS_LOG" in changed:
+        logging.getLogger("uvicorn.access").setLevel(access_log_level())
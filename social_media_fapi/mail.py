@@ -0,0 +1,112 @@
+"""
+Sending email over SMTP, for MAIL_TRANSPORT=smtp (the default sends through the Mailgun HTTP API, see
+tasks.send_simple_email).
+
+Opening an SMTP connection (TCP, EHLO, maybe STARTTLS and login) costs more than sending a short
+message on it, so the connections are kept open and reused: at most SMTP_POOL_SIZE of them, which is
+also how many messages are sent at once. smtplib is blocking, so the sending happens in threads.
+"""
+import asyncio
+import contextlib
+import logging
+import smtplib
+from email.message import EmailMessage
+from functools import lru_cache
+from typing import Optional
+
+from social_media_fapi import cache_sync
+from social_media_fapi.config import config
+from social_media_fapi.tls import ssl_context
+
+logger = logging.getLogger(__name__)
+
+
+def build_message(sender: str, to_email: str, subject: str, body: str) -> EmailMessage:
+    message = EmailMessage()
+    message["From"] = sender
+    message["To"] = to_email
+    message["Subject"] = subject
+    message.set_content(body)
+    return message
+
+
+class SMTPPool:
+    def __init__(
+        self,
+        host: str,
+        port: int,
+        size: int,
+        username: Optional[str] = None,
+        password: Optional[str] = None,
+        starttls: bool = False,
+        timeout: float = 30,
+    ) -> None:
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.starttls = starttls
+        self.timeout = timeout
+        self._semaphore = asyncio.Semaphore(size)
+        # Only touched from the event loop, a connection is in here or in use by exactly one thread.
+        self._idle: list[smtplib.SMTP] = []
+        self.connects = 0
+
+    def _connect(self) -> smtplib.SMTP:
+        connection = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        if self.starttls:
+            connection.starttls(context=ssl_context())
+        if self.username:
+            connection.login(self.username, self.password)
+        self.connects += 1
+        return connection
+
+    def _send(self, connection: Optional[smtplib.SMTP], message: EmailMessage) -> smtplib.SMTP:
+        if connection is None:
+            connection = self._connect()
+        try:
+            connection.send_message(message)
+        except smtplib.SMTPServerDisconnected:
+            # The server closed it while it was idle, one more go on a new connection.
+            connection = self._connect()
+            connection.send_message(message)
+        return connection
+
+    async def send(self, message: EmailMessage) -> None:
+        async with self._semaphore:
+            connection = self._idle.pop() if self._idle else None
+            try:
+                connection = await asyncio.to_thread(self._send, connection, message)
+            except Exception:
+                # We can't know what state it's in, it's not going back in the pool.
+                if connection is not None:
+                    await asyncio.to_thread(self._quit, connection)
+                raise
+            self._idle.append(connection)
+
+    @staticmethod
+    def _quit(connection: smtplib.SMTP) -> None:
+        with contextlib.suppress(smtplib.SMTPException, OSError):
+            connection.quit()
+
+    async def close(self) -> None:
+        idle, self._idle = self._idle, []
+        for connection in idle:
+            await asyncio.to_thread(self._quit, connection)
+
+
+@lru_cache()
+def smtp_pool() -> SMTPPool:
+    return SMTPPool(
+        config.SMTP_HOST,
+        config.SMTP_PORT,
+        config.SMTP_POOL_SIZE,
+        username=config.SMTP_USERNAME,
+        password=config.SMTP_PASSWORD,
+        starttls=config.SMTP_STARTTLS,
+        timeout=config.SMTP_TIMEOUT,
+    )
+
+
+# Each worker process has its own pool, see cache_sync.py. The old connections close when the server drops them.
+cache_sync.register(smtp_pool.cache_clear)
@@ -0,0 +1,115 @@
+"""
+A stand-in for the mail servers, for development and load tests. It accepts every message, counts
+it and throws it away:
+
+    SMTP on --smtp-port  MAIL_TRANSPORT=smtp SMTP_HOST=localhost SMTP_PORT=1025 SMTP_STARTTLS=false
+    HTTP on --http-port  the Mailgun messages API, MAILGUN_BASE_URL=http://localhost:8025/v3
+                         GET /stats has the counts.
+
+--latency adds that many seconds to every message, to see how the app copes with slow delivery.
+
+Run from the top social_media_fapi directory:
+    python -m social_media_fapi.mail_sink --latency 0.5
+"""
+import argparse
+import asyncio
+import logging
+from collections import Counter
+
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+
+logger = logging.getLogger(__name__)
+
+
+class MailSink:
+    def __init__(self, latency: float = 0.0) -> None:
+        self.latency = latency
+        self.counts = Counter()
+
+    async def received(self, transport: str, size: int) -> None:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        self.counts[f"{transport}_messages"] += 1
+        self.counts["bytes"] += size
+
+    async def handle_smtp(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """Just enough SMTP for smtplib: no auth, no TLS, and the message is read but not parsed."""
+        self.counts["smtp_connections"] += 1
+
+        async def reply(*lines: str) -> None:
+            # Multi-line replies have a - after the code on every line but the last.
+            for number, line in enumerate(lines, start=1):
+                separator = " " if number == len(lines) else "-"
+                writer.write(f"{line[:3]}{separator}{line[4:]}\r\n".encode())
+            await writer.drain()
+
+        try:
+            await reply("220 mail_sink ready")
+            while line := await reader.readline():
+                verb = line[:4].decode(errors="replace").upper()
+                if verb == "EHLO":
+                    await reply("250 mail_sink", "250 8BITMIME")
+                elif verb in ("HELO", "MAIL", "RCPT", "RSET", "NOOP"):
+                    await reply("250 OK")
+                elif verb == "DATA":
+                    await reply("354 End data with <CR><LF>.<CR><LF>")
+                    size = 0
+                    while (data := await reader.readline()) not in (b".\r\n", b".\n", b""):
+                        size += len(data)
+                    await self.received("smtp", size)
+                    await reply("250 OK queued")
+                elif verb == "QUIT":
+                    await reply("221 Bye")
+                    break
+                else:
+                    await reply("502 Command not implemented")
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    def http_app(self) -> Starlette:
+        async def messages(request: Request) -> JSONResponse:
+            body = await request.body()
+            await self.received("http", len(body))
+            return JSONResponse({"id": f"<{self.counts['http_messages']}@mail_sink>", "message": "Queued. Thank you."})
+
+        async def stats(request: Request) -> JSONResponse:
+            return JSONResponse(dict(self.counts))
+
+        return Starlette(
+            routes=[
+                Route("/v3/{domain}/messages", messages, methods=["POST"]),
+                Route("/stats", stats),
+            ]
+        )
+
+    async def start_smtp(self, host: str = "127.0.0.1", port: int = 1025) -> asyncio.Server:
+        """Starts the SMTP server, port 0 picks a free one (see server.sockets[0].getsockname())."""
+        return await asyncio.start_server(self.handle_smtp, host, port)
+
+
+async def main(args) -> None:
+    import uvicorn
+
+    sink = MailSink(latency=args.latency)
+    smtp_server = await sink.start_smtp(args.host, args.smtp_port)
+    http_server = uvicorn.Server(
+        uvicorn.Config(sink.http_app(), host=args.host, port=args.http_port, log_level="warning")
+    )
+    print(f"SMTP on {args.host}:{args.smtp_port}, HTTP on http://{args.host}:{args.http_port}/v3, latency {args.latency}s")
+    async with smtp_server:
+        await http_server.serve()
+    print(dict(sink.counts))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--smtp-port", type=int, default=1025)
+    parser.add_argument("--http-port", type=int, default=8025)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added to every message")
+    asyncio.run(main(parser.parse_args()))
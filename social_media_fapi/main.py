@@ -1,34 +1,88 @@
+import asyncio
 import logging
 from contextlib import asynccontextmanager
+from urllib.parse import urlparse
 
 from fastapi import FastAPI, HTTPException
 from fastapi.exception_handlers import http_exception_handler
+from fastapi.staticfiles import StaticFiles
 from asgi_correlation_id import CorrelationIdMiddleware
 
+from social_media_fapi import cache_sync, cleanup, image_providers, stats
+from social_media_fapi.compression import CompressionMiddleware
+from social_media_fapi.config import config
 from social_media_fapi.database import database
-from social_media_fapi.logging_conf import configure_logging
+from social_media_fapi.libs.b2 import b2_client
+from social_media_fapi.logging_conf import configure_logging, stop_logging
+from social_media_fapi.mail import smtp_pool
+from social_media_fapi.passwords import configure_password_hashing
+from social_media_fapi.routers.events import router as events_router
 from social_media_fapi.routers.post import router as post_router
 from social_media_fapi.routers.upload import router as upload_router
 from social_media_fapi.routers.user import router as user_router
+from social_media_fapi.security import get_token_keys, load_revoked_tokens, watch_token_denylist
+from social_media_fapi.tls import ssl_context
 
 logger = logging.getLogger(__name__)
 
 
+async def warm_up():
+    # Each worker does its slow first time work here, rather than in the first requests it gets.
+    await database.fetch_one("SELECT 1")
+    await load_revoked_tokens()
+    get_token_keys()
+    await asyncio.to_thread(ssl_context)
+    await asyncio.to_thread(configure_password_hashing, config.PASSWORD_HASH_TARGET_MS)
+    if config.B2_KEY_ID:
+        try:
+            await b2_client.authorize()
+        except Exception:
+            # The first B2 call will try to authorise again, so this shouldn't stop the worker starting.
+            logger.exception("Could not authorise B2 during warm up")
+
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     configure_logging()
     await database.connect()
+    await warm_up()
+    background = [
+        asyncio.create_task(cache_sync.watch()),
+        asyncio.create_task(watch_token_denylist(config.TOKEN_DENYLIST_SYNC_INTERVAL)),
+        asyncio.create_task(cleanup.watch_cleanup(config.CLEANUP_INTERVAL, config.CLEANUP_BATCH_SIZE)),
+    ]
+    if config.STATS_RECONCILE_INTERVAL:
+        background.append(asyncio.create_task(stats.watch_reconcile(config.STATS_RECONCILE_INTERVAL)))
+    if config.B2_KEY_ID:
+        background.append(asyncio.create_task(b2_client.watch_refresh(config.B2_AUTH_REFRESH_INTERVAL)))
     yield
+    for task in background:
+        task.cancel()
+    image_providers.local_provider.close()
+    b2_client.close()
+    if config.MAIL_TRANSPORT == "smtp":
+        await smtp_pool().close()
     await database.disconnect()
+    stop_logging()
 
 
 app = FastAPI(lifespan=lifespan)
 app.add_middleware(CorrelationIdMiddleware)
+app.add_middleware(CompressionMiddleware, minimum_size=config.COMPRESSION_MINIMUM_SIZE)
 
 
+app.include_router(events_router)
 app.include_router(post_router)
 app.include_router(upload_router)
 app.include_router(user_router)
+# What we store ourselves, e.g. the images of the local image provider. check_dir because it's made on first use.
+app.mount(urlparse(config.MEDIA_URL).path, StaticFiles(directory=config.MEDIA_DIR, check_dir=False), name="media")
+
+@app.get("/.well-known/jwks.json")
+async def jwks():
+    # The public keys clients (or other services) can use to check our tokens.
+    return get_token_keys().jwks()
+
 
 @app.exception_handler(HTTPException)
 async def http_exception_handle_logger(request, exc):
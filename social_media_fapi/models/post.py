@@ -12,6 +12,10 @@ class UserPost(UserPostIn):
     id: int
     user_id: int
     image_url: Optional[str] = None
+    # Only for posts created with a media file, see post_media.py
+    media_status: Optional[str] = None
+    thumbnail_url: Optional[str] = None
+    created_at: Optional[int] = None  # Unix time
 
 
 class UserPostWithLikes(UserPost):
@@ -22,12 +26,26 @@ class UserPostWithLikes(UserPost):
 class CommentIn(BaseModel):
     body: str
     post_id: int
+    # Set it to reply to another comment on the same post.
+    parent_id: Optional[int] = None
 
 
 class Comment(CommentIn):
     model_config = ConfigDict(from_attributes=True)
     id: int
     user_id: int
+    depth: int = 0
+
+
+class ThreadComment(Comment):
+    # The direct replies, some of which may not have been returned yet.
+    reply_count: int
+
+
+class CommentPage(BaseModel):
+    comments: list[ThreadComment]
+    # Pass it back as ?cursor= to get the next page, None when there are no more.
+    next_cursor: Optional[str] = None
 
 
 class UserPostWithComments(BaseModel):
@@ -52,3 +70,10 @@ class PostLike(PostLikeIn):
     model_config = ConfigDict(from_attributes=True)
     id: int
     user_id: int
+
+
+class PostStats(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+    post_id: int
+    comment_count: int
+    like_count: int
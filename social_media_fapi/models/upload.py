@@ -0,0 +1,30 @@
+from typing import Optional
+
+from pydantic import BaseModel
+
+
+class DirectUploadIn(BaseModel):
+    file_name: str
+    content_type: str = "application/octet-stream"
+
+
+class DirectUpload(BaseModel):
+    upload_id: str
+    # Send the file to upload_url with this method and these headers, before expires_at (Unix time).
+    upload_url: str
+    method: str
+    headers: dict[str, str]
+    expires_at: int
+
+
+class DirectUploadCompleteIn(BaseModel):
+    upload_id: str
+    # The post to make it the image of.
+    post_id: Optional[int] = None
+
+
+class DirectUploadComplete(BaseModel):
+    upload_id: str
+    file_url: str
+    size: int
+    post_id: Optional[int] = None
@@ -1,4 +1,4 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, ConfigDict
 
 
 class User(BaseModel):
@@ -6,4 +6,20 @@ class User(BaseModel):
     email: str
     
 class UserIn(User):
-    password: str
\ No newline at end of file
+    password: str
+
+
+class RefreshTokenIn(BaseModel):
+    refresh_token: str
+
+
+class RevokeTokenIn(BaseModel):
+    refresh_token: str | None = None
+
+
+class UserStats(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+    user_id: int
+    post_count: int
+    comment_count: int
+    like_count: int
@@ -0,0 +1,117 @@
+"""
+Password hashing policy.
+
+PASSWORD_SCHEMES lists the schemes we accept, the first one is used for new hashes and the others
+are deprecated: a user with an old hash gets rehashed with the current policy when they next log in
+(see security.authenticate_user). Hashes with a lower cost than the current one are upgraded the same way.
+
+The cost (bcrypt rounds, argon2 time cost) comes from the config, or if PASSWORD_HASH_TARGET_MS is set
+it is calibrated on this machine when the worker starts, so one hash takes about that long.
+
+To see what the costs would be on this machine and how many hashes/sec each core can do:
+    python -m social_media_fapi.passwords --target-ms 250
+"""
+import argparse
+import logging
+import math
+import os
+import time
+
+from passlib.context import CryptContext
+
+from social_media_fapi.config import config
+
+logger = logging.getLogger(__name__)
+
+BCRYPT_MIN_ROUNDS = 4
+BCRYPT_MAX_ROUNDS = 31
+
+
+def hash_policy(schemes: list[str], bcrypt_rounds: int, argon2_time_cost: int) -> dict:
+    """The CryptContext settings for the given costs."""
+    return {
+        "schemes": schemes,
+        "deprecated": "auto",  # Everything but the first scheme.
+        # Setting the minimum as well makes needs_update() true for hashes made with fewer rounds.
+        "bcrypt__default_rounds": bcrypt_rounds,
+        "bcrypt__min_rounds": bcrypt_rounds,
+        "argon2__time_cost": argon2_time_cost,
+        "argon2__memory_cost": config.ARGON2_MEMORY_COST,
+    }
+
+
+pwd_context = CryptContext(**hash_policy(config.PASSWORD_SCHEMES, config.BCRYPT_ROUNDS, config.ARGON2_TIME_COST))
+
+
+def time_hash(context: CryptContext, scheme: str, repeat: int = 3) -> float:
+    """Milliseconds for one hash, the fastest of `repeat` tries."""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        context.handler(scheme).hash("calibration password")
+        timings.append(time.perf_counter() - start)
+    return min(timings) * 1000
+
+
+def calibrate(scheme: str, target_ms: float) -> int:
+    """Returns the cost for `scheme` that makes one hash take about target_ms on this machine."""
+    if scheme == "bcrypt":
+        # Each extra bcrypt round doubles the time, so measure a cheap cost and scale up.
+        base_rounds = 8
+        context = CryptContext(schemes=["bcrypt"], bcrypt__default_rounds=base_rounds)
+        base_ms = time_hash(context, "bcrypt")
+        rounds = base_rounds + round(math.log2(target_ms / base_ms))
+        return max(BCRYPT_MIN_ROUNDS, min(BCRYPT_MAX_ROUNDS, rounds))
+    if scheme == "argon2":
+        # The argon2 time cost is the number of passes, so the time is roughly linear in it.
+        context = CryptContext(
+            schemes=["argon2"], argon2__time_cost=1, argon2__memory_cost=config.ARGON2_MEMORY_COST
+        )
+        return max(1, round(target_ms / time_hash(context, "argon2")))
+    raise ValueError(f"Don't know how to calibrate {scheme}")
+
+
+def configure_password_hashing(target_ms: float | None = None) -> None:
+    """
+    Applies the policy from the config to pwd_context (in place, so everything using it sees the change).
+    Slow when calibrating, call it from a thread.
+    """
+    schemes = config.PASSWORD_SCHEMES
+    if "argon2" in schemes and not CryptContext(schemes=["argon2"]).handler("argon2").has_backend():
+        raise RuntimeError("PASSWORD_SCHEMES includes argon2, but argon2-cffi is not installed")
+
+    bcrypt_rounds = config.BCRYPT_ROUNDS
+    argon2_time_cost = config.ARGON2_TIME_COST
+    if target_ms:
+        if "bcrypt" in schemes:
+            bcrypt_rounds = calibrate("bcrypt", target_ms)
+        if "argon2" in schemes:
+            argon2_time_cost = calibrate("argon2", target_ms)
+        logger.info(
+            "Calibrated password hashing to %sms: bcrypt rounds %s, argon2 time cost %s",
+            target_ms,
+            bcrypt_rounds,
+            argon2_time_cost,
+        )
+    pwd_context.update(**hash_policy(schemes, bcrypt_rounds, argon2_time_cost))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--target-ms", type=float, default=config.PASSWORD_HASH_TARGET_MS or 250)
+    parser.add_argument("--schemes", nargs="+", default=config.PASSWORD_SCHEMES)
+    args = parser.parse_args()
+
+    cores = os.cpu_count() or 1
+    for scheme in args.schemes:
+        try:
+            cost = calibrate(scheme, args.target_ms)
+        except Exception as e:
+            print(f"{scheme:7} unavailable: {e}")
+            continue
+        context = CryptContext(**hash_policy([scheme], cost, cost))
+        hash_ms = time_hash(context, scheme)
+        print(
+            f"{scheme:7} cost {cost:3}  {hash_ms:7.1f}ms per hash  "
+            f"{1000 / hash_ms:6.1f} hashes/sec per core  {cores * 1000 / hash_ms:7.1f} hashes/sec on {cores} cores"
+        )
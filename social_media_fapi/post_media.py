@@ -0,0 +1,140 @@
+"""
+A file sent with a new post: POST /post as multipart/form-data, with the body field and a media file.
+
+The file is checked as it arrives (see streaming_upload.py) and kept in a temp file, the post is created
+with media_status "pending" and the response goes out straight away. finalize() runs after that as a
+background task: the file goes to B2 (or MEDIA_DIR without B2), a thumbnail of at most THUMBNAIL_SIZE
+pixels is made when Pillow is installed, then the post gets its image_url and thumbnail_url and
+media_status "ready" ("failed" if it didn't work out). Clients hear about it from the post_image_ready
+event, or see it when they fetch the post again.
+"""
+import asyncio
+import logging
+import os
+import pathlib
+import shutil
+import tempfile
+import time
+from typing import Optional
+
+import aiofiles
+from fastapi import Request
+
+from social_media_fapi.config import config
+from social_media_fapi.database import database, post_table
+from social_media_fapi.direct_uploads import local_path, local_url, object_name, set_post_image
+from social_media_fapi.libs.b2 import b2_delete_file_by_url, b2_upload_file
+from social_media_fapi.streaming_upload import MultipartFile, UploadValidator
+
+try:
+    from PIL import Image
+except ImportError:  # pragma: no cover
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+
+class PendingMedia:
+    def __init__(self, path: pathlib.Path, file_name: str, content_type: str, sha1: str) -> None:
+        self.path = path
+        self.file_name = file_name
+        self.content_type = content_type
+        self.sha1 = sha1
+
+    def discard(self) -> None:
+        self.path.unlink(missing_ok=True)
+
+
+async def receive(request: Request) -> tuple[dict[str, str], Optional[PendingMedia]]:
+    """The other fields of the form, and the media file in a temp file (None if there wasn't one)."""
+    validator = UploadValidator(config.UPLOAD_MAX_BYTES, config.UPLOAD_ALLOWED_TYPES)
+    validator.check_content_length(request.headers.get("content-length"))
+    form = MultipartFile(request, "media", required=False)
+    handle, name = tempfile.mkstemp(prefix="post-media-")
+    os.close(handle)
+    path = pathlib.Path(name)
+    try:
+        async with aiofiles.open(path, "wb") as f:
+            async for chunk in form.chunks():
+                validator.feed(chunk)
+                await f.write(chunk)
+        if form.filename is None:
+            await asyncio.to_thread(path.unlink)
+            return form.fields, None
+        validator.finish()
+    except BaseException:
+        await asyncio.to_thread(path.unlink, missing_ok=True)
+        raise
+    return form.fields, PendingMedia(path, form.filename, validator.content_type, validator.sha1)
+
+
+def make_thumbnail(source: pathlib.Path, size: int) -> Optional[pathlib.Path]:
+    """A JPEG of at most size x size pixels, None without Pillow or if Pillow can't read the file."""
+    if Image is None:
+        return None
+    target = source.with_name(f"{source.name}.thumbnail.jpg")
+    try:
+        with Image.open(source) as image:
+            image.thumbnail((size, size))
+            image.convert("RGB").save(target, "JPEG", quality=85)
+    except (OSError, Image.DecompressionBombError):
+        # e.g. a video, or an image too big to be safe to open.
+        target.unlink(missing_ok=True)
+        return None
+    return target
+
+
+async def store(
+    user_id: int, path: pathlib.Path, content_type: str, sha1: Optional[str], stem: str = "file"
+) -> str:
+    """Moves the file to storage, returns its URL."""
+    name = object_name(user_id, content_type, prefix="posts", stem=stem)
+    if config.B2_KEY_ID:
+        return await b2_upload_file(local_file=str(path), file_name=name, content_type=content_type, sha1_sum=sha1)
+    target = local_path(name)
+    await asyncio.to_thread(target.parent.mkdir, parents=True, exist_ok=True)
+    # The temp file may be on another file system, so not os.replace.
+    await asyncio.to_thread(shutil.move, path, target)
+    return local_url(name)
+
+
+async def delete_stored(url: str) -> None:
+    """Deletes a file we stored, in B2 or in MEDIA_DIR. URLs that are neither (e.g. DeepAI's) are left alone."""
+    if await b2_delete_file_by_url(url):
+        return
+    prefix = local_url("")
+    if url.startswith(prefix):
+        await asyncio.to_thread(local_path(url.removeprefix(prefix)).unlink, missing_ok=True)
+
+
+async def finalize(post_id: int, user_id: int, media: PendingMedia) -> None:
+    stored = []
+    thumbnail_path = None
+    try:
+        # Made before the file is moved, it may not be on this disk after.
+        thumbnail_path = await asyncio.to_thread(make_thumbnail, media.path, config.THUMBNAIL_SIZE)
+        stored.append(await store(user_id, media.path, media.content_type, media.sha1))
+        if thumbnail_path:
+            stored.append(await store(user_id, thumbnail_path, "image/jpeg", None, stem="thumbnail"))
+        image_url, thumbnail_url = stored[0], (stored[1] if thumbnail_path else None)
+        if await set_post_image(post_id, image_url, thumbnail_url=thumbnail_url, media_status="ready"):
+            logger.info("Media of post %s is ready at %s", post_id, image_url)
+            return
+        logger.info("Post %s was deleted before its media was ready", post_id)
+    except Exception:
+        logger.exception("Could not store the media of post %s", post_id)
+        await database.execute(
+            post_table.update()
+            .where(post_table.c.id == post_id, post_table.c.deleted_at.is_(None))
+            .values(media_status="failed", updated_at=time.time())
+        )
+    finally:
+        await asyncio.to_thread(media.discard)
+        if thumbnail_path:
+            await asyncio.to_thread(thumbnail_path.unlink, missing_ok=True)
+    # Nothing points at what was stored.
+    for url in stored:
+        try:
+            await delete_stored(url)
+        except Exception:
+            logger.exception("Could not delete %s", url)
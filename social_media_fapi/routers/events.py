@@ -0,0 +1,126 @@
+import asyncio
+import contextlib
+import json
+import logging
+
+from fastapi import APIRouter, Request, WebSocket, WebSocketDisconnect, status
+from fastapi.responses import StreamingResponse
+
+from social_media_fapi.config import config
+from social_media_fapi.events import FEED_TOPIC, Subscription, bus, post_topic
+
+router = APIRouter()
+
+logger = logging.getLogger(__name__)
+
+
+def _parse_command(text: str) -> list[tuple[str, int]]:
+    """The (action, post id) pairs in a command, raises ValueError if it isn't a valid one."""
+    message = json.loads(text)
+    if not isinstance(message, dict) or not message.keys() & {"subscribe", "unsubscribe"}:
+        raise ValueError('expected {"subscribe": <post id>} or {"unsubscribe": <post id>}')
+    commands = []
+    for action in ("subscribe", "unsubscribe"):
+        if action in message:
+            post_id = message[action]
+            # bool is an int too, but {"subscribe": true} is surely a mistake.
+            if not isinstance(post_id, int) or isinstance(post_id, bool):
+                raise ValueError(f"{action} needs a post id")
+            commands.append((action, post_id))
+    return commands
+
+
+async def _receive_commands(websocket: WebSocket, subscription: Subscription):
+    # Clients can change what they follow on an open socket by sending {"subscribe": 1} or {"unsubscribe": 1}.
+    while True:
+        text = await websocket.receive_text()
+        try:
+            commands = _parse_command(text)
+        except ValueError as e:  # json.JSONDecodeError is a ValueError as well.
+            # The connection stays open, it's only this message that's ignored.
+            await websocket.send_json({"error": f"Invalid command: {e}"})
+            continue
+        for action, post_id in commands:
+            if action == "subscribe":
+                subscription.subscribe(post_topic(post_id))
+                await websocket.send_json({"subscribed": post_id})
+            else:
+                subscription.unsubscribe(post_topic(post_id))
+                await websocket.send_json({"unsubscribed": post_id})
+
+
+async def _send_events(websocket: WebSocket, subscription: Subscription):
+    while (message := await subscription.get()) is not None:
+        await websocket.send_text(message)
+    # None means we couldn't keep up, 1013 is "try again later".
+    await websocket.close(code=status.WS_1013_TRY_AGAIN_LATER)
+
+
+async def _serve_websocket(websocket: WebSocket, subscription: Subscription):
+    await websocket.accept()
+    tasks = [
+        asyncio.create_task(_receive_commands(websocket, subscription)),
+        asyncio.create_task(_send_events(websocket, subscription)),
+    ]
+    try:
+        # Whichever finishes first (client disconnected, or we dropped it) ends the connection.
+        done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            error = task.exception()
+            if isinstance(error, (WebSocketDisconnect, RuntimeError)):
+                logger.debug("WebSocket client disconnected")
+            elif error is not None:
+                logger.error("WebSocket connection failed", exc_info=error)
+                # Otherwise the client would be left waiting on a socket nobody is serving.
+                with contextlib.suppress(RuntimeError):  # Already closed.
+                    await websocket.close(code=status.WS_1011_INTERNAL_ERROR)
+    finally:
+        for task in tasks:
+            task.cancel()
+        subscription.close()
+
+
+@router.websocket("/ws/post")
+async def feed_websocket(websocket: WebSocket):
+    logger.info("WebSocket subscribed to the feed")
+    await _serve_websocket(websocket, bus.subscribe(FEED_TOPIC))
+
+
+@router.websocket("/ws/post/{post_id}")
+async def post_websocket(websocket: WebSocket, post_id: int):
+    logger.info("WebSocket subscribed to post %s", post_id)
+    await _serve_websocket(websocket, bus.subscribe(post_topic(post_id)))
+
+
+async def _event_stream(request: Request, subscription: Subscription):
+    try:
+        while True:
+            try:
+                message = await asyncio.wait_for(subscription.get(), config.SSE_PING_INTERVAL)
+            except asyncio.TimeoutError:
+                if await request.is_disconnected():
+                    break
+                # A comment line keeps proxies from closing an idle connection.
+                yield ": ping\n\n"
+                continue
+            if message is None:
+                break
+            yield f"data: {message}\n\n"
+    finally:
+        subscription.close()
+
+
+@router.get("/events/post")
+async def feed_events(request: Request):
+    logger.info("Server-sent events subscribed to the feed")
+    return StreamingResponse(
+        _event_stream(request, bus.subscribe(FEED_TOPIC)), media_type="text/event-stream"
+    )
+
+
+@router.get("/events/post/{post_id}")
+async def post_events(request: Request, post_id: int):
+    logger.info("Server-sent events subscribed to post %s", post_id)
+    return StreamingResponse(
+        _event_stream(request, bus.subscribe(post_topic(post_id))), media_type="text/event-stream"
+    )
@@ -1,23 +1,46 @@
+import asyncio
+import hashlib
 import logging
+import time
 from enum import Enum
 from typing import Annotated
 
 import sqlalchemy
-from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Request
-
-from social_media_fapi.database import comment_table, database, like_table, post_table
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Query, Request, Response
+from fastapi.exceptions import RequestValidationError
+from pydantic import ValidationError
+
+from social_media_fapi import image_providers, post_media
+from social_media_fapi.archive import find_archived_post
+from social_media_fapi.comment_paths import comment_path, subtree_bounds
+from social_media_fapi.config import config
+from social_media_fapi.database import (
+    comment_table,
+    database,
+    like_table,
+    post_archive_index_table,
+    post_stats_table,
+    post_table,
+    user_stats_table,
+)
+from social_media_fapi.events import FEED_TOPIC, bus, post_topic
+from social_media_fapi.image_generation import image_generator
 from social_media_fapi.models.post import (
     Comment,
     CommentIn,
+    CommentPage,
     PostLike,
     PostLikeIn,
+    PostStats,
     UserPost,
     UserPostIn,
     UserPostWithComments,
     UserPostWithLikes,
 )
 from social_media_fapi.models.user import User
+from social_media_fapi.row_json import RowEncoder
 from social_media_fapi.security import get_current_user
+from social_media_fapi.stats import increment
 from social_media_fapi.tasks import generate_and_add_to_post
 
 router = APIRouter()
@@ -27,22 +50,86 @@ logger = logging.getLogger(__name__)
 select_post_and_likes = (
     sqlalchemy.select(post_table, sqlalchemy.func.count(like_table.c.id).label("likes"))
     .select_from(post_table.outerjoin(like_table))
+    .where(post_table.c.deleted_at.is_(None))
+    .group_by(post_table.c.id)
+)
+
+# GET /post: only the columns it returns, in the order of UserPostWithLikes, so the rows can go
+# straight to JSON (see row_json.py) without a Record or a model for each.
+FEED_COLUMNS = tuple(UserPostWithLikes.model_fields)
+select_feed = (
+    sqlalchemy.select(
+        *(
+            sqlalchemy.func.count(like_table.c.id).label("likes") if name == "likes" else post_table.c[name]
+            for name in FEED_COLUMNS
+        )
+    )
+    .select_from(post_table.outerjoin(like_table))
+    .where(post_table.c.deleted_at.is_(None))
     .group_by(post_table.c.id)
 )
+feed_encoder = RowEncoder(FEED_COLUMNS)
+
+# The number of direct replies, for each comment in the outer query (uses the parent_id index).
+replies = comment_table.alias("replies")
+reply_count = (
+    sqlalchemy.select(sqlalchemy.func.count())
+    .where(replies.c.parent_id == comment_table.c.id)
+    .scalar_subquery()
+    .label("reply_count")
+)
+
+# For the comments in the outer query: their post hasn't been deleted. Deleted posts keep their
+# comments until cleanup.py gets to them, but they're hidden straight away.
+on_live_post = (
+    sqlalchemy.exists()
+    .where(post_table.c.id == comment_table.c.post_id, post_table.c.deleted_at.is_(None))
+)
 
 
 # Going from dict to DB we make function an async function as the DB is async.
 async def find_post(post_id: int):
-    logger.info(f"Finding post with id {post_id}")
+    # Pass the values as arguments so the message is only built if the log is actually emitted.
+    logger.info("Finding post with id %s", post_id)
     # The 'c' in 'post_table.c.id' is for column.
-    query = post_table.select().where(post_table.c.id == post_id)
+    query = post_table.select().where(post_table.c.id == post_id, post_table.c.deleted_at.is_(None))
     logger.debug(query)
     return await database.fetch_one(query)
 
 
-@router.post("/post", response_model=UserPost, status_code=201)
+# POST /post takes JSON, or a form with the body and a media file (see post_media.py). The route reads
+# the body itself to tell them apart, this is so the docs still show both.
+CREATE_POST_BODIES = {
+    "requestBody": {
+        "required": True,
+        "content": {
+            "application/json": {"schema": UserPostIn.model_json_schema()},
+            "multipart/form-data": {
+                "schema": {
+                    "type": "object",
+                    "properties": {"body": {"type": "string"}, "media": {"type": "string", "format": "binary"}},
+                    "required": ["body"],
+                }
+            },
+        },
+    }
+}
+
+
+def parse_post(data: dict | bytes) -> UserPostIn:
+    try:
+        if isinstance(data, dict):
+            return UserPostIn.model_validate(data)
+        return UserPostIn.model_validate_json(data)
+    except ValidationError as e:
+        # The same 422 FastAPI gives when it validates the body.
+        raise RequestValidationError(
+            [{**error, "loc": ("body", *error["loc"])} for error in e.errors(include_url=False)]
+        ) from None
+
+
+@router.post("/post", response_model=UserPost, status_code=201, openapi_extra=CREATE_POST_BODIES)
 async def create_post(
-    post: UserPostIn,
     current_user: Annotated[User, Depends(get_current_user)],
     background_tasks: BackgroundTasks,
     request: Request,
@@ -50,15 +137,46 @@ async def create_post(
 ) -> UserPost:
     logger.info("Creating post")
 
-    # This post.model_dump() Turns the Pydantic model into a dictionary
-    data = {**post.model_dump(), "user_id": current_user.id}
+    media = None
+    content_type = request.headers.get("content-type", "")
+    if content_type.startswith("multipart/form-data"):
+        fields, media = await post_media.receive(request)
+        try:
+            post = parse_post(fields)
+        except RequestValidationError:
+            if media:
+                await asyncio.to_thread(media.discard)
+            raise
+    elif content_type.startswith("application/x-www-form-urlencoded"):
+        # A form with no file.
+        post = parse_post(dict(await request.form()))
+    else:
+        post = parse_post(await request.body())
+
+    # This post.model_dump() Turns the Pydantic model into a dictionary. It's filled in and becomes the
+    # response, rather than copied into new dicts on the way.
+    now = time.time()
+    data = post.model_dump()
+    data["user_id"] = current_user.id
+    data["created_at"] = int(now)
+    data["updated_at"] = now
+    if media:
+        # Stored after the response goes, see post_media.finalize
+        data["media_status"] = "pending"
     # In the .values() the parameter can be a dictionary, and the keys need to match the columns of the DB table.
     query = post_table.insert().values(data)
 
     logger.debug(query)
-    last_record_id = await database.execute(query)
-
-    if prompt:
+    async with database.transaction():
+        last_record_id = await database.execute(query)
+        await database.execute(post_stats_table.insert().values(post_id=last_record_id))
+        await database.execute(increment(user_stats_table, current_user.id, post_count=1))
+    data["id"] = last_record_id
+    bus.publish(FEED_TOPIC, {"type": "post_created", "post": data})
+
+    if media:
+        background_tasks.add_task(post_media.finalize, last_record_id, current_user.id, media)
+    elif prompt:
         background_tasks.add_task(
             generate_and_add_to_post,
             current_user.email,
@@ -68,7 +186,35 @@ async def create_post(
             prompt
         )
 
-    return {**data, "id": last_record_id}
+    return data
+
+
+@router.delete("/post/{post_id}", status_code=204)
+async def delete_post(post_id: int, current_user: Annotated[User, Depends(get_current_user)]):
+    logger.info("Deleting post %s", post_id)
+    post = await find_post(post_id)
+    if not post:
+        raise HTTPException(status_code=404, detail="Post not found")
+    if post.user_id != current_user.id:
+        raise HTTPException(status_code=403, detail="You can only delete your own posts")
+
+    # Only mark it deleted here, the comments, likes and image are removed in the background (cleanup.py).
+    async with database.transaction():
+        deleted = await database.fetch_one(
+            post_table.update()
+            .where(post_table.c.id == post_id, post_table.c.deleted_at.is_(None))
+            .values(deleted_at=int(time.time()), updated_at=time.time())
+            .returning(post_table.c.id)
+        )
+        if not deleted:
+            # Someone deleted it since we looked.
+            raise HTTPException(status_code=404, detail="Post not found")
+        await database.execute(post_stats_table.delete().where(post_stats_table.c.post_id == post_id))
+        await database.execute(increment(user_stats_table, current_user.id, post_count=-1))
+
+    event = {"type": "post_deleted", "post_id": post_id}
+    bus.publish(FEED_TOPIC, event)
+    bus.publish(post_topic(post_id), event)
 
 
 class PostSorting(str, Enum):
@@ -77,39 +223,74 @@ class PostSorting(str, Enum):
     most_likes = "most_likes"
 
 
+# Everything that changes what GET /post returns moves one of these, and each is a single index lookup:
+# new posts, new likes, posts deleted or given an image (updated_at), and posts archived.
+feed_version = sqlalchemy.select(
+    sqlalchemy.select(sqlalchemy.func.max(post_table.c.id)).scalar_subquery(),
+    sqlalchemy.select(sqlalchemy.func.min(post_table.c.id)).scalar_subquery(),
+    sqlalchemy.select(sqlalchemy.func.max(post_table.c.updated_at)).scalar_subquery(),
+    sqlalchemy.select(sqlalchemy.func.max(like_table.c.id)).scalar_subquery(),
+    sqlalchemy.select(sqlalchemy.func.max(post_archive_index_table.c.post_id)).scalar_subquery(),
+)
+
+
+async def feed_etag(sorting: PostSorting) -> str:
+    version = await database.fetch_one(feed_version)
+    digest = hashlib.blake2b(repr(tuple(version.values())).encode(), digest_size=8).hexdigest()
+    return f'"posts-{sorting.value}-{digest}"'
+
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    if not if_none_match:
+        return False
+    # If-None-Match uses the weak comparison, W/"x" matches "x".
+    tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return "*" in tags or etag in tags
+
+
 @router.get("/post", response_model=list[UserPostWithLikes])
 async def get_all_posts(
+    request: Request,
     sorting: PostSorting = PostSorting.new,
 ) -> list[UserPostWithLikes]:  # http://api.com/post?sorting=most_likes
     logger.info("Get all posts")
 
+    # Worked out before the feed, so if a post arrives in between, the client gets the newer
+    # feed with the older ETag and simply fetches it again next time. Never the other way round.
+    etag = await feed_etag(sorting)
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+
     """
-    query = select_post_and_likes.order_by(sqlalchemy.desc(post_table.c.id))
-    query = select_post_and_likes.order_by(post_table.c.id.desc())
+    query = select_feed.order_by(sqlalchemy.desc(post_table.c.id))
+    query = select_feed.order_by(post_table.c.id.desc())
         Out of the two lins above, the second one is the preferred one.
         As we are unsing the sqlalchemy ORM, we can use the following one ONLY if you don't have a clumn object:
-        select_post_and_likes.order_by(sqlalchemy.desc("likes"))
+        select_feed.order_by(sqlalchemy.desc("likes"))
     """
 
     match sorting:
         case PostSorting.new:
-            query = select_post_and_likes.order_by(post_table.c.id.desc())
+            query = select_feed.order_by(post_table.c.id.desc())
         case PostSorting.old:
-            query = select_post_and_likes.order_by(post_table.c.id.asc())
+            query = select_feed.order_by(post_table.c.id.asc())
         case PostSorting.most_likes:
-            query = select_post_and_likes.order_by(sqlalchemy.desc("likes"))
+            query = select_feed.order_by(sqlalchemy.desc("likes"))
 
     # The above match statement is equivalent to the following if-elif-else block:
     # if sorting == PostSorting.new:
-    #     query = select_post_and_likes.order_by(post_table.c.id.desc())
+    #     query = select_feed.order_by(post_table.c.id.desc())
     # elif sorting == PostSorting.old:
-    #     query = select_post_and_likes.order_by(post_table.c.id.asc())
+    #     query = select_feed.order_by(post_table.c.id.asc())
     # elif sorting == PostSorting.most_likes:
-    #     query = select_post_and_likes.order_by(sqlalchemy.desc("likes"))
+    #     query = select_feed.order_by(sqlalchemy.desc("likes"))
 
     logger.debug(query)
 
-    return await database.fetch_all(query)
+    # Already JSON, so FastAPI doesn't check it against response_model (that's only for the docs here).
+    rows = await database.fetch_tuples(query)
+    return Response(feed_encoder.encode(rows), media_type="application/json", headers=headers)
 
 
 @router.post("/comment", response_model=Comment, status_code=201)
@@ -126,22 +307,148 @@ async def create_comment(
         # logger.error(f"Post with id {comment.post_id} not found")
         raise HTTPException(status_code=404, detail="Post not found")
 
+    parent_path = ""
+    depth = 0
+    if comment.parent_id is not None:
+        parent = await database.fetch_one(comment_table.select().where(comment_table.c.id == comment.parent_id))
+        if not parent or parent.post_id != comment.post_id:
+            raise HTTPException(status_code=404, detail="Comment to reply to not found")
+        if parent.depth >= config.MAX_COMMENT_DEPTH:
+            raise HTTPException(status_code=400, detail="Replies are nested too deeply")
+        parent_path = parent.path
+        depth = parent.depth + 1
+
     # comment.model_dump() - Turn the Pydantic model into a dictionary
-    data = {**comment.model_dump(), "user_id": current_user.id}
-    query = comment_table.insert().values(data)
-    logger.debug(query)
-    last_record_id = await database.execute(query)
-    return {**data, "id": last_record_id}
+    data = {**comment.model_dump(), "user_id": current_user.id, "depth": depth}
+    # The path ends with the comment's own id, which we only know after the insert.
+    async with database.transaction():
+        query = comment_table.insert().values({**data, "path": parent_path})
+        logger.debug(query)
+        last_record_id = await database.execute(query)
+        await database.execute(
+            comment_table.update()
+            .where(comment_table.c.id == last_record_id)
+            .values(path=comment_path(last_record_id, parent_path))
+        )
+        await database.execute(increment(post_stats_table, comment.post_id, comment_count=1))
+        await database.execute(increment(user_stats_table, current_user.id, comment_count=1))
+    new_comment = {**data, "id": last_record_id}
+    bus.publish(post_topic(comment.post_id), {"type": "comment_created", "comment": new_comment})
+    return new_comment
 
 
 @router.get("/post/{post_id}/comment", response_model=list[Comment])
 async def get_comments_on_post(post_id: int):
     logger.info("getting comments on post")
-    query = comment_table.select().where(comment_table.c.post_id == post_id)
+    query = comment_table.select().where(comment_table.c.post_id == post_id, on_live_post)
     logger.debug(query)
     return await database.fetch_all(query)
 
 
+@router.get("/post/{post_id}/thread", response_model=CommentPage)
+async def get_comment_thread(
+    post_id: int,
+    cursor: str = None,
+    limit: int = Query(default=20, ge=1, le=100),
+    replies_per_comment: int = Query(default=3, ge=1, le=100),
+    max_depth: int = Query(default=3, ge=0),
+):
+    """
+    The post's comments as threads, depth first, a page of `limit` comments on the post at a time: each
+    with its first `replies_per_comment` replies (and theirs), down to max_depth. Pass next_cursor back
+    as ?cursor= for the next page, and use reply_count and /comment/{id}/replies to expand the replies.
+    """
+    logger.info("Getting comment thread for post %s", post_id)
+
+    where = [comment_table.c.post_id == post_id, comment_table.c.depth <= max_depth, on_live_post]
+    if cursor:
+        # The cursor is the path of the last comment on the post of the previous page, carry on after its replies.
+        where.append(comment_table.c.path >= subtree_bounds(cursor)[1])
+    # Number the replies to each comment in one pass over the post's comments, then keep the first few.
+    # The comments on the post itself (parent_id NULL) are numbered the same way, and a page is the
+    # first limit of them, plus one to know if there's another page.
+    ranked = (
+        sqlalchemy.select(
+            comment_table,
+            reply_count,
+            sqlalchemy.func.row_number()
+            .over(partition_by=comment_table.c.parent_id, order_by=comment_table.c.id)
+            .label("rank"),
+        )
+        .where(*where)
+        .subquery()
+    )
+    query = (
+        sqlalchemy.select(ranked)
+        .where(
+            sqlalchemy.or_(
+                sqlalchemy.and_(ranked.c.parent_id.is_(None), ranked.c.rank <= limit + 1),
+                sqlalchemy.and_(ranked.c.parent_id.is_not(None), ranked.c.rank <= replies_per_comment),
+            )
+        )
+        .order_by(ranked.c.path)
+    )
+    logger.debug(query)
+
+    # A reply can make the cut while its parent didn't. Parents come before their replies
+    # in path order, so one pass drops those, and the replies of the extra comment on the post.
+    thread = []
+    kept = set()
+    next_cursor = None
+    last_path = None
+    for row in await database.fetch_all(query):
+        if row.parent_id is None:
+            if row.rank > limit:
+                # The extra one, so there's another page after the last comment on the post we kept.
+                next_cursor = last_path
+                continue
+            last_path = row.path
+        elif row.parent_id not in kept:
+            continue
+        kept.add(row.id)
+        thread.append(row)
+    return {"comments": thread, "next_cursor": next_cursor}
+
+
+@router.get("/comment/{comment_id}/replies", response_model=CommentPage)
+async def get_comment_replies(
+    comment_id: int,
+    cursor: str = None,
+    limit: int = Query(default=50, ge=1, le=500),
+    max_depth: int = Query(default=3, ge=1),
+):
+    """
+    The replies under a comment, at any depth down to max_depth below it, depth first.
+    This is how a client expands a collapsed part of a thread, a page at a time.
+    """
+    logger.info("Getting replies to comment %s", comment_id)
+    parent = await database.fetch_one(comment_table.select().where(comment_table.c.id == comment_id, on_live_post))
+    if not parent:
+        raise HTTPException(status_code=404, detail="Comment not found")
+
+    lower, upper = subtree_bounds(parent.path)
+    # The cursor is the path of the last reply on the previous page, the next page carries on after it.
+    if cursor and lower < cursor < upper:
+        lower = cursor
+    query = (
+        sqlalchemy.select(comment_table, reply_count)
+        .where(
+            comment_table.c.post_id == parent.post_id,
+            comment_table.c.path > lower,
+            comment_table.c.path < upper,
+            comment_table.c.depth <= parent.depth + max_depth,
+        )
+        .order_by(comment_table.c.path)
+        .limit(limit + 1)  # One extra to know if there's another page.
+    )
+    logger.debug(query)
+    rows = await database.fetch_all(query)
+    return {
+        "comments": rows[:limit],
+        "next_cursor": rows[limit - 1].path if len(rows) > limit else None,
+    }
+
+
 @router.get("/post/{post_id}", response_model=UserPostWithComments)
 async def get_post_with_comments(post_id: int):
     logger.info("Getting post with comments")
@@ -151,6 +458,10 @@ async def get_post_with_comments(post_id: int):
     post = await database.fetch_one(query)
 
     if not post:
+        # Old posts are moved out of the database, see archive.py
+        archived = await find_archived_post(post_id)
+        if archived:
+            return archived
         # Because we have added an exception handler in the main.py (see @app.exception_handler(HTTPException))
         # We no longer need to log the error message here.
         # logger.error(f"Post with post id {post_id} not found")
@@ -159,6 +470,21 @@ async def get_post_with_comments(post_id: int):
     return {"post": post, "comments": await get_comments_on_post(post_id)}
 
 
+@router.get("/post/{post_id}/stats", response_model=PostStats)
+async def get_post_stats(post_id: int):
+    logger.info("Getting stats for post %s", post_id)
+    stats = await database.fetch_one(post_stats_table.select().where(post_stats_table.c.post_id == post_id))
+    if not stats:
+        raise HTTPException(status_code=404, detail="Post not found")
+    return stats
+
+
+@router.get("/image-generation/stats")
+async def get_image_generation_stats() -> dict:
+    # waiting is the queue of generations held back by IMAGE_GENERATION_CONCURRENCY in this worker.
+    return {**image_generator.stats(), "providers": image_providers.stats()}
+
+
 @router.post("/like", response_model=PostLike, status_code=201)
 async def like_post(
     post_like: PostLikeIn, current_user: Annotated[User, Depends(get_current_user)]
@@ -176,5 +502,10 @@ async def like_post(
     data = {**post_like.model_dump(), "user_id": current_user.id}
     query = like_table.insert().values(data)
     logger.debug(query)
-    last_record_id = await database.execute(query)
-    return {**data, "id": last_record_id}
+    async with database.transaction():
+        last_record_id = await database.execute(query)
+        await database.execute(increment(post_stats_table, post_like.post_id, like_count=1))
+        await database.execute(increment(user_stats_table, current_user.id, like_count=1))
+    new_like = {**data, "id": last_record_id}
+    bus.publish(post_topic(post_like.post_id), {"type": "post_liked", "like": new_like})
+    return new_like
@@ -1,27 +1,68 @@
 import logging
 import tempfile
+import time
+from typing import Annotated, Optional
 
 import aiofiles
-from fastapi import APIRouter, HTTPException, UploadFile, status
-from social_media_fapi.libs.b2 import b2_upload_file
+from fastapi import APIRouter, Depends, Header, HTTPException, Request, status
+from social_media_fapi import direct_uploads
+from social_media_fapi.config import config
+from social_media_fapi.libs.b2 import b2_client, b2_upload_file
+from social_media_fapi.models.upload import (
+    DirectUpload,
+    DirectUploadComplete,
+    DirectUploadCompleteIn,
+    DirectUploadIn,
+)
+from social_media_fapi.models.user import User
+from social_media_fapi.routers.post import find_post
+from social_media_fapi.security import get_current_user
+from social_media_fapi.streaming_upload import MultipartFile, UploadValidator
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
-CHUNK_SIZE = 1024 * 1024
+# The body is read by the route itself (see streaming_upload.py), this is so the docs still show the form.
+UPLOAD_FORM = {
+    "requestBody": {
+        "required": True,
+        "content": {
+            "multipart/form-data": {
+                "schema": {
+                    "type": "object",
+                    "properties": {"file": {"type": "string", "format": "binary"}},
+                    "required": ["file"],
+                }
+            }
+        },
+    }
+}
 
 
-@router.post("/upload", status_code=201)
-async def upload_file(file: UploadFile):
+@router.post("/upload", status_code=201, openapi_extra=UPLOAD_FORM)
+async def upload_file(request: Request):
+    validator = UploadValidator(config.UPLOAD_MAX_BYTES, config.UPLOAD_ALLOWED_TYPES)
+    validator.check_content_length(request.headers.get("content-length"))
+    file = MultipartFile(request, "file")
     try:
         with tempfile.NamedTemporaryFile() as temp_file:
             filename = temp_file.name
-            logger.info("Saving upload file temp {filename}")
+            logger.info("Saving upload file temp %s", filename)
             async with aiofiles.open(filename, "wb") as f:
-                while chunk := await file.read(CHUNK_SIZE):
+                async for chunk in file.chunks():
+                    validator.feed(chunk)
                     await f.write(chunk)
-            file_url = b2_upload_file(local_file=filename, file_name=file.filename)
+            validator.finish()
+            file_url = await b2_upload_file(
+                local_file=filename,
+                file_name=file.filename,
+                content_type=validator.content_type,
+                sha1_sum=validator.sha1,
+            )
+    except HTTPException:
+        # Too big, the wrong type or not a form, from the validation.
+        raise
     except Exception as e:
         logger.debug(f"Error {e}")
         print(f"{e}")
@@ -31,3 +72,85 @@ async def upload_file(file: UploadFile):
         )
 
     return {"detail": f"Successfully uploaded {file.filename}", "file_url": file_url}
+
+
+@router.get("/upload/stats")
+async def get_upload_stats() -> dict:
+    # How long the B2 calls of this worker take, and when it last authorised.
+    return b2_client.stats()
+
+
+# Uploads straight to storage, see direct_uploads.py for how a client uses these.
+@router.post("/upload/authorize", response_model=DirectUpload, status_code=201)
+async def authorize_direct_upload(
+    upload: DirectUploadIn, current_user: Annotated[User, Depends(get_current_user)], request: Request
+):
+    if upload.content_type not in config.UPLOAD_ALLOWED_TYPES:
+        raise HTTPException(
+            status_code=415, detail="Only these types can be uploaded: " + ", ".join(config.UPLOAD_ALLOWED_TYPES)
+        )
+    return await direct_uploads.authorize_upload(
+        current_user.id,
+        upload.file_name,
+        upload.content_type,
+        lambda upload_id: str(request.url_for("put_local_upload", upload_id=upload_id)),
+    )
+
+
+@router.put("/upload/local/{upload_id}", status_code=204)
+async def put_local_upload(
+    upload_id: str,
+    request: Request,
+    x_upload_token: Annotated[Optional[str], Header()] = None,
+    x_bz_content_sha1: Annotated[Optional[str], Header()] = None,
+):
+    # The stand-in for B2 when it isn't configured, the token from /upload/authorize is the only auth.
+    upload = await direct_uploads.find_upload(upload_id)
+    if not direct_uploads.local_upload_allowed(upload, x_upload_token):
+        raise HTTPException(status_code=403, detail="Upload not authorised")
+    # The same checks as POST /upload, and only the type that was authorised (it's in the file's extension).
+    validator = UploadValidator(config.UPLOAD_MAX_BYTES, [upload.content_type])
+    validator.check_content_length(request.headers.get("content-length"))
+    size = await direct_uploads.save_local(upload.file_name, request.stream(), validator)
+    if x_bz_content_sha1 and x_bz_content_sha1.lower() != validator.sha1:
+        await direct_uploads.delete_stored_file(upload, direct_uploads.local_url(upload.file_name))
+        raise HTTPException(status_code=400, detail="The sha1 of the file doesn't match X-Bz-Content-Sha1")
+    logger.info("Saved %s bytes of upload %s", size, upload_id)
+
+
+@router.post("/upload/complete", response_model=DirectUploadComplete)
+async def complete_direct_upload(
+    complete: DirectUploadCompleteIn, current_user: Annotated[User, Depends(get_current_user)]
+):
+    upload = await direct_uploads.find_upload(complete.upload_id)
+    if not upload or upload.user_id != current_user.id:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    if upload.completed_at is not None:
+        raise HTTPException(status_code=409, detail="Upload already completed")
+    if upload.expires_at <= time.time():
+        raise HTTPException(status_code=410, detail="Upload authorisation has expired")
+    if complete.post_id is not None:
+        post = await find_post(complete.post_id)
+        if not post:
+            raise HTTPException(status_code=404, detail="Post not found")
+        if post.user_id != current_user.id:
+            raise HTTPException(status_code=403, detail="You can only add images to your own posts")
+
+    stored = await direct_uploads.stored_file(upload)
+    if stored is None:
+        raise HTTPException(status_code=400, detail="The file has not been uploaded")
+    file_url, size, content_type = stored
+    # B2 takes whatever the holder of the upload URL sends, so this is where its files are checked.
+    if size > config.UPLOAD_MAX_BYTES:
+        await direct_uploads.reject_upload(upload, file_url)
+        raise HTTPException(status_code=413, detail=f"The file is bigger than {config.UPLOAD_MAX_BYTES} bytes")
+    if content_type != upload.content_type or content_type not in config.UPLOAD_ALLOWED_TYPES:
+        await direct_uploads.reject_upload(upload, file_url)
+        raise HTTPException(status_code=415, detail=f"The file isn't of the type authorised, {upload.content_type}")
+    if not await direct_uploads.complete_upload(upload, file_url, size, complete.post_id):
+        raise HTTPException(status_code=409, detail="Upload already completed")
+    if complete.post_id is not None and not await direct_uploads.set_post_image(complete.post_id, file_url):
+        # Deleted since we looked, the upload is complete but isn't the image of anything.
+        raise HTTPException(status_code=404, detail="Post not found")
+
+    return {"upload_id": upload.id, "file_url": file_url, "size": size, "post_id": complete.post_id}
@@ -1,20 +1,28 @@
+import asyncio
 import logging
+from typing import Annotated
 
-# from  typing import Annotated
-from fastapi import APIRouter, BackgroundTasks, HTTPException, Request, status
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Request, status
+from fastapi.responses import StreamingResponse
 
 from social_media_fapi import tasks
 
 # from fastapi.security import OAuth2PasswordRequestForm
-from social_media_fapi.database import database, user_table
-from social_media_fapi.models.user import UserIn
+from social_media_fapi.database import database, user_stats_table, user_table
+from social_media_fapi.export import export_user_data
+from social_media_fapi.models.user import RefreshTokenIn, RevokeTokenIn, User, UserIn, UserStats
 from social_media_fapi.security import (
     authenticate_user,
     create_access_token,
     create_confirmation_token,
+    create_refresh_token,
+    decode_token,
+    get_current_user,
     get_password_hash,
     get_subject_for_token_type,
     get_user,
+    oauth2_scheme,
+    revoke_token,
 )
 
 router = APIRouter()
@@ -30,12 +38,14 @@ async def register(user: UserIn, background_tasks: BackgroundTasks, request: Req
             detail="A user with that email already exists",
         )
 
-    hashed_password = get_password_hash(user.password)
+    hashed_password = await asyncio.to_thread(get_password_hash, user.password)
     query = user_table.insert().values(email=user.email, password=hashed_password)
 
     logger.debug(query)
 
-    await database.execute(query)
+    async with database.transaction():
+        user_id = await database.execute(query)
+        await database.execute(user_stats_table.insert().values(user_id=user_id))
     # Adding a background task here allows the email to be sent later because it can be really slow.
     # The routine can then finish and move onto the next task.
     # There are others, such as RQ worker and celery when you have a computational expensive process as they have a separate process/server.
@@ -61,7 +71,34 @@ async def login(user: UserIn):
     # async def login(form_data: Annotated[OAuth2PasswordRequestForm, Depends()]):
     #     user = await authenticate_user(form_data.username, form_data.password)
     access_token = create_access_token(user.email)
-    return {"access_token": access_token, "token_type": "bearer"}
+    return {
+        "access_token": access_token,
+        "refresh_token": create_refresh_token(user.email),
+        "token_type": "bearer",
+    }
+
+
+@router.post("/token/refresh")
+async def refresh(refresh_token: RefreshTokenIn):
+    payload = decode_token(refresh_token.refresh_token, "refresh")
+    # Rotation: each refresh token can only be used once, so a stolen one that is used again is rejected.
+    await revoke_token(payload)
+    return {
+        "access_token": create_access_token(payload["sub"]),
+        "refresh_token": create_refresh_token(payload["sub"]),
+        "token_type": "bearer",
+    }
+
+
+@router.post("/token/revoke")
+async def revoke(
+    token: Annotated[str, Depends(oauth2_scheme)], revoke_token_in: RevokeTokenIn
+):
+    # Revokes the access token used for this request, and the refresh token if one is given.
+    await revoke_token(decode_token(token, "access"))
+    if revoke_token_in.refresh_token:
+        await revoke_token(decode_token(revoke_token_in.refresh_token, "refresh"))
+    return {"detail": "Token revoked"}
 
 
 @router.get("/confirm/{token}")
@@ -75,3 +112,25 @@ async def confirm_email(token: str):
 
     await database.execute(query)
     return {"detail": "User confirmed"}
+
+
+@router.get("/user/me/export")
+async def export_my_data(current_user: Annotated[User, Depends(get_current_user)]):
+    # Streamed as it's made, so there's no Content-Length and it goes out chunked.
+    logger.info("Exporting data of user %s", current_user.id)
+    return StreamingResponse(
+        export_user_data(current_user.id),
+        media_type="application/zip",
+        headers={"Content-Disposition": 'attachment; filename="export.zip"'},
+    )
+
+
+@router.get("/user/{user_id}/stats", response_model=UserStats)
+async def get_user_stats(user_id: int):
+    logger.info("Getting stats for user %s", user_id)
+    query = user_stats_table.select().where(user_stats_table.c.user_id == user_id)
+    logger.debug(query)
+    stats = await database.fetch_one(query)
+    if not stats:
+        raise HTTPException(status_code=404, detail="User not found")
+    return stats
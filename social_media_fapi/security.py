@@ -1,20 +1,26 @@
+import asyncio
 import datetime
+import heapq
 import logging
-from typing import Annotated, Literal
+import time
+import uuid
+from functools import lru_cache
+from typing import Annotated, Literal, Optional
 
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from jose import ExpiredSignatureError, jwt
-from passlib.context import CryptContext
 
+from social_media_fapi import cache_sync
 from social_media_fapi.config import config
-from social_media_fapi.database import database, user_table
+from social_media_fapi.database import database, insert_on_conflict, revoked_token_table, user_table
+from social_media_fapi.jwt_keys import JWTKeys
+from social_media_fapi.passwords import pwd_context
 
 logger = logging.getLogger(__name__)
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 # This is used to extract the token from the request header.
-pwd_context = CryptContext(schemes=["bcrypt"])
 
 def create_credentials_exception(detail: str) ->HTTPException:
     return  HTTPException(
@@ -24,12 +30,66 @@ def create_credentials_exception(detail: str) ->HTTPException:
 )
 
 
+@lru_cache()
+def get_token_keys() -> JWTKeys:
+    # Built on first use (and in main.warm_up) rather than at import, and rebuilt after a cache_sync,
+    # which is how a rotated key is picked up by all the workers.
+    return JWTKeys(
+        config.ALGORITHM,
+        secret_key=config.SECRET_KEY,
+        keys_dir=config.JWT_KEYS_DIR,
+        active_kid=config.JWT_ACTIVE_KID,
+    )
+
+
+cache_sync.register(get_token_keys.cache_clear)
+
+
 def access_token_expire_minutes() -> int:
     return 30
 
 def confirm_token_expire_minutes() -> int:
     return 1440 # 24 hours
 
+def refresh_token_expire_minutes() -> int:
+    return 43200 # 30 days
+
+
+class TokenDenylist:
+    """
+    The ids (jti) of revoked tokens that haven't expired yet, checked on every request.
+    Checking is a dict lookup, and entries are pruned once the token would have expired anyway,
+    so the memory used is bounded by the tokens revoked within one token lifetime.
+    """
+
+    def __init__(self) -> None:
+        self._expires_at: dict[str, float] = {}
+        # A heap ordered by expiry, so the expired entries can be removed without scanning everything.
+        self._expiry_heap: list[tuple[float, str]] = []
+
+    def add(self, jti: str, expires_at: float) -> None:
+        if jti not in self._expires_at:
+            heapq.heappush(self._expiry_heap, (expires_at, jti))
+            self._expires_at[jti] = expires_at
+        self.prune()
+
+    def prune(self, now: Optional[float] = None) -> None:
+        now = time.time() if now is None else now
+        while self._expiry_heap and self._expiry_heap[0][0] <= now:
+            _, jti = heapq.heappop(self._expiry_heap)
+            self._expires_at.pop(jti, None)
+
+    def __contains__(self, jti: str) -> bool:
+        return jti in self._expires_at
+
+    def __len__(self) -> int:
+        return len(self._expires_at)
+
+
+token_denylist = TokenDenylist()
+# The highest revoked_tokens.id this worker has loaded into token_denylist.
+_last_revoked_id = 0
+
 
 def create_access_token(email: str):
     logger.debug("Creating access token for user", extra={"email": email})
@@ -42,10 +102,9 @@ def create_access_token(email: str):
     # sub - The subject for the jwt or who the access token is for.
     # exp - the expiry time.
     # type - the type of token, in this case, access.
-    jwt_data = {"sub": email, "exp": expire, 'type': 'access'}
-    encoded_jwt = jwt.encode(
-        jwt_data, key=config.SECRET_KEY, algorithm=config.ALGORITHM
-    )
+    # jti - a unique id for the token, so it can be revoked.
+    jwt_data = {"sub": email, "exp": expire, 'type': 'access', "jti": uuid.uuid4().hex}
+    encoded_jwt = get_token_keys().encode(jwt_data)
     return encoded_jwt
 
 def create_confirmation_token(email: str):
@@ -60,14 +119,25 @@ def create_confirmation_token(email: str):
     # exp - the expiry time.
     # type - the type of token, in this case, confirmation.
     jwt_data = {"sub": email, "exp": expire, 'type': 'confirmation'}
-    encoded_jwt = jwt.encode(
-        jwt_data, key=config.SECRET_KEY, algorithm=config.ALGORITHM
+    encoded_jwt = get_token_keys().encode(jwt_data)
+    return encoded_jwt
+
+def create_refresh_token(email: str):
+    logger.debug("Creating refresh token for user", extra={"email": email})
+    # The refresh token lasts much longer, and is swapped for a new access token at /token/refresh.
+    expire = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(
+        minutes=refresh_token_expire_minutes()
     )
+    jwt_data = {"sub": email, "exp": expire, 'type': 'refresh', "jti": uuid.uuid4().hex}
+    encoded_jwt = get_token_keys().encode(jwt_data)
     return encoded_jwt
 
-def get_subject_for_token_type(token: str, type: Literal["access", "confirmation"]) -> str:
+def get_subject_for_token_type(token: str, type: Literal["access", "confirmation", "refresh"]) -> str:
+    return decode_token(token, type)["sub"]
+
+def decode_token(token: str, type: Literal["access", "confirmation", "refresh"]) -> dict:
     try:
-        payload = jwt.decode(token, config.SECRET_KEY, algorithms=[config.ALGORITHM])
+        payload = get_token_keys().decode(token)
 
     except ExpiredSignatureError as e:
         raise create_credentials_exception("Token has expired") from e
@@ -81,8 +151,57 @@ def get_subject_for_token_type(token: str, type: Literal["access", "confirmation
     token_type: str = payload.get("type")
     if token_type is None or token_type != type:
         raise create_credentials_exception(f"Token is not a valid {token_type} token, expected {type}")
-    
-    return email
+
+    # Only an in memory lookup, the denylist is kept up to date in the background (see watch_token_denylist).
+    jti = payload.get("jti")
+    if jti is not None and jti in token_denylist:
+        raise create_credentials_exception("Token has been revoked")
+
+    return payload
+
+
+async def revoke_token(payload: dict):
+    jti = payload.get("jti")
+    if jti is None or jti in token_denylist:
+        return
+    logger.debug("Revoking token", extra={"email": payload["sub"]})
+    token_denylist.add(jti, payload["exp"])
+    # Saved so the other workers (and this one after a restart) pick it up.
+    query = (
+        insert_on_conflict(revoked_token_table)
+        .values(jti=jti, expires_at=payload["exp"])
+        .on_conflict_do_nothing(index_elements=[revoked_token_table.c.jti])
+        .returning(revoked_token_table.c.id)
+    )
+    logger.debug(query)
+    if await database.fetch_one(query) is None:
+        # Another worker revoked it before our denylist caught up (e.g. a refresh token used twice),
+        # so it's the same as finding it in the denylist.
+        raise create_credentials_exception("Token has been revoked")
+
+
+async def load_revoked_tokens():
+    global _last_revoked_id
+    query = revoked_token_table.select().where(
+        revoked_token_table.c.id > _last_revoked_id,
+        revoked_token_table.c.expires_at > int(time.time()),
+    )
+    for row in await database.fetch_all(query):
+        token_denylist.add(row.jti, row.expires_at)
+        _last_revoked_id = max(_last_revoked_id, row.id)
+
+
+async def watch_token_denylist(interval: float):
+    # Runs for the life of the worker (see main.lifespan) to pick up tokens revoked by the other workers.
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await load_revoked_tokens()
+            await database.execute(
+                revoked_token_table.delete().where(revoked_token_table.c.expires_at <= int(time.time()))
+            )
+        except Exception:
+            logger.exception("Could not load the revoked tokens")
 
 def get_password_hash(password: str) -> str:
     return pwd_context.hash(password)
@@ -105,10 +224,21 @@ async def authenticate_user(email: str, password: str):
     user = await get_user(email)
     if not user:
         raise create_credentials_exception("Invalid email or pasword")
-    if not verify_password(password, user.password):
+    # Hashing is deliberately slow, so it runs in a thread rather than blocking the event loop.
+    if not await asyncio.to_thread(verify_password, password, user.password):
         raise create_credentials_exception("Invalid email or password")
     if not user.confirmed:
         raise create_credentials_exception("User not confirmed email")
+    if pwd_context.needs_update(user.password):
+        # The hash uses an old scheme or a lower cost than the current policy.
+        # We only have the plain password now, so this is the time to rehash it.
+        logger.debug("Rehashing password", extra={"email": email})
+        query = (
+            user_table.update()
+            .where(user_table.c.id == user.id)
+            .values(password=await asyncio.to_thread(get_password_hash, password))
+        )
+        await database.execute(query)
     return user
 
 # Changed teh parameter from token: str to token: Annotated[str, Depends(oauth2_scheme)]
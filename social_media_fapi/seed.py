@@ -0,0 +1,237 @@
+"""
+Generate synthetic users, posts, comments and likes and bulk load them into the database.
+
+The data is skewed like a real social network: a few users write most of the posts, a few
+posts get most of the likes (power-law/Zipf), and comments arrive in threads (bursts on the same post).
+
+Run from the top social_media_fapi directory, the database comes from the usual config (ENV_STATE):
+    python -m social_media_fapi.seed --users 100000 --posts 1000000 --comments 2000000 --likes 5000000 --reset
+"""
+import argparse
+import itertools
+import random
+import time
+from typing import Iterator, Optional
+
+import sqlalchemy
+from rich.progress import BarColumn, Progress, TextColumn, TimeRemainingColumn
+
+from social_media_fapi.comment_paths import comment_path
+
+WORDS = (
+    "the a cat dog blue shorthair couch sunny morning coffee code python fastapi post like comment "
+    "today amazing weekend travel photo friends great new idea think love really just about"
+).split()
+
+
+def zipf_cum_weights(n: int, s: float) -> list[float]:
+    # Cumulative weights, so random.choices can use bisect instead of summing the weights every call.
+    return list(itertools.accumulate(1 / rank**s for rank in range(1, n + 1)))
+
+
+class Generator:
+    def __init__(self, users: int, posts: int, skew: float = 1.1, seed: Optional[int] = None) -> None:
+        self.random = random.Random(seed)
+        self.users = users
+        self.posts = posts
+        # Build a pool of bodies once, generating the text per row is slower than the insert.
+        self.bodies = [" ".join(self.random.choices(WORDS, k=self.random.randint(3, 20))) for _ in range(1000)]
+
+        # Shuffle the ids, so the most active users and popular posts are spread over the table.
+        self.user_ids = list(range(1, users + 1))
+        self.random.shuffle(self.user_ids)
+        self.user_weights = zipf_cum_weights(users, skew)
+        self.post_ids = list(range(1, posts + 1))
+        self.random.shuffle(self.post_ids)
+        self.post_weights = zipf_cum_weights(posts, skew)
+
+    def pick_users(self, k: int) -> list[int]:
+        return self.random.choices(self.user_ids, cum_weights=self.user_weights, k=k)
+
+    def pick_posts(self, k: int) -> list[int]:
+        return self.random.choices(self.post_ids, cum_weights=self.post_weights, k=k)
+
+    def user_rows(self, count: int, password: str) -> Iterator[tuple]:
+        for user_id in range(1, count + 1):
+            yield (user_id, f"user{user_id}@example.com", password, True)
+
+    def post_rows(self, count: int, batch_size: int, days: int = 365) -> Iterator[tuple]:
+        # Spread evenly over the last `days` days, oldest first.
+        now = int(time.time())
+        spacing = days * 24 * 60 * 60 / max(count, 1)
+        for start in range(1, count + 1, batch_size):
+            size = min(batch_size, count + 1 - start)
+            authors = self.pick_users(size)
+            bodies = self.random.choices(self.bodies, k=size)
+            ids = range(start, start + size)
+            created = (now - int((count - post_id) * spacing) for post_id in ids)
+            yield from zip(ids, bodies, authors, created)
+
+    def comment_rows(self, count: int, reply_rate: float = 0.5, max_depth: int = 8) -> Iterator[tuple]:
+        # A thread is a burst of comments on one post, the length is roughly geometric (mean 5).
+        # About reply_rate of them reply to an earlier comment in the burst.
+        comment_id = 0
+        while comment_id < count:
+            post_id = self.pick_posts(1)[0]
+            length = min(int(self.random.expovariate(0.2)) + 1, count - comment_id)
+            thread = []
+            for user_id, body in zip(self.pick_users(length), self.random.choices(self.bodies, k=length)):
+                comment_id += 1
+                parent_id, parent_path, depth = None, "", 0
+                if thread and self.random.random() < reply_rate:
+                    parent_id, parent_path, parent_depth = self.random.choice(thread)
+                    depth = parent_depth + 1
+                path = comment_path(comment_id, parent_path)
+                if depth < max_depth:
+                    thread.append((comment_id, path, depth))
+                yield (comment_id, body, post_id, user_id, parent_id, path, depth)
+
+    def like_rows(self, count: int, batch_size: int) -> Iterator[tuple]:
+        for start in range(0, count, batch_size):
+            size = min(batch_size, count - start)
+            yield from zip(self.pick_posts(size), self.pick_users(size))
+
+
+def batched(rows: Iterator[tuple], size: int) -> Iterator[list[tuple]]:
+    while batch := list(itertools.islice(rows, size)):
+        yield batch
+
+
+def bulk_insert(connection, table: sqlalchemy.Table, columns: list[str], rows, batch_size: int, progress, task):
+    if connection.dialect.name == "sqlite":
+        # Going straight to the DBAPI cursor skips SQLAlchemy's per-row parameter processing,
+        # which is most of the cost when loading millions of rows.
+        statement = str(table.insert().compile(dialect=connection.dialect, column_keys=columns))
+        cursor = connection.connection.cursor()
+        for batch in batched(rows, batch_size):
+            cursor.executemany(statement, batch)
+            progress.advance(task, len(batch))
+        cursor.close()
+    else:
+        for batch in batched(rows, batch_size):
+            connection.execute(table.insert(), [dict(zip(columns, row)) for row in batch])
+            progress.advance(task, len(batch))
+
+
+def seed(
+    engine: sqlalchemy.Engine,
+    users: int,
+    posts: int,
+    comments: int,
+    likes: int,
+    batch_size: int = 50000,
+    skew: float = 1.1,
+    password: str = "password",
+    random_seed: Optional[int] = None,
+    show_progress: bool = True,
+) -> dict:
+    """
+    Empties the users, posts, comments and likes tables (with their stats and the archive index) and
+    fills them with generated data.
+    Every user has the email user<id>@example.com, is confirmed and shares the same password.
+    Returns the rows inserted per table and the rows per second.
+    """
+    from social_media_fapi.config import config
+    from social_media_fapi.database import (
+        archived_comment_index_table,
+        archived_like_index_table,
+        archived_user_stats_table,
+        comment_table,
+        like_table,
+        post_archive_index_table,
+        post_stats_table,
+        post_table,
+        upload_table,
+        user_stats_table,
+        user_table,
+    )
+    from social_media_fapi.security import get_password_hash
+
+    users = max(users, 1)
+    generator = Generator(users, posts, skew=skew, seed=random_seed)
+    # Hashing is slow on purpose, so every user shares the one hash.
+    password_hash = get_password_hash(password)
+
+    plan = [
+        (user_table, ["id", "email", "password", "confirmed"], generator.user_rows(users, password_hash), users),
+        (post_table, ["id", "body", "user_id", "created_at"], generator.post_rows(posts, batch_size), posts),
+    ]
+    if posts:
+        plan += [
+            (
+                comment_table,
+                ["id", "body", "post_id", "user_id", "parent_id", "path", "depth"],
+                generator.comment_rows(comments, max_depth=config.MAX_COMMENT_DEPTH),
+                comments,
+            ),
+            (like_table, ["post_id", "user_id"], generator.like_rows(likes, batch_size), likes),
+        ]
+
+    start = time.perf_counter()
+    with engine.begin() as connection:
+        if connection.dialect.name == "sqlite":
+            # Only for this connection: don't wait for the disk after every transaction.
+            connection.exec_driver_sql("PRAGMA synchronous = OFF")
+        # The stats go too, stats.reconcile() makes them again for the new rows. So does the index of
+        # posts archived by an earlier run, their ids would hide the new posts with the same ids, and
+        # the direct uploads, which point at the old posts.
+        for table in (
+            like_table,
+            comment_table,
+            post_stats_table,
+            archived_comment_index_table,
+            archived_like_index_table,
+            post_archive_index_table,
+            upload_table,
+            post_table,
+            archived_user_stats_table,
+            user_stats_table,
+            user_table,
+        ):
+            connection.execute(table.delete())
+
+        with Progress(
+            TextColumn("{task.description:10}"),
+            BarColumn(),
+            TextColumn("{task.completed:>10,}/{task.total:,} rows"),
+            TimeRemainingColumn(),
+            disable=not show_progress,
+        ) as progress:
+            for table, columns, rows, total in plan:
+                task = progress.add_task(table.name, total=total)
+                bulk_insert(connection, table, columns, rows, batch_size, progress, task)
+    elapsed = time.perf_counter() - start
+
+    counts = {table.name: total for table, _, _, total in plan}
+    return {**counts, "seconds": round(elapsed, 2), "rows_per_second": round(sum(counts.values()) / elapsed)}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--posts", type=int, default=100000)
+    parser.add_argument("--comments", type=int, default=200000)
+    parser.add_argument("--likes", type=int, default=500000)
+    parser.add_argument("--batch-size", type=int, default=50000)
+    parser.add_argument("--skew", type=float, default=1.1, help="Zipf exponent, higher is more skewed")
+    parser.add_argument("--password", default="password", help="The password of every generated user")
+    parser.add_argument("--random-seed", type=int, help="Set it to generate the same data every run")
+    parser.add_argument("--reset", action="store_true", help="Required, the tables are emptied first")
+    args = parser.parse_args()
+    if not args.reset:
+        parser.error("seeding empties the users, posts, comments and likes tables, pass --reset to confirm")
+
+    from social_media_fapi.database import engine
+
+    result = seed(
+        engine,
+        args.users,
+        args.posts,
+        args.comments,
+        args.likes,
+        batch_size=args.batch_size,
+        skew=args.skew,
+        password=args.password,
+        random_seed=args.random_seed,
+    )
+    print(result)
@@ -0,0 +1,45 @@
+"""
+Production entry point, runs the app with several uvicorn worker processes.
+
+    python -m social_media_fapi.serve
+
+The settings come from the config (e.g. PROD_WEB_CONCURRENCY, PROD_PORT).
+Send SIGHUP to the main process for a graceful reload: the workers are replaced one at a time,
+each new worker is ready before the old one is stopped.
+To reload the settings and clear the in-process caches of every worker without restarting, run python -m social_media_fapi.cache_sync
+"""
+import os
+
+import uvicorn
+
+from social_media_fapi.config import config
+
+
+def main() -> None:
+    # Importing the database module creates the tables. Do it once here, otherwise the workers
+    # starting at the same time all try to create them and some fail with "table already exists".
+    import social_media_fapi.database  # noqa: F401
+
+    uvicorn.run(
+        # The app has to be an import string so every worker process can import it.
+        "social_media_fapi.main:app",
+        host=config.HOST,
+        port=config.PORT,
+        workers=config.WEB_CONCURRENCY or os.cpu_count(),
+        loop=config.UVICORN_LOOP,
+        http=config.UVICORN_HTTP,
+        backlog=config.UVICORN_BACKLOG,
+        limit_concurrency=config.UVICORN_LIMIT_CONCURRENCY,
+        limit_max_requests=config.UVICORN_LIMIT_MAX_REQUESTS,
+        # Stops all the workers restarting at the same time when they reach limit_max_requests.
+        limit_max_requests_jitter=(config.UVICORN_LIMIT_MAX_REQUESTS or 0) // 10,
+        timeout_keep_alive=config.UVICORN_TIMEOUT_KEEP_ALIVE,
+        timeout_graceful_shutdown=config.UVICORN_TIMEOUT_GRACEFUL_SHUTDOWN,
+        # We configure logging ourselves in main.lifespan (including the access log).
+        log_config=None,
+        proxy_headers=True,
+    )
+
+
+if __name__ == "__main__":
+    main()
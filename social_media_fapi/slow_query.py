@@ -0,0 +1,113 @@
+import logging
+import time
+from typing import Any, Optional, Union
+
+import databases
+from sqlalchemy.dialects.sqlite import pysqlite
+from sqlalchemy.sql import ClauseElement
+
+# This logger has its own rotating JSON file, see logging_conf.py
+logger = logging.getLogger("social_media_fapi.slow_query")
+
+Query = Union[ClauseElement, str]
+
+# What databases compiles sqlite queries with, ? placeholders in order.
+SQLITE_DIALECT = pysqlite.dialect(paramstyle="qmark")
+
+
+class SlowQueryDatabase(databases.Database):
+    """
+    A databases.Database that times fetch_all, fetch_one and execute.
+    Statements slower than `slow_query_ms` are logged with the shape of their bound
+    parameters (the types, never the values) and the query plan from EXPLAIN.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        *,
+        slow_query_ms: Optional[float] = None,
+        explain: bool = True,
+        **options: Any,
+    ) -> None:
+        super().__init__(url, **options)
+        self.slow_query_ms = slow_query_ms
+        self.explain = explain
+
+    async def fetch_all(self, query: Query, values: Optional[dict] = None):
+        start = time.perf_counter()
+        result = await super().fetch_all(query, values)
+        await self._check_slow(query, values, start)
+        return result
+
+    async def fetch_one(self, query: Query, values: Optional[dict] = None):
+        start = time.perf_counter()
+        result = await super().fetch_one(query, values)
+        await self._check_slow(query, values, start)
+        return result
+
+    async def execute(self, query: Query, values: Optional[dict] = None):
+        start = time.perf_counter()
+        result = await super().execute(query, values)
+        await self._check_slow(query, values, start)
+        return result
+
+    async def fetch_tuples(self, query: ClauseElement) -> list[tuple]:
+        """
+        fetch_all for results with many rows: each row is the driver's plain tuple, in the order of the
+        query's columns, without a Row and a Record around it. The values aren't converted either, so
+        only for columns that come back as what they are (not booleans or dates on sqlite).
+        """
+        start = time.perf_counter()
+        if self.url.dialect != "sqlite":
+            rows = [tuple(record._mapping) for record in await super().fetch_all(query)]
+        else:
+            compiled = query.compile(dialect=SQLITE_DIALECT, compile_kwargs={"render_postcompile": True})
+            params = compiled.construct_params()
+            async with self.connection() as connection:
+                # One call, so no other query on this connection runs between the execute and the fetch.
+                rows = await connection.raw_connection.execute_fetchall(
+                    compiled.string, [params[key] for key in compiled.positiontup]
+                )
+        await self._check_slow(query, None, start)
+        return rows
+
+    async def _check_slow(self, query: Query, values: Optional[dict], start: float):
+        if self.slow_query_ms is None:
+            return
+        duration_ms = (time.perf_counter() - start) * 1000
+        if duration_ms < self.slow_query_ms:
+            return
+
+        statement, params = compile_query(query, values)
+        plan = await self._explain(statement, params) if self.explain else None
+        logger.warning(
+            "Slow query took %.1fms",
+            duration_ms,
+            extra={
+                "duration_ms": round(duration_ms, 3),
+                "statement": statement,
+                "param_shapes": {name: type(value).__name__ for name, value in params.items()},
+                "plan": plan,
+            },
+        )
+
+    async def _explain(self, statement: str, params: dict) -> list[str]:
+        prefix = "EXPLAIN QUERY PLAN" if self.url.dialect == "sqlite" else "EXPLAIN"
+        try:
+            # Call the parent class so the EXPLAIN itself is not timed and logged.
+            rows = await super().fetch_all(f"{prefix} {statement}", params)
+        except Exception as e:
+            return [f"EXPLAIN failed: {e}"]
+        if self.url.dialect == "sqlite":
+            # The sqlite rows are (id, parent, notused, detail), the detail is the useful part.
+            return [row[3] for row in rows]
+        return [" ".join(str(column) for column in row) for row in rows]
+
+
+def compile_query(query: Query, values: Optional[dict] = None) -> tuple[str, dict]:
+    if isinstance(query, str):
+        return query, values or {}
+    # Compiling without a dialect gives named (:param) placeholders, which databases can bind again.
+    compiled = query.compile()
+    return str(compiled), {**compiled.params, **(values or {})}
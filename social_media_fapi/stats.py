@@ -0,0 +1,118 @@
+"""
+Per-user and per-post counts (posts, comments, likes) served from the user_stats and post_stats tables.
+
+The write routes add to the counts in the same transaction as the row they insert, so reading them
+is a primary key lookup however big the tables get. reconcile() recounts everything from the source
+tables, it runs in the background (see main.lifespan) to fill in rows that were loaded in bulk
+(seed.py) and to fix any drift.
+"""
+import asyncio
+import logging
+
+import sqlalchemy
+
+from social_media_fapi.database import (
+    archived_user_stats_table,
+    comment_table,
+    database,
+    like_table,
+    post_stats_table,
+    post_table,
+    user_stats_table,
+    user_table,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def increment(table: sqlalchemy.Table, key: int, **amounts: int):
+    """The UPDATE adding the amounts to the row's counts, e.g. increment(user_stats_table, 1, post_count=1)"""
+    # col = col + n is done by the database, so concurrent requests can't lose each other's updates.
+    key_column = table.primary_key.columns.values()[0]
+    return (
+        table.update()
+        .where(key_column == key)
+        .values({name: table.c[name] + amount for name, amount in amounts.items()})
+    )
+
+
+def _counts(source: sqlalchemy.Table, source_key, stats_key, *where):
+    return (
+        sqlalchemy.select(sqlalchemy.func.count())
+        .select_from(source)
+        .where(source_key == stats_key, *where)
+        .scalar_subquery()
+    )
+
+
+def _archived(name: str):
+    # What archive.py moved out of the database still counts.
+    column = archived_user_stats_table.c[name]
+    return sqlalchemy.func.coalesce(
+        sqlalchemy.select(column)
+        .where(archived_user_stats_table.c.user_id == user_stats_table.c.user_id)
+        .scalar_subquery(),
+        0,
+    )
+
+
+async def _reconcile_table(
+    stats_table: sqlalchemy.Table, key_name: str, owners: sqlalchemy.Select, counts: dict
+) -> int:
+    key = stats_table.c[key_name]
+    # Rows for users/posts that were inserted without going through the routes.
+    missing = owners.where(~sqlalchemy.exists().where(key == owners.selected_columns.id))
+    await database.execute(stats_table.insert().from_select([key_name], missing))
+    # And the other way round, rows left behind by users/posts that were deleted in bulk.
+    orphans = await database.fetch_all(
+        stats_table.delete().where(key.not_in(owners.scalar_subquery())).returning(key)
+    )
+
+    wrong = sqlalchemy.or_(*(stats_table.c[name] != count for name, count in counts.items()))
+    drifted = await database.fetch_val(sqlalchemy.select(sqlalchemy.func.count()).where(wrong))
+    if drifted:
+        await database.execute(stats_table.update().where(wrong).values(counts))
+    return drifted + len(orphans)
+
+
+async def reconcile() -> dict:
+    """Recount every row of the stats tables, returns how many rows of each were wrong (or orphaned)."""
+    user_id = user_stats_table.c.user_id
+    post_id = post_stats_table.c.post_id
+    async with database.transaction():
+        users = await _reconcile_table(
+            user_stats_table,
+            "user_id",
+            sqlalchemy.select(user_table.c.id),
+            {
+                "post_count": _counts(
+                    post_table, post_table.c.user_id, user_id, post_table.c.deleted_at.is_(None)
+                )
+                + _archived("post_count"),
+                "comment_count": _counts(comment_table, comment_table.c.user_id, user_id)
+                + _archived("comment_count"),
+                "like_count": _counts(like_table, like_table.c.user_id, user_id) + _archived("like_count"),
+            },
+        )
+        posts = await _reconcile_table(
+            post_stats_table,
+            "post_id",
+            # Deleted posts lose their stats row (see routers.post.delete_post).
+            sqlalchemy.select(post_table.c.id).where(post_table.c.deleted_at.is_(None)),
+            {
+                "comment_count": _counts(comment_table, comment_table.c.post_id, post_id),
+                "like_count": _counts(like_table, like_table.c.post_id, post_id),
+            },
+        )
+    return {"user_stats": users, "post_stats": posts}
+
+
+async def watch_reconcile(interval: float):
+    # Runs for the life of the worker (see main.lifespan), the first time straight away.
+    while True:
+        try:
+            drifted = await reconcile()
+            logger.info("Reconciled stats, corrected rows: %s", drifted)
+        except Exception:
+            logger.exception("Could not reconcile the stats")
+        await asyncio.sleep(interval)
@@ -0,0 +1,168 @@
+"""
+Reading an uploaded file while it arrives, for POST /upload (see routers/upload.py).
+
+FastAPI's UploadFile only gets to the route after the whole request body has been parsed and spooled
+to disk, so a file that's too big or of the wrong type would be read in full before we could say no.
+Here the multipart body is parsed as it comes in and each chunk goes through an UploadValidator first:
+
+    413 as soon as the Content-Length, or the bytes so far, are over UPLOAD_MAX_BYTES
+    415 if the first bytes aren't one of UPLOAD_ALLOWED_TYPES (we look at them, not at what the client says)
+
+The sha1 is worked out on the way too, B2 checks the upload against it.
+"""
+import hashlib
+from typing import AsyncIterator, Optional
+
+from fastapi import HTTPException, Request
+from python_multipart import MultipartParser
+from python_multipart.multipart import parse_options_header
+
+# The files we know by their first bytes.
+SIGNATURES = [
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+]
+SNIFF_BYTES = 12
+
+# What we name the files of each type we store, the client's own file name is never used for that
+# (a .html would be served as a page from our domain).
+EXTENSIONS = {
+    "image/png": ".png",
+    "image/jpeg": ".jpg",
+    "image/gif": ".gif",
+    "image/webp": ".webp",
+    "video/mp4": ".mp4",
+}
+
+# Room for the multipart boundaries, part headers and other fields around the file in the Content-Length.
+FORM_OVERHEAD = 16 * 1024
+# The other fields are kept in memory, they're short text like a post's body.
+MAX_FIELD_BYTES = 10 * 1024
+
+
+def sniff(head: bytes) -> Optional[str]:
+    """The type of a file from its first SNIFF_BYTES bytes, None if we don't know it."""
+    for signature, content_type in SIGNATURES:
+        if head.startswith(signature):
+            return content_type
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    if head[4:8] == b"ftyp":
+        return "video/mp4"
+    return None
+
+
+class UploadValidator:
+    def __init__(self, max_bytes: int, allowed_types: list[str]) -> None:
+        self.max_bytes = max_bytes
+        self.allowed_types = allowed_types
+        self.size = 0
+        self.content_type: Optional[str] = None
+        self._head = b""
+        self._sha1 = hashlib.sha1()
+
+    def check_content_length(self, content_length: Optional[str]) -> None:
+        if content_length and content_length.isdigit() and int(content_length) > self.max_bytes + FORM_OVERHEAD:
+            raise HTTPException(status_code=413, detail=f"The file is bigger than {self.max_bytes} bytes")
+
+    def feed(self, chunk: bytes) -> None:
+        """Call with each chunk before keeping it, raises the 413/415 as soon as we know."""
+        self.size += len(chunk)
+        if self.size > self.max_bytes:
+            raise HTTPException(status_code=413, detail=f"The file is bigger than {self.max_bytes} bytes")
+        if self.content_type is None:
+            self._head += chunk[: SNIFF_BYTES - len(self._head)]
+            if len(self._head) >= SNIFF_BYTES:
+                self._check_type()
+        self._sha1.update(chunk)
+
+    def finish(self) -> None:
+        # Files shorter than SNIFF_BYTES are only checked here.
+        if self.content_type is None:
+            self._check_type()
+
+    def _check_type(self) -> None:
+        content_type = sniff(self._head)
+        if content_type not in self.allowed_types:
+            raise HTTPException(
+                status_code=415, detail="Only these types can be uploaded: " + ", ".join(self.allowed_types)
+            )
+        self.content_type = content_type
+
+    @property
+    def sha1(self) -> str:
+        return self._sha1.hexdigest()
+
+
+class MultipartFile:
+    """
+    The file in one field of a multipart/form-data request, read from the body as it arrives.
+    The other fields that aren't files are in .fields once chunks() is done.
+    """
+
+    def __init__(self, request: Request, field: str, required: bool = True) -> None:
+        content_type, options = parse_options_header(request.headers.get("content-type", ""))
+        if content_type != b"multipart/form-data" or b"boundary" not in options:
+            raise HTTPException(status_code=400, detail="Expected a multipart/form-data body")
+        self.request = request
+        self.field = field.encode()
+        self.required = required
+        self.boundary = options[b"boundary"]
+        self.filename: Optional[str] = None
+        self.fields: dict[str, str] = {}
+
+    async def chunks(self) -> AsyncIterator[bytes]:
+        # The parser calls back while we feed it, so we collect what it found and act on it between chunks.
+        events: list[tuple[str, object]] = []
+        header_field, header_value, headers = bytearray(), bytearray(), {}
+
+        def on_header_end():
+            headers[bytes(header_field).lower()] = bytes(header_value)
+            header_field.clear()
+            header_value.clear()
+
+        def on_headers_finished():
+            events.append(("part", dict(headers)))
+            headers.clear()
+
+        parser = MultipartParser(
+            self.boundary,
+            {
+                "on_header_field": lambda data, start, end: header_field.extend(data[start:end]),
+                "on_header_value": lambda data, start, end: header_value.extend(data[start:end]),
+                "on_header_end": on_header_end,
+                "on_headers_finished": on_headers_finished,
+                "on_part_data": lambda data, start, end: events.append(("data", data[start:end])),
+            },
+        )
+        found = in_file = False
+        field: Optional[bytearray] = None
+        fields: dict[str, bytearray] = {}
+        async for body in self.request.stream():
+            parser.write(body)
+            for kind, value in events:
+                if kind == "part":
+                    _, options = parse_options_header(value.get(b"content-disposition", b""))
+                    # Only the first file in the field, other files are read past.
+                    in_file = not found and options.get(b"name") == self.field and b"filename" in options
+                    field = None
+                    if in_file:
+                        found = True
+                        self.filename = options[b"filename"].decode(errors="replace")
+                    elif b"filename" not in options and b"name" in options:
+                        field = fields.setdefault(options[b"name"].decode(errors="replace"), bytearray())
+                elif in_file and value:
+                    yield value
+                elif field is not None:
+                    field.extend(value)
+                    if len(field) > MAX_FIELD_BYTES:
+                        raise HTTPException(
+                            status_code=413, detail=f"Form fields can't be over {MAX_FIELD_BYTES} bytes"
+                        )
+            events.clear()
+        parser.finalize()
+        self.fields = {name: value.decode(errors="replace") for name, value in fields.items()}
+        if self.required and not found:
+            raise HTTPException(status_code=422, detail=f"No file in the {self.field.decode()} field")
@@ -1,13 +1,21 @@
 import logging
+import mimetypes
+import pathlib
+import smtplib
+import time
 from json import JSONDecodeError
 
 import httpx
 from databases import Database
 
 from social_media_fapi.config import config
-
-
 from social_media_fapi.database import post_table
+from social_media_fapi.events import FEED_TOPIC, bus, post_topic
+from social_media_fapi.image_generation import image_generator, prompt_key
+from social_media_fapi.image_providers import DeepAIProvider, ProviderError, generate_hedged, get_provider, register
+from social_media_fapi.libs.b2 import b2_upload_bytes
+from social_media_fapi.mail import build_message, smtp_pool
+from social_media_fapi.tls import ssl_context
 
 logger = logging.getLogger(__name__)
 
@@ -18,13 +26,22 @@ class APIResponseError(Exception):
 
 async def send_simple_email(to_email: str, subject: str, body: str):
     logger.debug(f"Sending email to '{to_email[:3]}' with subject '{subject[:20]}'")
-    async with httpx.AsyncClient() as client:
+    sender = f"Mike <mailgun@{config.MAILGUN_DOMAIN}>"
+    if config.MAIL_TRANSPORT == "smtp":
+        # Over connections that are kept open, see mail.py
+        try:
+            await smtp_pool().send(build_message(sender, to_email, subject, body))
+        except (smtplib.SMTPException, OSError) as err:
+            raise APIResponseError(f"SMTP delivery failed: {err}") from err
+        return None
+
+    async with httpx.AsyncClient(verify=ssl_context()) as client:
         try:
             response = await client.post(
-                f"https://api.mailgun.net/v3/{config.MAILGUN_DOMAIN}/messages",
-                auth=("api, config.MAILGUN_API_KEY"),
+                f"{config.MAILGUN_BASE_URL}/{config.MAILGUN_DOMAIN}/messages",
+                auth=("api", config.MAILGUN_API_KEY),
                 data={
-                    "from": f"Mike <mailgun@{config.MAILGUN_DOMAIN}>",
+                    "from": sender,
                     "to": [to_email],
                     "subject": subject,
                     "text": body,
@@ -56,7 +73,7 @@ async def send_user_registration_email(email: str, confirmation_url: str):
 
 async def _generate_cute_creature_api(prompt: str):
     logger.debug("Generate cute creature")
-    async with httpx.AsyncClient() as client:
+    async with httpx.AsyncClient(verify=ssl_context()) as client:
         try:
             response = await client.post(
                 # "https://api.deepai.org/api/text2img"
@@ -76,6 +93,47 @@ async def _generate_cute_creature_api(prompt: str):
             raise APIResponseError("API response parsing failed") from err
 
 
+async def _store_generated_image(prompt: str, output_url: str) -> str:
+    """Copies the image DeepAI made to our bucket, their links don't last. Without B2 it's their link."""
+    if not config.B2_KEY_ID:
+        return output_url
+    async with httpx.AsyncClient(verify=ssl_context(), timeout=60) as client:
+        response = await client.get(output_url)
+        response.raise_for_status()
+    content_type = response.headers.get("content-type", "image/jpeg").split(";")[0]
+    suffix = pathlib.PurePosixPath(output_url).suffix or mimetypes.guess_extension(content_type) or ""
+    file_name = f"generated/{prompt_key(prompt)}{suffix}"
+    return await b2_upload_bytes(response.content, file_name, content_type)
+
+
+async def _deepai_image_url(prompt: str) -> str:
+    response = await _generate_cute_creature_api(prompt)
+    try:
+        return response["output_url"]
+    except (KeyError, TypeError) as err:
+        raise APIResponseError("API response had no output_url") from err
+
+
+# A lambda, so _generate_cute_creature_api is looked up on every call (the tests patch it).
+register(DeepAIProvider(config.IMAGE_PROVIDER_TIMEOUT, lambda prompt: _deepai_image_url(prompt)))
+
+
+async def _generate_image_url(prompt: str) -> str:
+    provider = get_provider()
+    output_url = await generate_hedged(
+        provider, prompt, attempts=config.IMAGE_PROVIDER_ATTEMPTS, hedge_after=config.IMAGE_HEDGE_AFTER
+    )
+    if not provider.external:
+        return output_url
+    try:
+        return await _store_generated_image(prompt, output_url)
+    except httpx.HTTPError as err:
+        raise APIResponseError(f"Could not store the generated image: {err}") from err
+    except Exception as err:
+        logger.exception("Could not upload the generated image to B2")
+        raise APIResponseError("Could not store the generated image") from err
+
+
 async def generate_and_add_to_post(
     email: str,
     post_id: int,
@@ -84,8 +142,9 @@ async def generate_and_add_to_post(
     prompt: str = "A blue British shorthair cat is sitting on a couch",
 ):
     try:
-        response = await _generate_cute_creature_api(prompt)
-    except APIResponseError:
+        # The same prompt as a recent post gets the same image, see image_generation.py
+        image_url = await image_generator.get(prompt, _generate_image_url)
+    except (APIResponseError, ProviderError):
         return await send_simple_email(
             email,
             "Error generating image",
@@ -98,16 +157,24 @@ async def generate_and_add_to_post(
 
     query = (
         post_table.update()
-        .where(post_table.c.id == post_id)
-        .values(image_url = response["output_url"])
+        # The post may have been deleted while the image was being made, cleanup.py won't look at it again.
+        .where(post_table.c.id == post_id, post_table.c.deleted_at.is_(None))
+        .values(image_url = image_url, updated_at=time.time())
+        .returning(post_table.c.id)
     )
 
     logger.debug(query)
 
-    await database.execute(query)
+    if await database.fetch_one(query) is None:
+        logger.info("Post %s was deleted before its image was ready", post_id)
+        return None
 
     logger.debug("Database connection in background task closed")
 
+    event = {"type": "post_image_ready", "post_id": post_id, "image_url": image_url}
+    bus.publish(post_topic(post_id), event)
+    bus.publish(FEED_TOPIC, event)
+
     await send_simple_email(
         email,
         "Image generation completed",
@@ -117,4 +184,4 @@ async def generate_and_add_to_post(
         ),
     )
 
-    return response
+    return {"output_url": image_url}
@@ -1,4 +1,7 @@
+import atexit
 import os
+import pathlib
+import tempfile
 from typing import AsyncGenerator, Generator
 from unittest.mock import AsyncMock, Mock
 
@@ -9,10 +12,21 @@ from httpx import ASGITransport, AsyncClient, Request, Response
 # This is used to overwrite the main envrionment settings by setting the envrionment to use test database.
 os.environ["ENV_STATE"] = "test"
 
-from social_media_fapi.database import database, user_table  # noqa: E402
+# Every process running tests (each pytest-xdist worker, or just the one) gets its own new database
+# file, so `pytest -n auto` works and there's never an old test.db with an out of date schema.
+# database.py creates the tables when it's imported below.
+if "TEST_DATABASE_URL" not in os.environ:
+    test_database_file = pathlib.Path(tempfile.gettempdir()) / f"social_media_fapi-test-{os.getpid()}.db"
+    test_database_file.unlink(missing_ok=True)
+    os.environ["TEST_DATABASE_URL"] = f"sqlite:///{test_database_file}"
+    atexit.register(test_database_file.unlink, missing_ok=True)
+
+from social_media_fapi.database import database, user_stats_table, user_table  # noqa: E402
+from social_media_fapi.image_generation import image_generator  # noqa: E402
 
 # the # noqa: E402  tells the ruff linter to ignore the rule to put this import to the top of hte file.
 from social_media_fapi.main import app  # noqa: E402
+from social_media_fapi.security import create_access_token, get_password_hash  # noqa: E402
 from social_media_fapi.tests.helpers import create_post  # noqa: E402
 
 
@@ -41,6 +55,14 @@ async def db() -> AsyncGenerator:
     await database.disconnect()
 
 
+@pytest.fixture(autouse=True)
+def clear_image_cache():
+    # The database rolls back after each test, the in-memory cache of generated images has to as well.
+    image_generator.clear()
+    yield
+    image_generator.clear()
+
+
 @pytest.fixture()
 async def async_client() -> AsyncGenerator:
     from social_media_fapi.main import app  # Import your FastAPI app here
@@ -50,13 +72,19 @@ async def async_client() -> AsyncGenerator:
         yield ac
 
 
+@pytest.fixture(scope="session")
+def password_hash() -> str:
+    # Hashed once for the whole run. The tests of /register itself still go through the route.
+    return get_password_hash("1234")
+
+
 @pytest.fixture()
-async def registered_user(async_client: AsyncClient) -> dict:
+async def registered_user(password_hash: str) -> dict:
+    # Straight into the tables, the same rows /register would create.
     user_details = {"email": "test@example.com", "password": "1234"}
-    await async_client.post("/register", json=user_details)
-    query = user_table.select().where(user_table.c.email == user_details["email"])
-    user = await database.fetch_one(query)
-    user_details["id"] = user.id
+    query = user_table.insert().values(email=user_details["email"], password=password_hash)
+    user_details["id"] = await database.execute(query)
+    await database.execute(user_stats_table.insert().values(user_id=user_details["id"]))
     return user_details
 
 
@@ -72,10 +100,9 @@ async def confirmed_user(registered_user: dict) -> dict:
 
 
 @pytest.fixture()
-async def logged_in_token(async_client: AsyncClient, confirmed_user: dict) -> str:
-    response = await async_client.post("/token", json=confirmed_user)
-    assert response.status_code == 200
-    return response.json().get("access_token")
+def logged_in_token(confirmed_user: dict) -> str:
+    # What /token would give back, the login itself is tested in routers/test_user.py
+    return create_access_token(confirmed_user["email"])
 
 
 @pytest.fixture(autouse=True)
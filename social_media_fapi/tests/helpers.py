@@ -33,3 +33,20 @@ async def like_post(
         headers={"Authorization": f"Bearer {logged_in_token}"},
     )
     return response.json()
+
+
+async def create_reply(
+    body: str, post_id: int, parent_id: int, async_client: AsyncClient, logged_in_token: str
+) -> dict:
+    response = await async_client.post(
+        "/comment",
+        json={"body": body, "post_id": post_id, "parent_id": parent_id},
+        headers={"Authorization": f"Bearer {logged_in_token}"},
+    )
+    return response.json()
+
+
+async def delete_post(post_id: int, async_client: AsyncClient, logged_in_token: str):
+    return await async_client.delete(
+        f"/post/{post_id}", headers={"Authorization": f"Bearer {logged_in_token}"}
+    )
@@ -0,0 +1,186 @@
+import pytest
+from httpx import AsyncClient
+
+from social_media_fapi import direct_uploads
+from social_media_fapi.config import config
+from social_media_fapi.database import database, upload_table
+
+PNG = b"\x89PNG\r\n\x1a\n" + b"\0" * 100
+
+
+@pytest.fixture(autouse=True)
+def local_storage(mocker, tmp_path):
+    mocker.patch.object(config, "B2_KEY_ID", None)
+    mocker.patch.object(config, "MEDIA_DIR", str(tmp_path))
+    return tmp_path
+
+
+async def authorize(
+    async_client: AsyncClient, token: str, file_name: str = "my cat.png", content_type: str = "image/png"
+) -> dict:
+    response = await async_client.post(
+        "/upload/authorize",
+        json={"file_name": file_name, "content_type": content_type},
+        headers={"Authorization": f"Bearer {token}"},
+    )
+    assert response.status_code == 201
+    return response.json()
+
+
+async def send_file(async_client: AsyncClient, upload: dict, content: bytes = PNG):
+    # What the client does with the answer from /upload/authorize.
+    return await async_client.request(
+        upload["method"], upload["upload_url"], headers=upload["headers"], content=content
+    )
+
+
+async def complete(async_client: AsyncClient, token: str, upload_id: str, post_id: int = None):
+    return await async_client.post(
+        "/upload/complete",
+        json={"upload_id": upload_id, "post_id": post_id},
+        headers={"Authorization": f"Bearer {token}"},
+    )
+
+
+@pytest.mark.anyio
+async def test_direct_upload_to_a_post(
+    async_client: AsyncClient, logged_in_token: str, created_post: dict, local_storage
+):
+    upload = await authorize(async_client, logged_in_token)
+    assert upload["method"] == "PUT"
+    assert (await send_file(async_client, upload)).status_code == 204
+
+    response = await complete(async_client, logged_in_token, upload["upload_id"], created_post["id"])
+
+    assert response.status_code == 200
+    file_url = response.json()["file_url"]
+    assert file_url.startswith("/media/uploads/") and file_url.endswith("/file.png")
+    assert response.json()["size"] == len(PNG)
+    assert (local_storage / file_url.removeprefix("/media/")).read_bytes() == PNG
+    post = await async_client.get(f"/post/{created_post['id']}")
+    assert post.json()["post"]["image_url"] == file_url
+
+
+@pytest.mark.anyio
+async def test_upload_needs_the_token(async_client: AsyncClient, logged_in_token: str):
+    upload = await authorize(async_client, logged_in_token)
+    upload["headers"]["X-Upload-Token"] = "wrong"
+    assert (await send_file(async_client, upload)).status_code == 403
+
+
+@pytest.mark.anyio
+async def test_complete_before_upload(async_client: AsyncClient, logged_in_token: str):
+    upload = await authorize(async_client, logged_in_token)
+    response = await complete(async_client, logged_in_token, upload["upload_id"])
+    assert response.status_code == 400
+
+
+@pytest.mark.anyio
+async def test_complete_twice(async_client: AsyncClient, logged_in_token: str):
+    upload = await authorize(async_client, logged_in_token)
+    await send_file(async_client, upload)
+    assert (await complete(async_client, logged_in_token, upload["upload_id"])).status_code == 200
+    assert (await complete(async_client, logged_in_token, upload["upload_id"])).status_code == 409
+    # And the file can't be replaced after.
+    assert (await send_file(async_client, upload)).status_code == 403
+
+
+@pytest.mark.anyio
+async def test_expired_upload(async_client: AsyncClient, logged_in_token: str, local_storage):
+    upload = await authorize(async_client, logged_in_token)
+    await send_file(async_client, upload)
+    await database.execute(upload_table.update().values(expires_at=0))
+
+    response = await complete(async_client, logged_in_token, upload["upload_id"])
+    assert response.status_code == 410
+
+    assert await direct_uploads.delete_expired_uploads() == 1
+    assert await direct_uploads.find_upload(upload["upload_id"]) is None
+    assert not any(path.is_file() for path in local_storage.rglob("*"))
+
+
+@pytest.mark.anyio
+async def test_b2_authorisation(async_client: AsyncClient, logged_in_token: str, mocker):
+    mocker.patch.object(config, "B2_KEY_ID", "key")
+    mocker.patch.object(
+        direct_uploads.b2_client, "upload_authorization", return_value=("https://b2.example/upload", "b2-token")
+    )
+    upload = await authorize(async_client, logged_in_token)
+
+    assert upload["upload_url"] == "https://b2.example/upload"
+    assert upload["method"] == "POST"
+    assert upload["headers"]["Authorization"] == "b2-token"
+    assert upload["headers"]["X-Bz-File-Name"].endswith("/file.png")
+
+
+@pytest.mark.anyio
+async def test_authorize_type_not_allowed(async_client: AsyncClient, logged_in_token: str):
+    response = await async_client.post(
+        "/upload/authorize",
+        json={"file_name": "evil.html", "content_type": "text/html"},
+        headers={"Authorization": f"Bearer {logged_in_token}"},
+    )
+    assert response.status_code == 415
+
+
+@pytest.mark.anyio
+async def test_local_upload_of_another_type(async_client: AsyncClient, logged_in_token: str, local_storage):
+    upload = await authorize(async_client, logged_in_token, file_name="evil.html")
+
+    response = await send_file(async_client, upload, b"<script>alert(1)</script>" * 100)
+
+    assert response.status_code == 415
+    assert not any(path.is_file() for path in local_storage.rglob("*"))
+    assert (await complete(async_client, logged_in_token, upload["upload_id"])).status_code == 400
+
+
+@pytest.mark.anyio
+async def test_local_upload_too_big(async_client: AsyncClient, logged_in_token: str, local_storage, mocker):
+    mocker.patch.object(config, "UPLOAD_MAX_BYTES", 10)
+    upload = await authorize(async_client, logged_in_token)
+
+    assert (await send_file(async_client, upload)).status_code == 413
+    assert not any(path.is_file() for path in local_storage.rglob("*"))
+
+
+@pytest.mark.anyio
+async def test_local_upload_wrong_sha1(async_client: AsyncClient, logged_in_token: str, local_storage):
+    upload = await authorize(async_client, logged_in_token)
+    upload["headers"]["X-Bz-Content-Sha1"] = "0" * 40
+
+    assert (await send_file(async_client, upload)).status_code == 400
+    assert not any(path.is_file() for path in local_storage.rglob("*"))
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize(
+    "size, content_type, status_code",
+    [(100, "text/html", 415), (10**9, "image/png", 413), (100, "image/png", 200)],
+)
+async def test_complete_checks_b2_file(
+    async_client: AsyncClient, logged_in_token: str, mocker, size, content_type, status_code
+):
+    mocker.patch.object(config, "B2_KEY_ID", "key")
+    mocker.patch.object(
+        direct_uploads.b2_client, "upload_authorization", return_value=("https://b2.example/upload", "b2-token")
+    )
+    mocker.patch.object(
+        direct_uploads.b2_client, "file_by_name", return_value=("https://b2.example/file", size, content_type)
+    )
+    delete = mocker.patch("social_media_fapi.direct_uploads.b2_delete_file_by_url")
+    upload = await authorize(async_client, logged_in_token)
+
+    response = await complete(async_client, logged_in_token, upload["upload_id"])
+
+    assert response.status_code == status_code
+    if status_code == 200:
+        delete.assert_not_called()
+    else:
+        delete.assert_called_once_with("https://b2.example/file")
+        assert await direct_uploads.find_upload(upload["upload_id"]) is None
+
+
+def test_object_name():
+    name = direct_uploads.object_name(1, "image/jpeg")
+    assert name.startswith("uploads/1/") and name.endswith("/file.jpg")
+    assert direct_uploads.object_name(1, "image/png", prefix="posts", stem="thumbnail").endswith("/thumbnail.png")
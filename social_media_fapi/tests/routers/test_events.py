@@ -0,0 +1,32 @@
+import json
+
+from fastapi.testclient import TestClient
+
+from social_media_fapi.events import FEED_TOPIC, bus, post_topic
+
+
+def test_post_websocket_receives_events(client: TestClient):
+    with client.websocket_connect("/ws/post/1") as websocket:
+        # Publish from the event loop the app is running on.
+        websocket.portal.call(bus.publish, post_topic(1), {"type": "comment_created"})
+        assert json.loads(websocket.receive_text()) == {"type": "comment_created"}
+
+
+def test_websocket_subscribe_command(client: TestClient):
+    with client.websocket_connect("/ws/post") as websocket:
+        websocket.send_json({"subscribe": 5})
+        assert websocket.receive_json() == {"subscribed": 5}
+        websocket.portal.call(bus.publish, FEED_TOPIC, {"type": "post_created"})
+        assert json.loads(websocket.receive_text()) == {"type": "post_created"}
+        websocket.portal.call(bus.publish, post_topic(5), {"type": "post_liked"})
+        assert json.loads(websocket.receive_text()) == {"type": "post_liked"}
+
+
+def test_websocket_invalid_commands(client: TestClient):
+    with client.websocket_connect("/ws/post") as websocket:
+        for command in ('{"subscribe": "abc"}', "[1, 2]", "not json", '{"hello": 1}'):
+            websocket.send_text(command)
+            assert "error" in websocket.receive_json()
+        # Still open and listening.
+        websocket.send_json({"subscribe": 5})
+        assert websocket.receive_json() == {"subscribed": 5}
@@ -2,7 +2,13 @@ import pytest
 from httpx import AsyncClient
 
 from social_media_fapi import security
-from social_media_fapi.tests.helpers import create_comment, create_post, like_post
+from social_media_fapi.tests.helpers import (
+    create_comment,
+    create_post,
+    create_reply,
+    delete_post,
+    like_post,
+)
 
 """
 To run the tests go into the social_media_fapi (the top one) and run: pytest.
@@ -232,3 +238,181 @@ async def test_get_missing_post_with_comments(
     response = await async_client.get("/post/2")
 
     assert response.status_code == 404
+
+
+@pytest.mark.anyio
+async def test_create_reply(
+    async_client: AsyncClient, created_post: dict, created_comment: dict, logged_in_token: str
+):
+    reply = await create_reply(
+        "Test Reply", created_post["id"], created_comment["id"], async_client, logged_in_token
+    )
+    assert {"parent_id": created_comment["id"], "depth": 1}.items() <= reply.items()
+
+
+@pytest.mark.anyio
+async def test_create_reply_to_missing_comment(
+    async_client: AsyncClient, created_post: dict, logged_in_token: str
+):
+    response = await async_client.post(
+        "/comment",
+        json={"body": "Test Reply", "post_id": created_post["id"], "parent_id": 99},
+        headers={"Authorization": f"Bearer {logged_in_token}"},
+    )
+    assert response.status_code == 404
+
+
+@pytest.mark.anyio
+async def test_create_reply_too_deep(
+    async_client: AsyncClient, created_post: dict, created_comment: dict, logged_in_token: str, mocker
+):
+    mocker.patch("social_media_fapi.routers.post.config.MAX_COMMENT_DEPTH", 0)
+    response = await async_client.post(
+        "/comment",
+        json={"body": "Test Reply", "post_id": created_post["id"], "parent_id": created_comment["id"]},
+        headers={"Authorization": f"Bearer {logged_in_token}"},
+    )
+    assert response.status_code == 400
+
+
+@pytest.mark.anyio
+async def test_get_comment_thread(
+    async_client: AsyncClient, created_post: dict, created_comment: dict, logged_in_token: str
+):
+    post_id = created_post["id"]
+    first = await create_reply("1", post_id, created_comment["id"], async_client, logged_in_token)
+    nested = await create_reply("1.1", post_id, first["id"], async_client, logged_in_token)
+    second = await create_reply("2", post_id, created_comment["id"], async_client, logged_in_token)
+    other = await create_comment("Other", post_id, async_client, logged_in_token)
+
+    response = await async_client.get(f"/post/{post_id}/thread")
+    assert response.status_code == 200
+    assert response.json()["next_cursor"] is None
+    assert [(c["id"], c["reply_count"]) for c in response.json()["comments"]] == [
+        (created_comment["id"], 2),
+        (first["id"], 1),
+        (nested["id"], 0),
+        (second["id"], 0),
+        (other["id"], 0),
+    ]
+
+    # Only the first reply to each comment, the second reply to the post is cut as well.
+    # Only the first reply to each comment, and the first comment on the post on the first page.
+    params = {"limit": 1, "replies_per_comment": 1, "max_depth": 1}
+    page = (await async_client.get(f"/post/{post_id}/thread", params=params)).json()
+    assert [c["id"] for c in page["comments"]] == [created_comment["id"], first["id"]]
+
+    page = (await async_client.get(f"/post/{post_id}/thread", params={**params, "cursor": page["next_cursor"]})).json()
+    assert [c["id"] for c in page["comments"]] == [other["id"]]
+    assert page["next_cursor"] is None
+
+
+@pytest.mark.anyio
+async def test_get_comment_thread_pages_comments_on_the_post(
+    async_client: AsyncClient, created_post: dict, logged_in_token: str
+):
+    post_id = created_post["id"]
+    comments = [await create_comment(str(number), post_id, async_client, logged_in_token) for number in range(5)]
+    reply = await create_reply("Reply", post_id, comments[1]["id"], async_client, logged_in_token)
+
+    seen = []
+    cursor = None
+    while True:
+        # More comments on the post than replies_per_comment, they're paged by limit.
+        params = {"limit": 2, "replies_per_comment": 1, **({"cursor": cursor} if cursor else {})}
+        page = (await async_client.get(f"/post/{post_id}/thread", params=params)).json()
+        seen += [c["id"] for c in page["comments"]]
+        cursor = page["next_cursor"]
+        if cursor is None:
+            break
+
+    assert seen == [comments[0]["id"], comments[1]["id"], reply["id"], *(c["id"] for c in comments[2:])]
+
+
+@pytest.mark.anyio
+async def test_get_comment_replies_pages(
+    async_client: AsyncClient, created_post: dict, created_comment: dict, logged_in_token: str
+):
+    post_id = created_post["id"]
+    first = await create_reply("1", post_id, created_comment["id"], async_client, logged_in_token)
+    nested = await create_reply("1.1", post_id, first["id"], async_client, logged_in_token)
+    second = await create_reply("2", post_id, created_comment["id"], async_client, logged_in_token)
+    await create_comment("Not a reply", post_id, async_client, logged_in_token)
+
+    url = f"/comment/{created_comment['id']}/replies"
+    page = (await async_client.get(url, params={"limit": 2})).json()
+    assert [c["id"] for c in page["comments"]] == [first["id"], nested["id"]]
+
+    page = (await async_client.get(url, params={"limit": 2, "cursor": page["next_cursor"]})).json()
+    assert [c["id"] for c in page["comments"]] == [second["id"]]
+    assert page["next_cursor"] is None
+
+
+@pytest.mark.anyio
+async def test_get_replies_missing_comment(async_client: AsyncClient):
+    response = await async_client.get("/comment/99/replies")
+    assert response.status_code == 404
+
+
+@pytest.mark.anyio
+async def test_get_post_stats(
+    async_client: AsyncClient, created_post: dict, created_comment: dict, logged_in_token: str
+):
+    await like_post(created_post["id"], async_client, logged_in_token)
+    response = await async_client.get(f"/post/{created_post['id']}/stats")
+    assert response.status_code == 200
+    assert response.json() == {"post_id": created_post["id"], "comment_count": 1, "like_count": 1}
+
+
+@pytest.mark.anyio
+async def test_delete_post(
+    async_client: AsyncClient, created_post: dict, confirmed_user: dict, logged_in_token: str
+):
+    response = await delete_post(created_post["id"], async_client, logged_in_token)
+    assert response.status_code == 204
+
+    assert (await async_client.get(f"/post/{created_post['id']}")).status_code == 404
+    assert (await async_client.get("/post")).json() == []
+    stats = (await async_client.get(f"/user/{confirmed_user['id']}/stats")).json()
+    assert stats["post_count"] == 0
+    # Already gone.
+    response = await delete_post(created_post["id"], async_client, logged_in_token)
+    assert response.status_code == 404
+
+
+@pytest.mark.anyio
+async def test_delete_post_hides_its_comments(
+    async_client: AsyncClient, created_post: dict, created_comment: dict, logged_in_token: str
+):
+    await delete_post(created_post["id"], async_client, logged_in_token)
+
+    # The comments are still in the table until the cleaner runs, but not served.
+    assert (await async_client.get(f"/post/{created_post['id']}/comment")).json() == []
+    assert (await async_client.get(f"/post/{created_post['id']}/thread")).json()["comments"] == []
+    response = await async_client.get(f"/comment/{created_comment['id']}/replies")
+    assert response.status_code == 404
+
+
+@pytest.mark.anyio
+async def test_delete_post_not_owner(async_client: AsyncClient, created_post: dict):
+    await async_client.post("/register", json={"email": "other@example.com", "password": "1234"})
+    token = security.create_access_token("other@example.com")
+    response = await delete_post(created_post["id"], async_client, token)
+    assert response.status_code == 403
+
+
+@pytest.mark.anyio
+async def test_get_all_posts_not_modified(
+    async_client: AsyncClient, created_post: dict, logged_in_token: str
+):
+    response = await async_client.get("/post")
+    etag = response.headers["etag"]
+
+    response = await async_client.get("/post", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+
+    # A like changes the feed, so the old ETag no longer matches.
+    await like_post(created_post["id"], async_client, logged_in_token)
+    response = await async_client.get("/post", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["etag"] != etag
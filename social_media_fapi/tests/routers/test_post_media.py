@@ -0,0 +1,111 @@
+import pytest
+from httpx import AsyncClient
+
+from social_media_fapi import post_media
+from social_media_fapi.config import config
+
+PNG = b"\x89PNG\r\n\x1a\n" + b"\0" * 100
+
+
+@pytest.fixture(autouse=True)
+def local_storage(mocker, tmp_path):
+    mocker.patch.object(config, "B2_KEY_ID", None)
+    mocker.patch.object(config, "MEDIA_DIR", str(tmp_path))
+    return tmp_path
+
+
+async def create_post_with_media(
+    async_client: AsyncClient, token: str, body: str = "My post", media: bytes = PNG
+):
+    return await async_client.post(
+        "/post",
+        data={"body": body} if body is not None else {},
+        files={"media": ("cat.png", media)} if media is not None else None,
+        headers={"Authorization": f"Bearer {token}"},
+    )
+
+
+@pytest.mark.anyio
+async def test_create_post_with_media(async_client: AsyncClient, logged_in_token: str, local_storage):
+    response = await create_post_with_media(async_client, logged_in_token)
+
+    assert response.status_code == 201
+    assert response.json()["body"] == "My post"
+    assert response.json()["media_status"] == "pending"
+
+    # The test client waits for the background tasks, so the media is stored by now.
+    post = (await async_client.get(f"/post/{response.json()['id']}")).json()["post"]
+    assert post["media_status"] == "ready"
+    assert post["image_url"].startswith("/media/posts/") and post["image_url"].endswith("/file.png")
+    assert (local_storage / post["image_url"].removeprefix("/media/")).read_bytes() == PNG
+
+
+@pytest.mark.anyio
+async def test_create_post_form_without_media(async_client: AsyncClient, logged_in_token: str):
+    response = await create_post_with_media(async_client, logged_in_token, media=None)
+
+    assert response.status_code == 201
+    assert response.json()["media_status"] is None
+
+
+@pytest.mark.anyio
+async def test_create_post_form_missing_body(async_client: AsyncClient, logged_in_token: str, mocker):
+    discard = mocker.spy(post_media.PendingMedia, "discard")
+    response = await create_post_with_media(async_client, logged_in_token, body=None)
+
+    assert response.status_code == 422
+    discard.assert_called_once()
+
+
+@pytest.mark.anyio
+async def test_create_post_media_wrong_type(async_client: AsyncClient, logged_in_token: str):
+    response = await create_post_with_media(async_client, logged_in_token, media=b"just some text, not an image")
+    assert response.status_code == 415
+
+
+@pytest.mark.anyio
+async def test_media_that_could_not_be_stored(async_client: AsyncClient, logged_in_token: str, mocker):
+    mocker.patch("social_media_fapi.post_media.store", side_effect=OSError("disk full"))
+    response = await create_post_with_media(async_client, logged_in_token)
+
+    post = (await async_client.get(f"/post/{response.json()['id']}")).json()["post"]
+    assert post["media_status"] == "failed"
+    assert post["image_url"] is None
+
+
+@pytest.mark.anyio
+async def test_post_deleted_before_media_was_ready(
+    async_client: AsyncClient, logged_in_token: str, created_post: dict, local_storage, tmp_path_factory
+):
+    await async_client.delete(f"/post/{created_post['id']}", headers={"Authorization": f"Bearer {logged_in_token}"})
+    path = tmp_path_factory.mktemp("pending") / "upload"
+    path.write_bytes(PNG)
+
+    await post_media.finalize(created_post["id"], 1, post_media.PendingMedia(path, "cat.png", "image/png", "sha1"))
+
+    assert not path.exists()
+    assert not any(path.is_file() for path in local_storage.rglob("*"))
+
+
+def test_thumbnail(tmp_path):
+    Image = pytest.importorskip("PIL.Image")
+    source = tmp_path / "big.png"
+    Image.new("RGB", (1000, 500), "red").save(source)
+
+    thumbnail = post_media.make_thumbnail(source, 100)
+
+    with Image.open(thumbnail) as image:
+        assert image.size == (100, 50)
+
+
+@pytest.mark.anyio
+async def test_create_post_with_image_has_thumbnail(async_client: AsyncClient, logged_in_token: str, tmp_path):
+    Image = pytest.importorskip("PIL.Image")
+    Image.new("RGB", (1000, 500), "red").save(tmp_path / "big.png")
+
+    response = await create_post_with_media(async_client, logged_in_token, media=(tmp_path / "big.png").read_bytes())
+
+    post = (await async_client.get(f"/post/{response.json()['id']}")).json()["post"]
+    assert post["thumbnail_url"].endswith("/thumbnail.jpg")
+    with Image.open(tmp_path / post["thumbnail_url"].removeprefix("/media/")) as image:
+        assert image.size == (320, 160)
@@ -1,11 +1,18 @@
 import contextlib
+import hashlib
 import os
 import pathlib
 import tempfile
 
 import pytest
+from fastapi import HTTPException
 from httpx import AsyncClient
 
+from social_media_fapi.config import config
+from social_media_fapi.streaming_upload import UploadValidator
+
+PNG_HEADER = b"\x89PNG\r\n\x1a\n"
+
 
 @pytest.fixture()
 def sample_image(
@@ -14,7 +21,8 @@ def sample_image(
     # __file__ is the path to THIS file. The .parent then takes us to the parent direcotry, which is routers.
     # The .resolve gets the absolute path to the file (which is going to be a fake file.)
     path = (pathlib.Path(__file__).parent / "assets" / "myfile.png").resolve()
-    fs.create_file(path)
+    # Starts like a PNG, uploads are checked by their first bytes.
+    fs.create_file(path, contents=PNG_HEADER + b"\0" * 100)
     return path
 
 
@@ -74,3 +82,64 @@ async def test_temp_file_removed_after_upload(
     created_temp_file = named_temp_file_spy.spy_return
 
     assert not os.path.exists(created_temp_file.name)
+
+
+@pytest.mark.anyio
+async def test_upload_sends_type_and_sha1(
+    async_client: AsyncClient, logged_in_token: str, sample_image: pathlib.Path, mock_b2_upload_file
+):
+    await call_upload_endpoint(async_client, logged_in_token, sample_image)
+
+    kwargs = mock_b2_upload_file.call_args.kwargs
+    assert kwargs["file_name"] == "myfile.png"
+    assert kwargs["content_type"] == "image/png"
+    assert kwargs["sha1_sum"] == hashlib.sha1(sample_image.read_bytes()).hexdigest()
+
+
+@pytest.mark.anyio
+async def test_upload_unknown_type(
+    async_client: AsyncClient, logged_in_token: str, sample_image: pathlib.Path, mock_b2_upload_file
+):
+    sample_image.write_bytes(b"#!/bin/sh\nrm -rf /\n")
+    response = await call_upload_endpoint(async_client, logged_in_token, sample_image)
+
+    assert response.status_code == 415
+    mock_b2_upload_file.assert_not_called()
+
+
+@pytest.mark.anyio
+async def test_upload_too_big(
+    async_client: AsyncClient, logged_in_token: str, sample_image: pathlib.Path, mock_b2_upload_file, mocker
+):
+    mocker.patch.object(config, "UPLOAD_MAX_BYTES", 50)
+    response = await call_upload_endpoint(async_client, logged_in_token, sample_image)
+
+    assert response.status_code == 413
+    mock_b2_upload_file.assert_not_called()
+
+
+def test_validator_stops_at_the_chunk_over_the_limit():
+    validator = UploadValidator(max_bytes=20, allowed_types=["image/png"])
+    validator.feed(PNG_HEADER + b"\0" * 8)
+    with pytest.raises(HTTPException) as error:
+        validator.feed(b"\0" * 8)
+    assert error.value.status_code == 413
+
+    validator = UploadValidator(max_bytes=20, allowed_types=["image/png"])
+    validator.feed(b"GIF8")
+    # Not enough to tell yet, the next chunk decides.
+    with pytest.raises(HTTPException) as error:
+        validator.feed(b"9a" + b"\0" * 6)
+    assert error.value.status_code == 415
+
+
+@pytest.mark.anyio
+async def test_upload_content_length_too_big(async_client: AsyncClient, logged_in_token: str, aiofiles_mock_open):
+    response = await async_client.post(
+        "/upload",
+        files={"file": ("big.png", PNG_HEADER + b"\0" * 100)},
+        headers={"Authorization": f"Bearer {logged_in_token}", "Content-Length": str(10**12)},
+    )
+    assert response.status_code == 413
+    # Before any of the body was read.
+    aiofiles_mock_open.assert_not_called()
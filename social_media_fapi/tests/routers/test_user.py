@@ -2,6 +2,8 @@ import pytest
 from fastapi import BackgroundTasks
 from httpx import AsyncClient
 
+from social_media_fapi import security
+
 
 async def register_user(async_client: AsyncClient, email: str, password: str):
     return await async_client.post(
@@ -90,3 +92,65 @@ async def test_login_user(async_client: AsyncClient, confirmed_user: dict):
         },
     )
     assert response.status_code == 200
+
+
+@pytest.mark.anyio
+async def test_refresh_token_rotation(async_client: AsyncClient, confirmed_user: dict):
+    response = await async_client.post("/token", json=confirmed_user)
+    refresh_token = response.json()["refresh_token"]
+
+    response = await async_client.post("/token/refresh", json={"refresh_token": refresh_token})
+    assert response.status_code == 200
+    assert response.json()["refresh_token"] != refresh_token
+
+    # The old refresh token can only be used once.
+    response = await async_client.post("/token/refresh", json={"refresh_token": refresh_token})
+    assert response.status_code == 401
+
+
+@pytest.mark.anyio
+async def test_refresh_token_reused_on_another_worker(async_client: AsyncClient, confirmed_user: dict, mocker):
+    response = await async_client.post("/token", json=confirmed_user)
+    refresh_token = response.json()["refresh_token"]
+    await async_client.post("/token/refresh", json={"refresh_token": refresh_token})
+
+    # A worker whose denylist hasn't loaded the revocation yet still finds it in the database.
+    mocker.patch.object(security, "token_denylist", security.TokenDenylist())
+    response = await async_client.post("/token/refresh", json={"refresh_token": refresh_token})
+    assert response.status_code == 401
+    assert response.json()["detail"] == "Token has been revoked"
+
+
+@pytest.mark.anyio
+async def test_revoke_token(async_client: AsyncClient, logged_in_token: str):
+    headers = {"Authorization": f"Bearer {logged_in_token}"}
+    response = await async_client.post("/token/revoke", json={}, headers=headers)
+    assert response.status_code == 200
+
+    response = await async_client.post("/post", json={"body": "Test Post"}, headers=headers)
+    assert response.status_code == 401
+    assert "Token has been revoked" in response.json()["detail"]
+
+
+@pytest.mark.anyio
+async def test_user_stats(
+    async_client: AsyncClient, confirmed_user: dict, created_post: dict, logged_in_token: str
+):
+    headers = {"Authorization": f"Bearer {logged_in_token}"}
+    await async_client.post("/comment", json={"body": "Comment", "post_id": created_post["id"]}, headers=headers)
+    await async_client.post("/like", json={"post_id": created_post["id"]}, headers=headers)
+
+    response = await async_client.get(f"/user/{confirmed_user['id']}/stats")
+    assert response.status_code == 200
+    assert response.json() == {
+        "user_id": confirmed_user["id"],
+        "post_count": 1,
+        "comment_count": 1,
+        "like_count": 1,
+    }
+
+
+@pytest.mark.anyio
+async def test_user_stats_not_found(async_client: AsyncClient):
+    response = await async_client.get("/user/99/stats")
+    assert response.status_code == 404
@@ -0,0 +1,62 @@
+import gzip
+import json
+
+import pytest
+from httpx import AsyncClient
+
+from social_media_fapi import archive, stats
+from social_media_fapi.database import database, post_archive_index_table, post_table
+from social_media_fapi.tests.helpers import create_comment, like_post
+
+
+@pytest.fixture()
+def archive_dir(tmp_path, mocker):
+    mocker.patch("social_media_fapi.archive.config.ARCHIVE_DIR", str(tmp_path))
+    return tmp_path
+
+
+@pytest.fixture()
+async def old_post(async_client: AsyncClient, created_post: dict, logged_in_token: str) -> dict:
+    await create_comment("Old comment", created_post["id"], async_client, logged_in_token)
+    await like_post(created_post["id"], async_client, logged_in_token)
+    await database.execute(post_table.update().values(created_at=0))
+    return created_post
+
+
+def test_write_and_read_blocks(tmp_path):
+    documents = [{"post": {"id": post_id}, "comments": [], "likes": []} for post_id in range(1, 6)]
+    path = tmp_path / "posts.jsonl.gz"
+    entries, raw_bytes, compressed_bytes = archive.write_blocks(path, documents, block_size=2)
+
+    # Three blocks, and the file is still one valid gzip file.
+    assert len({offset for _, offset, _ in entries}) == 3
+    assert [json.loads(line) for line in gzip.decompress(path.read_bytes()).splitlines()] == documents
+    assert (raw_bytes, compressed_bytes) == (len(gzip.decompress(path.read_bytes())), path.stat().st_size)
+    _, offset, length = entries[4]
+    assert archive.read_block(str(path), offset, length) == (documents[4],)
+
+
+@pytest.mark.anyio
+async def test_archive_posts(async_client: AsyncClient, old_post: dict, archive_dir):
+    live = (await async_client.get(f"/post/{old_post['id']}")).json()
+
+    report = await archive.archive_posts(older_than_days=30)
+    assert {"posts": 1, "comments": 1, "likes": 1}.items() <= report.items()
+    assert "reclaimed_bytes" in report
+
+    assert await database.fetch_all(post_table.select()) == []
+    assert len(await database.fetch_all(post_archive_index_table.select())) == 1
+    # Still readable through the API, from the archive.
+    response = await async_client.get(f"/post/{old_post['id']}")
+    assert response.status_code == 200
+    assert response.json() == live
+    # And the user's stats still count it.
+    assert await stats.reconcile() == {"user_stats": 0, "post_stats": 0}
+
+
+@pytest.mark.anyio
+async def test_archive_keeps_new_posts(old_post: dict, archive_dir):
+    await database.execute(post_table.update().values(created_at=None))
+    report = await archive.archive_posts(older_than_days=30)
+    assert report["file"] is None
+    assert len(await database.fetch_all(post_table.select())) == 1
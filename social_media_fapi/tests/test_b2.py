@@ -0,0 +1,76 @@
+import asyncio
+
+import pytest
+
+from social_media_fapi.libs.b2 import B2Client
+
+
+@pytest.fixture()
+def fake_b2(mocker):
+    """B2Client._authorize without Backblaze, each call gives a new api and bucket."""
+    authorized = []
+
+    def authorize():
+        api, bucket = mocker.Mock(name=f"api{len(authorized)}"), mocker.Mock()
+        api.get_download_url_for_fileid.side_effect = (
+            lambda file_id: f"https://b2.example/b2_download_file_by_id?fileId={file_id}"
+        )
+        bucket.upload_bytes.return_value.id_ = "file1"
+        authorized.append(api)
+        return api, bucket
+
+    mocker.patch.object(B2Client, "_authorize", side_effect=authorize)
+    return authorized
+
+
+@pytest.fixture()
+def client():
+    client = B2Client(upload_threads=2)
+    yield client
+    client.close()
+
+
+@pytest.mark.anyio
+async def test_upload_bytes_authorises_once(fake_b2, client):
+    urls = await asyncio.gather(*(client.upload_bytes(b"data", f"{n}.png", "image/png") for n in range(3)))
+
+    assert urls == ["https://b2.example/b2_download_file_by_id?fileId=file1"] * 3
+    assert len(fake_b2) == 1
+    stats = client.stats()
+    assert stats["authorized_at"] is not None
+    assert stats["calls"]["upload_bytes"]["ok"] == 3
+
+
+@pytest.mark.anyio
+async def test_refresh_swaps_the_api(fake_b2, client):
+    await client.authorize()
+    await client.authorize()
+    await client.delete_file_by_url("https://b2.example/b2_download_file_by_id?fileId=file1")
+
+    assert len(fake_b2) == 2
+    fake_b2[0].delete_file_version.assert_not_called()
+    fake_b2[1].delete_file_version.assert_called_once()
+
+
+@pytest.mark.anyio
+async def test_not_a_b2_url(fake_b2, client):
+    assert await client.delete_file_by_url("https://example.com/cat.png") is False
+    assert fake_b2 == []
+
+
+@pytest.mark.anyio
+async def test_errors_are_counted(fake_b2, client):
+    await client.authorize()
+    fake_b2[0].get_file_info.side_effect = Exception("B2 is down")
+
+    with pytest.raises(Exception, match="B2 is down"):
+        await client.delete_file_by_url("https://b2.example/b2_download_file_by_id?fileId=file1")
+    assert client.stats()["calls"]["delete_file"]["errors"] == 1
+
+
+@pytest.mark.anyio
+async def test_reset_authorises_on_next_call(fake_b2, client):
+    await client.authorize()
+    client.reset()
+    await client.upload_bytes(b"data", "cat.png")
+    assert len(fake_b2) == 2
@@ -0,0 +1,29 @@
+import asyncio
+
+import pytest
+
+from social_media_fapi import cache_sync
+
+
+def test_bump_increments_generation(tmp_path):
+    path = tmp_path / "generation"
+    assert cache_sync.bump(str(path)) == 1
+    assert cache_sync.bump(str(path)) == 2
+    assert cache_sync.read_generation(path) == 2
+
+
+@pytest.mark.anyio
+async def test_watch_runs_callbacks_when_bumped(tmp_path, mocker):
+    path = tmp_path / "generation"
+    callback = mocker.Mock()
+    mocker.patch.object(cache_sync, "_callbacks", [callback])
+
+    watcher = asyncio.create_task(cache_sync.watch(str(path), interval=0.01))
+    await asyncio.sleep(0.05)
+    callback.assert_not_called()
+
+    cache_sync.bump(str(path))
+    await asyncio.sleep(0.05)
+    watcher.cancel()
+
+    callback.assert_called_once()
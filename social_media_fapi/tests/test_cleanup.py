@@ -0,0 +1,133 @@
+import time
+
+import pytest
+from httpx import AsyncClient
+
+from social_media_fapi import archive, cleanup
+from social_media_fapi.config import config
+from social_media_fapi.database import (
+    comment_table,
+    database,
+    generated_image_table,
+    like_table,
+    post_table,
+    user_stats_table,
+)
+from social_media_fapi.tests.helpers import create_comment, create_post, create_reply, delete_post, like_post
+
+PNG = b"\x89PNG\r\n\x1a\n" + b"\0" * 100
+
+
+@pytest.fixture()
+def mock_b2_delete(mocker):
+    return mocker.patch("social_media_fapi.post_media.b2_delete_file_by_url", return_value=True)
+
+
+@pytest.mark.anyio
+async def test_purge_deleted_posts(
+    async_client: AsyncClient, created_post: dict, logged_in_token: str, mock_b2_delete
+):
+    post_id = created_post["id"]
+    comment = await create_comment("Comment", post_id, async_client, logged_in_token)
+    await create_reply("Reply", post_id, comment["id"], async_client, logged_in_token)
+    await create_comment("Comment", post_id, async_client, logged_in_token)
+    await like_post(post_id, async_client, logged_in_token)
+    await database.execute(
+        post_table.update().where(post_table.c.id == post_id).values(image_url="https://example.com/image.png")
+    )
+    await delete_post(post_id, async_client, logged_in_token)
+
+    # A batch size of 1 makes it go round the loop for every row.
+    assert await cleanup.purge_deleted_posts(batch_size=1) == 1
+
+    assert await database.fetch_all(comment_table.select()) == []
+    assert await database.fetch_all(like_table.select()) == []
+    mock_b2_delete.assert_called_once_with("https://example.com/image.png")
+    post = await database.fetch_one(post_table.select())
+    assert post.purged_at is not None and post.image_url is None
+    stats = await database.fetch_one(user_stats_table.select())
+    assert (stats.post_count, stats.comment_count, stats.like_count) == (0, 0, 0)
+
+    # Nothing left to do.
+    assert await cleanup.purge_deleted_posts(batch_size=1) == 0
+
+
+@pytest.mark.anyio
+async def test_purge_retries_when_image_delete_fails(
+    async_client: AsyncClient, created_post: dict, logged_in_token: str, mock_b2_delete
+):
+    mock_b2_delete.side_effect = Exception("B2 is down")
+    await database.execute(post_table.update().values(image_url="https://example.com/image.png"))
+    await delete_post(created_post["id"], async_client, logged_in_token)
+
+    assert await cleanup.purge_deleted_posts(batch_size=10) == 0
+    mock_b2_delete.side_effect = None
+    assert await cleanup.purge_deleted_posts(batch_size=10) == 1
+
+
+@pytest.mark.anyio
+async def test_purge_keeps_shared_generated_images(
+    async_client: AsyncClient, created_post: dict, logged_in_token: str, mock_b2_delete
+):
+    # Two posts with the same prompt got the same generated image.
+    other_post = await create_post("Other", async_client, logged_in_token)
+    await database.execute(post_table.update().values(image_url="https://example.com/cat.png"))
+    await delete_post(created_post["id"], async_client, logged_in_token)
+
+    assert await cleanup.purge_deleted_posts(batch_size=10) == 1
+    mock_b2_delete.assert_not_called()
+
+    # Still in the cache of generated images, so a later post may get it too.
+    await database.execute(
+        generated_image_table.insert().values(
+            prompt_key="cat", prompt="cat", image_url="https://example.com/cat.png", created_at=int(time.time())
+        )
+    )
+    await delete_post(other_post["id"], async_client, logged_in_token)
+    assert await cleanup.purge_deleted_posts(batch_size=10) == 1
+    mock_b2_delete.assert_not_called()
+
+
+@pytest.mark.anyio
+async def test_purge_deletes_local_media(async_client: AsyncClient, logged_in_token: str, mocker, tmp_path):
+    mocker.patch.object(config, "B2_KEY_ID", None)
+    mocker.patch.object(config, "MEDIA_DIR", str(tmp_path))
+    headers = {"Authorization": f"Bearer {logged_in_token}"}
+    # One post with its media sent along, one with an image uploaded straight to (local) storage.
+    with_media = await async_client.post(
+        "/post", data={"body": "Media"}, files={"media": ("cat.png", PNG)}, headers=headers
+    )
+    with_upload = await create_post("Upload", async_client, logged_in_token)
+    upload = await async_client.post(
+        "/upload/authorize", json={"file_name": "cat.png", "content_type": "image/png"}, headers=headers
+    )
+    upload = upload.json()
+    await async_client.put(upload["upload_url"], headers=upload["headers"], content=PNG)
+    await async_client.post(
+        "/upload/complete", json={"upload_id": upload["upload_id"], "post_id": with_upload["id"]}, headers=headers
+    )
+    assert any(path.is_file() for path in tmp_path.rglob("*"))
+
+    await delete_post(with_media.json()["id"], async_client, logged_in_token)
+    await delete_post(with_upload["id"], async_client, logged_in_token)
+    assert await cleanup.purge_deleted_posts(batch_size=10) == 2
+
+    assert not any(path.is_file() for path in tmp_path.rglob("*"))
+
+
+@pytest.mark.anyio
+async def test_purge_keeps_images_of_archived_posts(
+    async_client: AsyncClient, created_post: dict, logged_in_token: str, mock_b2_delete, mocker, tmp_path
+):
+    mocker.patch.object(config, "ARCHIVE_DIR", str(tmp_path))
+    # Same prompt, same generated image: one post gets archived, the other is deleted.
+    await database.execute(post_table.update().values(image_url="https://example.com/cat.png", created_at=0))
+    newer = await create_post("Newer", async_client, logged_in_token)
+    await database.execute(
+        post_table.update().where(post_table.c.id == newer["id"]).values(image_url="https://example.com/cat.png")
+    )
+    await archive.archive_posts(older_than_days=30)
+    await delete_post(newer["id"], async_client, logged_in_token)
+
+    assert await cleanup.purge_deleted_posts(batch_size=10) == 1
+    mock_b2_delete.assert_not_called()
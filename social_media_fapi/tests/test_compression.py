@@ -0,0 +1,102 @@
+import gzip
+
+import pytest
+from httpx import ASGITransport, AsyncClient
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Route
+
+from social_media_fapi import compression
+
+BIG = {"posts": [{"id": i, "body": "The same words again and again"} for i in range(200)]}
+
+
+async def big(request):
+    if request.headers.get("if-none-match") == '"v1"':
+        return Response(status_code=304, headers={"ETag": '"v1"'})
+    return JSONResponse(BIG, headers={"ETag": '"v1"'})
+
+
+async def small(request):
+    return JSONResponse({"id": 1})
+
+
+async def streamed(request):
+    async def lines():
+        for i in range(100):
+            yield f'{{"line": {i}}}\n'
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+
+async def image(request):
+    return Response(b"\0" * 5000, media_type="image/png")
+
+
+app = Starlette(
+    routes=[Route("/big", big), Route("/small", small), Route("/streamed", streamed), Route("/image", image)]
+)
+
+
+@pytest.fixture()
+async def client():
+    transport = ASGITransport(app=compression.CompressionMiddleware(app, minimum_size=500))
+    async with AsyncClient(transport=transport, base_url="http://test") as client:
+        yield client
+
+
+@pytest.mark.parametrize(
+    "accept_encoding, expected",
+    [
+        ("gzip", "gzip"),
+        ("gzip, br, zstd", "zstd"),
+        ("gzip;q=1, zstd;q=0.5", "gzip"),
+        ("*", "zstd"),
+        ("identity", None),
+        ("gzip;q=0", None),
+        ("", None),
+    ],
+)
+def test_negotiate(accept_encoding, expected):
+    assert compression.negotiate(accept_encoding, ["zstd", "br", "gzip"]) == expected
+
+
+def test_levels_for():
+    assert compression.levels_for("application/json") == compression.LEVELS["application/json"]
+    assert compression.levels_for("text/html; charset=utf-8") == compression.LEVELS["text/"]
+    assert compression.levels_for("text/event-stream") is None
+    assert compression.levels_for("image/png") is None
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("encoding", compression.ENCODINGS)
+async def test_compresses_big_json(client: AsyncClient, encoding: str):
+    response = await client.get("/big", headers={"Accept-Encoding": encoding})
+    assert response.headers["content-encoding"] == encoding
+    assert response.headers["vary"] == "Accept-Encoding"
+    assert response.headers["etag"] == f'"v1-{encoding}"'
+    assert int(response.headers["content-length"]) < len(response.content)
+    assert response.json() == BIG
+
+
+@pytest.mark.anyio
+async def test_not_modified_with_compressed_etag(client: AsyncClient):
+    response = await client.get("/big", headers={"Accept-Encoding": "gzip", "If-None-Match": '"v1-gzip"'})
+    assert response.status_code == 304
+    assert response.headers["etag"] == '"v1-gzip"'
+
+
+@pytest.mark.anyio
+async def test_small_and_incompressible_left_alone(client: AsyncClient):
+    for path in ("/small", "/image"):
+        response = await client.get(path, headers={"Accept-Encoding": "gzip"})
+        assert "content-encoding" not in response.headers
+
+
+@pytest.mark.anyio
+async def test_streamed_response(client: AsyncClient):
+    async with client.stream("GET", "/streamed", headers={"Accept-Encoding": "gzip"}) as response:
+        assert response.headers["content-encoding"] == "gzip"
+        assert "content-length" not in response.headers
+        raw = b"".join([chunk async for chunk in response.aiter_raw()])
+    assert gzip.decompress(raw).decode().splitlines()[-1] == '{"line": 99}'
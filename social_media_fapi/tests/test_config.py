@@ -0,0 +1,74 @@
+import logging
+
+import pytest
+from pydantic import ValidationError
+
+from social_media_fapi import cache_sync, logging_conf
+from social_media_fapi.config import config, reload_config
+from social_media_fapi.events import bus
+from social_media_fapi.image_generation import image_generator
+
+
+@pytest.fixture()
+def env(monkeypatch):
+    # Changes the environment for reload_config, and reloads the settings the test started with after.
+    yield monkeypatch
+    monkeypatch.undo()
+    reload_config()
+
+
+def test_reload_changes_config_in_place(env):
+    env.setenv("TEST_IMAGE_CACHE_TTL", "60")
+    env.setenv("TEST_EVENT_BUFFER_SIZE", "7")
+
+    changed = reload_config()
+
+    assert set(changed) == {"IMAGE_CACHE_TTL", "EVENT_BUFFER_SIZE"}
+    assert changed["IMAGE_CACHE_TTL"][1] == 60
+    assert config.IMAGE_CACHE_TTL == 60
+    # The subscribers copied the new values.
+    assert image_generator.ttl == 60
+    assert bus.buffer_size == 7
+
+
+def test_reload_without_changes():
+    assert reload_config() == {}
+
+
+def test_reload_with_a_bad_value_changes_nothing(env):
+    ttl = config.IMAGE_CACHE_TTL
+    env.setenv("TEST_IMAGE_CACHE_TTL", "a week")
+    env.setenv("TEST_EVENT_BUFFER_SIZE", "7")
+
+    with pytest.raises(ValidationError):
+        reload_config()
+
+    assert config.IMAGE_CACHE_TTL == ttl
+    assert config.EVENT_BUFFER_SIZE != 7
+
+
+def test_reload_updates_logging(env, mocker):
+    sampling_filter = logging_conf.SamplingFilter(sample_rate=1.0, high_water=1000)
+    mocker.patch.object(logging_conf, "_sampling_filters", [sampling_filter])
+    logger = logging.getLogger("social_media_fapi")
+    level = logger.level
+    env.setenv("TEST_LOG_SAMPLE_RATE", "0.25")
+    env.setenv("TEST_LOG_LEVEL", "WARNING")
+    try:
+        reload_config()
+
+        assert sampling_filter.sample_rate == 0.25
+        assert logger.level == logging.WARNING
+    finally:
+        env.delenv("TEST_LOG_LEVEL")
+        reload_config()
+        logger.setLevel(level)
+
+
+def test_cache_sync_reloads_config_first(env):
+    assert cache_sync._callbacks[0] is reload_config
+    env.setenv("TEST_IMAGE_CACHE_TTL", "60")
+
+    cache_sync.invalidate_local()
+
+    assert config.IMAGE_CACHE_TTL == 60
@@ -0,0 +1,36 @@
+import json
+
+import pytest
+
+from social_media_fapi.events import EventBus, post_topic
+
+
+@pytest.mark.anyio
+async def test_publish_reaches_subscribers_of_topic():
+    bus = EventBus()
+    subscription = bus.subscribe(post_topic(1))
+    other = bus.subscribe(post_topic(2))
+
+    assert bus.publish(post_topic(1), {"type": "test"}) == 1
+    assert json.loads(await subscription.get()) == {"type": "test"}
+    assert other.queue.empty()
+
+
+def test_close_removes_subscription():
+    bus = EventBus()
+    subscription = bus.subscribe(post_topic(1))
+    subscription.close()
+    assert bus.subscriber_count(post_topic(1)) == 0
+    assert bus.publish(post_topic(1), {"type": "test"}) == 0
+
+
+@pytest.mark.anyio
+async def test_slow_subscriber_dropped():
+    bus = EventBus(buffer_size=2)
+    slow = bus.subscribe("feed")
+    for i in range(3):
+        bus.publish("feed", {"i": i})
+
+    assert bus.dropped == 1
+    assert bus.subscriber_count("feed") == 0
+    assert await slow.get() is None
@@ -0,0 +1,122 @@
+import io
+import json
+import zipfile
+
+import httpx
+import pytest
+from httpx import AsyncClient
+
+from social_media_fapi import archive, export
+from social_media_fapi.config import config
+from social_media_fapi.database import database, post_table
+from social_media_fapi.security import create_access_token
+from social_media_fapi.tests.helpers import create_comment, create_post, like_post
+
+
+def image_handler(request: httpx.Request) -> httpx.Response:
+    if request.url.path == "/missing.png":
+        return httpx.Response(404)
+    return httpx.Response(200, content=b"\x89PNG" + b"\0" * 100, headers={"content-type": "image/png"})
+
+
+@pytest.mark.anyio
+async def test_export_user_data(
+    async_client: AsyncClient, confirmed_user: dict, created_post: dict, logged_in_token: str, mocker
+):
+    await create_comment("Comment", created_post["id"], async_client, logged_in_token)
+    await like_post(created_post["id"], async_client, logged_in_token)
+    missing = await create_post("No image", async_client, logged_in_token)
+    await database.execute(
+        post_table.update().where(post_table.c.id == created_post["id"]).values(image_url="https://example.com/a")
+    )
+    await database.execute(
+        post_table.update().where(post_table.c.id == missing["id"]).values(image_url="https://example.com/missing.png")
+    )
+    # Small chunks and pages, so it goes through the loops more than once.
+    mocker.patch("social_media_fapi.export.CHUNK_SIZE", 10)
+    mocker.patch("social_media_fapi.export.PAGE_SIZE", 1)
+
+    # AsyncClient was imported before conftest mocks httpx.AsyncClient, so it's the real one.
+    client = AsyncClient(transport=httpx.MockTransport(image_handler))
+    chunks = [chunk async for chunk in export.export_user_data(confirmed_user["id"], client)]
+    assert len(chunks) > 1
+
+    with zipfile.ZipFile(io.BytesIO(b"".join(chunks))) as zip_file:
+        posts = [json.loads(line) for line in zip_file.read("posts.ndjson").splitlines()]
+        assert [post["id"] for post in posts] == [created_post["id"], missing["id"]]
+        assert len(zip_file.read("comments.ndjson").splitlines()) == 1
+        assert len(zip_file.read("likes.ndjson").splitlines()) == 1
+        assert zip_file.read(f"images/{created_post['id']}.png").startswith(b"\x89PNG")
+        manifest = json.loads(zip_file.read("export.json"))
+    assert manifest["counts"]["images"] == 1
+    assert [image["post_id"] for image in manifest["failed_images"]] == [missing["id"]]
+
+
+@pytest.mark.anyio
+async def test_export_reads_local_images_from_media_dir(
+    async_client: AsyncClient, confirmed_user: dict, created_post: dict, logged_in_token: str, mocker, tmp_path
+):
+    mocker.patch.object(config, "MEDIA_DIR", str(tmp_path))
+    (tmp_path / "posts").mkdir()
+    (tmp_path / "posts" / "file.png").write_bytes(b"\x89PNG local")
+    gone = await create_post("Gone", async_client, logged_in_token)
+    await database.execute(
+        post_table.update().where(post_table.c.id == created_post["id"]).values(image_url="/media/posts/file.png")
+    )
+    await database.execute(
+        post_table.update().where(post_table.c.id == gone["id"]).values(image_url="/media/posts/gone.png")
+    )
+
+    # Nothing of ours should be downloaded.
+    client = AsyncClient(transport=httpx.MockTransport(lambda request: httpx.Response(500)))
+    chunks = [chunk async for chunk in export.export_user_data(confirmed_user["id"], client)]
+
+    with zipfile.ZipFile(io.BytesIO(b"".join(chunks))) as zip_file:
+        assert zip_file.read(f"images/{created_post['id']}.png") == b"\x89PNG local"
+        manifest = json.loads(zip_file.read("export.json"))
+    assert manifest["counts"]["images"] == 1
+    assert [image["post_id"] for image in manifest["failed_images"]] == [gone["id"]]
+
+
+@pytest.mark.anyio
+async def test_export_route(async_client: AsyncClient, created_post: dict, logged_in_token: str):
+    response = await async_client.get("/user/me/export", headers={"Authorization": f"Bearer {logged_in_token}"})
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/zip"
+    with zipfile.ZipFile(io.BytesIO(response.content)) as zip_file:
+        assert json.loads(zip_file.read("posts.ndjson"))["body"] == created_post["body"]
+
+
+@pytest.mark.anyio
+async def test_export_needs_login(async_client: AsyncClient):
+    response = await async_client.get("/user/me/export")
+    assert response.status_code == 401
+
+
+@pytest.mark.anyio
+async def test_export_includes_archived_comments_and_likes(
+    async_client: AsyncClient, confirmed_user: dict, logged_in_token: str, tmp_path, mocker
+):
+    # Someone else's post, which the user commented on and liked before it was archived.
+    await async_client.post("/register", json={"email": "other@example.com", "password": "1234"})
+    other_token = create_access_token("other@example.com")
+    other_post = await create_post("Other", async_client, other_token)
+    await create_comment("Comment", other_post["id"], async_client, logged_in_token)
+    await like_post(other_post["id"], async_client, logged_in_token)
+    own_post = await create_post("Own", async_client, logged_in_token)
+    await database.execute(post_table.update().values(created_at=0))
+    await database.execute(
+        post_table.update().where(post_table.c.id == own_post["id"]).values(image_url="https://example.com/a.png")
+    )
+    mocker.patch("social_media_fapi.archive.config.ARCHIVE_DIR", str(tmp_path))
+    await archive.archive_posts(older_than_days=30)
+
+    client = AsyncClient(transport=httpx.MockTransport(image_handler))
+    chunks = [chunk async for chunk in export.export_user_data(confirmed_user["id"], client)]
+
+    with zipfile.ZipFile(io.BytesIO(b"".join(chunks))) as zip_file:
+        comments = [json.loads(line) for line in zip_file.read("comments.ndjson").splitlines()]
+        likes = [json.loads(line) for line in zip_file.read("likes.ndjson").splitlines()]
+        assert zip_file.read(f"images/{own_post['id']}.png").startswith(b"\x89PNG")
+    assert [(comment["body"], comment["archived"]) for comment in comments] == [("Comment", True)]
+    assert [(like["post_id"], like["archived"]) for like in likes] == [(other_post["id"], True)]
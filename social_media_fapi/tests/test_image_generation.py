@@ -0,0 +1,143 @@
+import asyncio
+from unittest.mock import AsyncMock
+
+import httpx
+import pytest
+
+from social_media_fapi import tasks
+from social_media_fapi.database import database, generated_image_table
+from social_media_fapi.image_generation import ImageGenerator, normalize_prompt
+
+
+def test_normalize_prompt():
+    assert normalize_prompt("  A   Blue\tCat!  ") == "a blue cat"
+    assert normalize_prompt("A blue cat.") == normalize_prompt("a blue cat")
+
+
+@pytest.mark.anyio
+async def test_same_prompt_is_generated_once():
+    generator = ImageGenerator(concurrency=2, ttl=60, cache_size=10)
+    generate = AsyncMock(return_value="https://example.com/cat.jpg")
+
+    assert await generator.get("A cat", generate) == "https://example.com/cat.jpg"
+    assert await generator.get("a  CAT.", generate) == "https://example.com/cat.jpg"
+
+    generate.assert_awaited_once_with("A cat")
+    assert generator.counts["memory_hits"] == 1
+
+
+@pytest.mark.anyio
+async def test_cached_in_the_database():
+    generate = AsyncMock(return_value="https://example.com/cat.jpg")
+    await ImageGenerator(concurrency=2, ttl=60, cache_size=10).get("A cat", generate)
+
+    # Another worker (or this one after a restart) has nothing in memory.
+    other = ImageGenerator(concurrency=2, ttl=60, cache_size=10)
+    assert await other.get("A cat", generate) == "https://example.com/cat.jpg"
+    generate.assert_awaited_once()
+    assert other.counts["database_hits"] == 1
+
+
+@pytest.mark.anyio
+async def test_expired_images_are_generated_again():
+    generator = ImageGenerator(concurrency=2, ttl=60, cache_size=10)
+    await generator.get("A cat", AsyncMock(return_value="https://example.com/old.jpg"))
+    await database.execute(generated_image_table.update().values(created_at=0))
+    generator.clear()
+
+    assert await generator.get("A cat", AsyncMock(return_value="https://example.com/new.jpg")) == (
+        "https://example.com/new.jpg"
+    )
+
+
+@pytest.mark.anyio
+async def test_prompt_generated_by_two_workers_at_once():
+    # Both looked in the database before either saved, the second save replaces the first.
+    for image_url in ("https://example.com/first.jpg", "https://example.com/second.jpg"):
+        values = {"prompt": "a cat", "image_url": image_url, "created_at": 1}
+        await ImageGenerator(concurrency=2, ttl=60, cache_size=10)._save("key", values)
+
+    rows = await database.fetch_all(generated_image_table.select())
+    assert [row.image_url for row in rows] == ["https://example.com/second.jpg"]
+
+
+@pytest.mark.anyio
+async def test_concurrent_identical_prompts_share_one_call():
+    generator = ImageGenerator(concurrency=2, ttl=60, cache_size=10)
+    release = asyncio.Event()
+
+    async def generate(prompt: str) -> str:
+        await release.wait()
+        return "https://example.com/cat.jpg"
+
+    generate = AsyncMock(side_effect=generate)
+    waiters = [asyncio.create_task(generator.get("A cat", generate)) for _ in range(5)]
+    await asyncio.sleep(0)
+    release.set()
+
+    assert await asyncio.gather(*waiters) == ["https://example.com/cat.jpg"] * 5
+    generate.assert_awaited_once()
+    assert generator.counts["coalesced"] == 4
+
+
+@pytest.mark.anyio
+async def test_concurrency_is_limited_and_the_queue_counted():
+    generator = ImageGenerator(concurrency=1, ttl=60, cache_size=10)
+    release = asyncio.Event()
+
+    async def generate(prompt: str) -> str:
+        await release.wait()
+        return f"https://example.com/{prompt}.jpg"
+
+    waiters = [asyncio.create_task(generator.get(f"animal {n}", generate)) for n in range(3)]
+    # Each one looks in the database first, give them time to get to the queue.
+    for _ in range(500):
+        if generator.stats()["running"] + generator.stats()["waiting"] == 3:
+            break
+        await asyncio.sleep(0.01)
+    assert generator.stats()["running"] == 1
+    assert generator.stats()["waiting"] == 2
+
+    release.set()
+    await asyncio.gather(*waiters)
+    assert generator.stats()["running"] == generator.stats()["waiting"] == 0
+
+
+@pytest.mark.anyio
+async def test_failures_are_not_cached():
+    generator = ImageGenerator(concurrency=2, ttl=60, cache_size=10)
+    with pytest.raises(tasks.APIResponseError):
+        await generator.get("A cat", AsyncMock(side_effect=tasks.APIResponseError("down")))
+
+    assert await generator.get("A cat", AsyncMock(return_value="https://example.com/cat.jpg")) == (
+        "https://example.com/cat.jpg"
+    )
+    assert generator.counts["failed"] == 1
+
+
+@pytest.mark.anyio
+async def test_generated_image_is_copied_to_b2(mocker, mock_httpx_client):
+    mocker.patch.object(tasks.config, "B2_KEY_ID", "key")
+    upload = mocker.patch("social_media_fapi.tasks.b2_upload_bytes", return_value="https://b2.example/cat")
+    mock_httpx_client.post.return_value = httpx.Response(
+        200, json={"output_url": "https://deepai.example/abc.png"}, request=httpx.Request("POST", "//")
+    )
+    mock_httpx_client.get = AsyncMock(
+        return_value=httpx.Response(
+            200, content=b"png", headers={"content-type": "image/png"}, request=httpx.Request("GET", "//")
+        )
+    )
+
+    assert await tasks._generate_image_url("A cat") == "https://b2.example/cat"
+    data, file_name, content_type = upload.call_args.args
+    assert data == b"png"
+    assert file_name.startswith("generated/") and file_name.endswith(".png")
+    assert content_type == "image/png"
+
+
+@pytest.mark.anyio
+async def test_get_image_generation_stats(async_client: httpx.AsyncClient):
+    response = await async_client.get("/image-generation/stats")
+
+    assert response.status_code == 200
+    assert {"waiting", "running", "in_flight", "cached"} <= response.json().keys()
@@ -0,0 +1,113 @@
+import asyncio
+import zlib
+
+import pytest
+
+from social_media_fapi import image_providers, tasks
+from social_media_fapi.image_providers import (
+    ImageProvider,
+    LocalImageProvider,
+    ProviderError,
+    generate_hedged,
+    render_placeholder,
+)
+
+
+class ScriptedProvider(ImageProvider):
+    """Answers each call after the next of the given delays, or raises it if it's an exception."""
+
+    name = "scripted"
+
+    def __init__(self, *script, timeout: float = 1.0) -> None:
+        super().__init__(timeout)
+        self.script = list(script)
+        self.calls = 0
+
+    async def create(self, prompt: str) -> str:
+        step = self.script[self.calls]
+        self.calls += 1
+        if isinstance(step, Exception):
+            raise step
+        await asyncio.sleep(step)
+        return f"https://example.com/{self.calls}.png"
+
+
+def test_render_placeholder_is_deterministic(tmp_path):
+    name = render_placeholder("A cat", str(tmp_path), size=16)
+    first = (tmp_path / name).read_bytes()
+    (tmp_path / name).unlink()
+
+    assert render_placeholder("A cat", str(tmp_path), size=16) == name
+    assert (tmp_path / name).read_bytes() == first
+    assert first.startswith(b"\x89PNG\r\n\x1a\n")
+    assert render_placeholder("A dog", str(tmp_path), size=16) != name
+
+
+def test_png_pixels(tmp_path):
+    data = image_providers.png(2, 1, [b"\xff\x00\x00\x00\x00\xff"])
+    idat = data.index(b"IDAT")
+    length = int.from_bytes(data[idat - 4 : idat], "big")
+    assert zlib.decompress(data[idat + 4 : idat + 4 + length]) == b"\0\xff\x00\x00\x00\x00\xff"
+
+
+@pytest.mark.anyio
+async def test_local_provider(tmp_path):
+    provider = LocalImageProvider(timeout=30, media_dir=str(tmp_path), media_url="/media", workers=1)
+    try:
+        url = await provider.generate("A cat")
+    finally:
+        provider.close()
+
+    assert url.startswith("/media/generated/") and url.endswith(".png")
+    assert (tmp_path / "generated" / url.rsplit("/", 1)[1]).exists()
+    assert provider.stats.summary()["ok"] == 1
+
+
+@pytest.mark.anyio
+async def test_timeout():
+    provider = ScriptedProvider(1.0, timeout=0.01)
+    with pytest.raises(ProviderError, match="took longer"):
+        await provider.generate("A cat")
+    assert provider.stats.summary()["timeouts"] == 1
+
+
+@pytest.mark.anyio
+async def test_retry_after_failure():
+    provider = ScriptedProvider(ProviderError("down"), 0)
+    assert await generate_hedged(provider, "A cat", attempts=2) == "https://example.com/2.png"
+    summary = provider.stats.summary()
+    assert (summary["errors"], summary["ok"], summary["retries"]) == (1, 1, 1)
+
+
+@pytest.mark.anyio
+async def test_all_attempts_fail():
+    provider = ScriptedProvider(ProviderError("down"), ProviderError("still down"))
+    with pytest.raises(ProviderError, match="still down"):
+        await generate_hedged(provider, "A cat", attempts=2)
+
+
+@pytest.mark.anyio
+async def test_hedged_call_wins_over_a_slow_one():
+    # The first call hangs, the second starts after hedge_after and answers straight away.
+    provider = ScriptedProvider(10, 0)
+    assert await generate_hedged(provider, "A cat", attempts=2, hedge_after=0.01) == "https://example.com/2.png"
+    # The slow one is cancelled, it records that when it next runs.
+    await asyncio.sleep(0.01)
+    assert provider.stats.summary()["cancelled"] == 1
+
+
+def test_unknown_provider():
+    with pytest.raises(ProviderError, match="Unknown IMAGE_PROVIDER"):
+        image_providers.get_provider("nope")
+
+
+@pytest.mark.anyio
+async def test_generate_with_local_provider(mocker, tmp_path):
+    provider = LocalImageProvider(timeout=30, media_dir=str(tmp_path), media_url="/media", workers=1)
+    mocker.patch.dict(image_providers.providers, {"local": provider})
+    mocker.patch.object(tasks.config, "IMAGE_PROVIDER", "local")
+    try:
+        # Ours already, so not copied to B2.
+        assert (await tasks._generate_image_url("A cat")).startswith("/media/generated/")
+    finally:
+        provider.close()
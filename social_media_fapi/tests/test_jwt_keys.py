@@ -0,0 +1,58 @@
+import time
+
+import pytest
+from jose import jwt
+from jose.exceptions import ExpiredSignatureError, JWTError
+
+from social_media_fapi.jwt_keys import JWTKeys, generate_key
+
+
+@pytest.fixture()
+def es256_keys_dir(tmp_path):
+    generate_key(str(tmp_path), "old")
+    generate_key(str(tmp_path), "new")
+    return str(tmp_path)
+
+
+def test_hs256_matches_jose():
+    keys = JWTKeys("HS256", secret_key="secret")
+    token = jwt.encode({"sub": "a", "exp": time.time() + 60}, "secret", algorithm="HS256")
+    assert keys.decode(token)["sub"] == "a"
+    assert jwt.decode(keys.encode({"sub": "b"}), "secret", algorithms=["HS256"])["sub"] == "b"
+
+
+def test_decode_rejects_bad_signature():
+    token = JWTKeys("HS256", secret_key="other").encode({"sub": "a"})
+    with pytest.raises(JWTError):
+        JWTKeys("HS256", secret_key="secret").decode(token)
+
+
+def test_decode_rejects_garbage():
+    with pytest.raises(JWTError):
+        JWTKeys("HS256", secret_key="secret").decode("not a token")
+
+
+def test_decode_expired():
+    keys = JWTKeys("HS256", secret_key="secret")
+    with pytest.raises(ExpiredSignatureError):
+        keys.decode(keys.encode({"sub": "a", "exp": time.time() - 1}))
+
+
+def test_es256_key_rotation(es256_keys_dir):
+    old_token = JWTKeys("ES256", keys_dir=es256_keys_dir, active_kid="old").encode({"sub": "a"})
+    keys = JWTKeys("ES256", keys_dir=es256_keys_dir, active_kid="new")
+
+    assert jwt.get_unverified_header(keys.encode({"sub": "b"}))["kid"] == "new"
+    # Tokens signed with the previous key are still accepted.
+    assert keys.decode(old_token)["sub"] == "a"
+
+
+def test_es256_jwks_only_public(es256_keys_dir):
+    jwks = JWTKeys("ES256", keys_dir=es256_keys_dir, active_kid="new").jwks()
+    assert {key["kid"] for key in jwks["keys"]} == {"old", "new"}
+    assert all("d" not in key for key in jwks["keys"])
+
+
+def test_unknown_active_kid(es256_keys_dir):
+    with pytest.raises(ValueError):
+        JWTKeys("ES256", keys_dir=es256_keys_dir, active_kid="missing")
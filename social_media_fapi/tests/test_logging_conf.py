@@ -0,0 +1,51 @@
+import logging
+import queue
+
+from social_media_fapi.logging_conf import (
+    CorrelationIdFilter,
+    LazyQueueHandler,
+    SamplingFilter,
+)
+
+
+def make_record(level: int = logging.DEBUG) -> logging.LogRecord:
+    return logging.LogRecord("test", level, __file__, 1, "message %s", ("arg",), None)
+
+
+def test_sampling_filter_keeps_everything_below_high_water():
+    log_queue = queue.Queue()
+    sampling_filter = SamplingFilter(sample_rate=0.0, high_water=10, log_queue=log_queue)
+    assert sampling_filter.filter(make_record())
+
+
+def test_sampling_filter_drops_debug_above_high_water():
+    log_queue = queue.Queue()
+    log_queue.put(make_record())
+    sampling_filter = SamplingFilter(sample_rate=0.0, high_water=1, log_queue=log_queue)
+    assert not sampling_filter.filter(make_record(logging.DEBUG))
+    assert not sampling_filter.filter(make_record(logging.INFO))
+    assert sampling_filter.filter(make_record(logging.WARNING))
+
+
+def test_lazy_queue_handler_does_not_render_message():
+    log_queue = queue.Queue()
+    handler = LazyQueueHandler(log_queue)
+    record = make_record()
+    handler.handle(record)
+    queued = log_queue.get_nowait()
+    assert queued.msg == "message %s"
+    assert queued.args == ("arg",)
+
+
+def test_lazy_queue_handler_drops_when_full():
+    handler = LazyQueueHandler(queue.Queue(maxsize=1))
+    handler.handle(make_record())
+    handler.handle(make_record())
+    assert handler.dropped == 1
+
+
+def test_correlation_id_filter_keeps_existing_id():
+    record = make_record()
+    record.correlation_id = "abc"
+    CorrelationIdFilter(default_value="-").filter(record)
+    assert record.correlation_id == "abc"
@@ -0,0 +1,61 @@
+import pytest
+from httpx import ASGITransport, AsyncClient
+
+from social_media_fapi import mail, tasks
+from social_media_fapi.mail import SMTPPool, build_message
+from social_media_fapi.mail_sink import MailSink
+
+
+@pytest.fixture()
+async def smtp_sink():
+    sink = MailSink()
+    server = await sink.start_smtp(port=0)
+    sink.port = server.sockets[0].getsockname()[1]
+    async with server:
+        yield sink
+
+
+@pytest.mark.anyio
+async def test_smtp_pool_reuses_connections(smtp_sink: MailSink):
+    pool = SMTPPool("127.0.0.1", smtp_sink.port, size=2, starttls=False)
+    for number in range(3):
+        await pool.send(build_message("from@example.com", "to@example.com", f"Subject {number}", "Body"))
+    await pool.close()
+
+    assert smtp_sink.counts["smtp_messages"] == 3
+    assert pool.connects == smtp_sink.counts["smtp_connections"] == 1
+
+
+@pytest.mark.anyio
+async def test_send_simple_email_over_smtp(smtp_sink: MailSink, mocker):
+    mocker.patch.object(tasks.config, "MAIL_TRANSPORT", "smtp")
+    pool = SMTPPool("127.0.0.1", smtp_sink.port, size=1, starttls=False)
+    mocker.patch("social_media_fapi.tasks.smtp_pool", return_value=pool)
+
+    await tasks.send_simple_email("test@example.com", "Test subject", "Test body")
+    await pool.close()
+    assert smtp_sink.counts["smtp_messages"] == 1
+
+
+@pytest.mark.anyio
+async def test_send_simple_email_smtp_error(mocker):
+    mocker.patch.object(tasks.config, "MAIL_TRANSPORT", "smtp")
+    # Nothing listens on port 1.
+    mocker.patch("social_media_fapi.tasks.smtp_pool", return_value=SMTPPool("127.0.0.1", 1, size=1, starttls=False))
+
+    with pytest.raises(tasks.APIResponseError, match="SMTP delivery failed"):
+        await tasks.send_simple_email("test@example.com", "Test subject", "Test body")
+
+
+@pytest.mark.anyio
+async def test_http_sink_latency():
+    sink = MailSink(latency=0.01)
+    # AsyncClient was imported before conftest mocks httpx.AsyncClient, so it's the real one.
+    async with AsyncClient(transport=ASGITransport(app=sink.http_app()), base_url="http://sink") as client:
+        response = await client.post("/v3/example.com/messages", data={"to": "to@example.com", "text": "Hi"})
+        assert response.status_code == 200
+        assert (await client.get("/stats")).json()["http_messages"] == 1
+
+
+def test_smtp_pool_is_cached():
+    assert mail.smtp_pool() is mail.smtp_pool()
@@ -0,0 +1,46 @@
+import pytest
+
+from social_media_fapi import passwords, security
+from social_media_fapi.database import database, user_table
+
+
+@pytest.fixture()
+def restore_policy():
+    yield
+    passwords.configure_password_hashing()
+
+
+def test_calibrate_bcrypt():
+    # Faster targets can never need more rounds.
+    fast = passwords.calibrate("bcrypt", 1)
+    slow = passwords.calibrate("bcrypt", 200)
+    assert passwords.BCRYPT_MIN_ROUNDS <= fast <= slow <= passwords.BCRYPT_MAX_ROUNDS
+
+
+def test_calibrate_unknown_scheme():
+    with pytest.raises(ValueError):
+        passwords.calibrate("md5_crypt", 100)
+
+
+def test_lower_cost_needs_update(restore_policy):
+    old_hash = passwords.pwd_context.handler("bcrypt").using(rounds=4).hash("secret")
+    passwords.pwd_context.update(**passwords.hash_policy(["bcrypt"], 5, 1))
+    assert passwords.pwd_context.needs_update(old_hash)
+    assert not passwords.pwd_context.needs_update(passwords.pwd_context.hash("secret"))
+
+
+@pytest.mark.anyio
+async def test_authenticate_user_rehashes(confirmed_user: dict, restore_policy):
+    query = user_table.select().where(user_table.c.email == confirmed_user["email"])
+    old_hash = (await database.fetch_one(query)).password
+
+    # Raise the cost above the one the user was hashed with.
+    rounds = passwords.pwd_context.handler("bcrypt").from_string(old_hash).rounds + 1
+    passwords.pwd_context.update(**passwords.hash_policy(["bcrypt"], rounds, 1))
+    await security.authenticate_user(confirmed_user["email"], confirmed_user["password"])
+
+    new_hash = (await database.fetch_one(query)).password
+    assert new_hash != old_hash
+    assert not passwords.pwd_context.needs_update(new_hash)
+    # And the password still works.
+    await security.authenticate_user(confirmed_user["email"], confirmed_user["password"])
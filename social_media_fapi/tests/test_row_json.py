@@ -0,0 +1,29 @@
+import pytest
+from fastapi.responses import JSONResponse
+
+from social_media_fapi.models.post import UserPostWithLikes
+from social_media_fapi.routers.post import FEED_COLUMNS, feed_encoder
+from social_media_fapi.row_json import RowEncoder
+
+ROWS = [
+    ("Hello", 1, 1, None, None, None, 1700000000, 0),
+    ('Quotes " and \\ and\nnew lines, emoji 🐱 and é', 2, 7, "https://example.com/a.png", "ready", None, None, 3),
+]
+
+
+def test_same_bytes_as_fastapi():
+    posts = [UserPostWithLikes(**dict(zip(FEED_COLUMNS, row))).model_dump(mode="json") for row in ROWS]
+    assert feed_encoder.encode(ROWS) == JSONResponse(posts).body
+
+
+def test_empty():
+    assert feed_encoder.encode([]) == b"[]"
+
+
+def test_floats():
+    assert RowEncoder(["a"]).encode([(0.5,)]) == b'[{"a":0.5}]'
+
+
+def test_unknown_type():
+    with pytest.raises(KeyError):
+        RowEncoder(["a"]).encode([(True,)])
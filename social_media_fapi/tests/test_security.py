@@ -1,3 +1,5 @@
+import time
+
 import pytest
 from jose import jwt
 
@@ -137,3 +139,42 @@ async def test_get_current_user_wrong_type_token(registered_user: dict):
     token = security.create_confirmation_token(registered_user["email"])
     with pytest.raises(security.HTTPException):
         await security.get_current_user(token)
+
+
+def test_create_refresh_token():
+    token = security.create_refresh_token("123")
+    assert {"sub": "123", "type": "refresh"}.items() <= jwt.decode(
+        token, key=config.SECRET_KEY, algorithms=[config.ALGORITHM]
+    ).items()
+
+
+def test_token_denylist_prunes_expired():
+    now = time.time()
+    denylist = security.TokenDenylist()
+    denylist.add("old", now + 100)
+    denylist.add("new", now + 200)
+    denylist.prune(now=now + 150)
+    assert "old" not in denylist
+    assert "new" in denylist
+    assert len(denylist) == 1
+
+
+@pytest.mark.anyio
+async def test_revoked_token_rejected(registered_user: dict):
+    token = security.create_access_token(registered_user["email"])
+    await security.revoke_token(security.decode_token(token, "access"))
+    with pytest.raises(security.HTTPException) as exec_info:
+        security.get_subject_for_token_type(token, "access")
+    assert "Token has been revoked" == exec_info.value.detail
+
+
+@pytest.mark.anyio
+async def test_token_revoked_by_another_worker(registered_user: dict, mocker):
+    payload = security.decode_token(security.create_refresh_token(registered_user["email"]), "refresh")
+    await security.revoke_token(payload)
+    # This worker's denylist hasn't caught up with the one that revoked it.
+    mocker.patch.object(security, "token_denylist", security.TokenDenylist())
+
+    with pytest.raises(security.HTTPException) as exec_info:
+        await security.revoke_token(payload)
+    assert exec_info.value.detail == "Token has been revoked"
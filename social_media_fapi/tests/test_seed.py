@@ -0,0 +1,59 @@
+from collections import Counter
+
+import sqlalchemy
+
+from social_media_fapi.database import metadata
+from social_media_fapi.seed import Generator, seed
+
+
+def test_likes_are_skewed():
+    generator = Generator(users=100, posts=1000, seed=1)
+    likes = Counter(post_id for post_id, _ in generator.like_rows(10000, batch_size=1000))
+    top_ten = sum(count for _, count in likes.most_common(10))
+    # With a Zipf distribution 1% of the posts get a large share of the likes.
+    assert top_ten > 10000 * 0.2
+
+
+def test_comment_rows_exact_count():
+    generator = Generator(users=10, posts=10, seed=1)
+    assert len(list(generator.comment_rows(123))) == 123
+
+
+def test_comment_replies_are_in_the_parents_thread():
+    generator = Generator(users=10, posts=10, seed=1)
+    comments = {row[0]: row for row in generator.comment_rows(500, max_depth=2)}
+    replies = [row for row in comments.values() if row[4] is not None]
+    assert replies
+    for _, _, post_id, _, parent_id, path, depth in replies:
+        parent = comments[parent_id]
+        assert parent[2] == post_id
+        assert path.startswith(parent[5])
+        assert depth == parent[6] + 1 <= 2
+
+
+def test_seed_inserts_rows():
+    engine = sqlalchemy.create_engine("sqlite://")
+    metadata.create_all(engine)
+
+    seed(engine, users=8, posts=30, comments=0, likes=0, show_progress=False)
+    with engine.begin() as connection:
+        # Stats of the users and posts of an earlier run.
+        connection.execute(sqlalchemy.text("INSERT INTO user_stats (user_id, post_count) VALUES (8, 3)"))
+        connection.execute(sqlalchemy.text("INSERT INTO post_stats (post_id) VALUES (30)"))
+        # And of posts it archived.
+        connection.execute(sqlalchemy.text("INSERT INTO archived_user_stats (user_id, post_count) VALUES (1, 2)"))
+        connection.execute(
+            sqlalchemy.text(
+                "INSERT INTO post_archive_index (post_id, user_id, file, offset, length) VALUES (3, 1, 'a.gz', 0, 10)"
+            )
+        )
+
+    result = seed(engine, users=5, posts=20, comments=30, likes=40, batch_size=7, show_progress=False)
+
+    with engine.connect() as connection:
+        expected_counts = {"users": 5, "posts": 20, "comments": 30, "likes": 40, "user_stats": 0, "post_stats": 0}
+        expected_counts.update({"post_archive_index": 0, "archived_user_stats": 0})
+        for table, expected in expected_counts.items():
+            count = connection.execute(sqlalchemy.text(f"SELECT count(*) FROM {table}")).scalar()
+            assert count == expected
+    assert result["posts"] == 20
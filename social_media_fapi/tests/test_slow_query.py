@@ -0,0 +1,34 @@
+import logging
+
+import pytest
+from databases import Database
+
+from social_media_fapi.database import post_table
+from social_media_fapi.slow_query import compile_query
+
+
+def test_compile_query_named_params():
+    statement, params = compile_query(post_table.select().where(post_table.c.id == 1))
+    assert ":id_1" in statement
+    assert params == {"id_1": 1}
+
+
+@pytest.mark.anyio
+async def test_slow_query_logged_with_plan(db: Database, mocker, caplog):
+    mocker.patch.object(db, "slow_query_ms", 0)
+    with caplog.at_level(logging.WARNING, logger="social_media_fapi.slow_query"):
+        await db.fetch_all(post_table.select().where(post_table.c.id == 1))
+
+    record = caplog.records[-1]
+    assert record.param_shapes == {"id_1": "int"}
+    assert "posts" in record.statement
+    assert any("posts" in line for line in record.plan)
+
+
+@pytest.mark.anyio
+async def test_fast_query_not_logged(db: Database, mocker, caplog):
+    mocker.patch.object(db, "slow_query_ms", 10_000)
+    with caplog.at_level(logging.WARNING, logger="social_media_fapi.slow_query"):
+        await db.fetch_all(post_table.select())
+
+    assert not caplog.records
@@ -0,0 +1,41 @@
+import pytest
+
+from social_media_fapi import stats
+from social_media_fapi.database import database, post_stats_table, user_stats_table
+from social_media_fapi.tests.helpers import delete_post
+
+
+@pytest.mark.anyio
+async def test_reconcile_nothing_to_fix(created_post: dict):
+    assert await stats.reconcile() == {"user_stats": 0, "post_stats": 0}
+
+
+@pytest.mark.anyio
+async def test_reconcile_fixes_drift(confirmed_user: dict, created_post: dict):
+    await database.execute(stats.increment(user_stats_table, confirmed_user["id"], post_count=5))
+    # As if the post had been bulk loaded without its stats row.
+    await database.execute(post_stats_table.delete())
+
+    assert await stats.reconcile() == {"user_stats": 1, "post_stats": 0}
+
+    user_stats = await database.fetch_one(user_stats_table.select())
+    assert user_stats.post_count == 1
+    post_stats = await database.fetch_one(post_stats_table.select())
+    assert (post_stats.post_id, post_stats.comment_count, post_stats.like_count) == (created_post["id"], 0, 0)
+
+
+@pytest.mark.anyio
+async def test_reconcile_ignores_deleted_posts(async_client, created_post: dict, logged_in_token: str):
+    await delete_post(created_post["id"], async_client, logged_in_token)
+    assert await stats.reconcile() == {"user_stats": 0, "post_stats": 0}
+    assert await database.fetch_all(post_stats_table.select()) == []
+
+
+@pytest.mark.anyio
+async def test_reconcile_removes_orphaned_rows(created_post: dict):
+    # As if the posts had been deleted in bulk, without going through DELETE /post/{id}.
+    await database.execute(post_stats_table.insert().values(post_id=999))
+
+    assert await stats.reconcile() == {"user_stats": 0, "post_stats": 1}
+    rows = await database.fetch_all(post_stats_table.select())
+    assert [row.post_id for row in rows] == [created_post["id"]]
@@ -2,6 +2,7 @@ import httpx
 import pytest
 from databases import Database
 
+from social_media_fapi import tasks
 from social_media_fapi.database import post_table
 from social_media_fapi.tasks import (
     APIResponseError,
@@ -17,6 +18,13 @@ async def test_send_simple_email(mock_httpx_client):
     mock_httpx_client.post.assert_called()
 
 
+@pytest.mark.anyio
+async def test_send_simple_email_mailgun_auth(mock_httpx_client, mocker):
+    mocker.patch.object(tasks.config, "MAILGUN_API_KEY", "key-123")
+    await send_simple_email("test@example.com", "Test subject", "Test body")
+    assert mock_httpx_client.post.call_args.kwargs["auth"] == ("api", "key-123")
+
+
 @pytest.mark.anyio
 async def test_send_simple_email_api_error(mock_httpx_client):
     mock_httpx_client.post.return_value = httpx.Response(
@@ -78,3 +86,21 @@ async def test_generate_and_add_to_post_success(
     updated_post = await db.fetch_one(query)
 
     assert updated_post.image_url == json_data["output_url"]
+
+
+@pytest.mark.anyio
+async def test_generate_and_add_to_post_deleted_post(
+    mock_httpx_client, created_post: dict, confirmed_user: dict, db: Database, mocker
+):
+    mock_httpx_client.post.return_value = httpx.Response(
+        status_code=200, json={"output_url": "https://example.com/image.jpg"}, request=httpx.Request("POST", "//")
+    )
+    publish = mocker.patch("social_media_fapi.tasks.bus.publish")
+    # Deleted while the image was being generated.
+    await db.execute(post_table.update().values(deleted_at=1))
+
+    assert await generate_and_add_to_post(confirmed_user["email"], created_post["id"], "/post/1", db, "A cat") is None
+
+    updated_post = await db.fetch_one(post_table.select().where(post_table.c.id == created_post["id"]))
+    assert updated_post.image_url is None
+    publish.assert_not_called()
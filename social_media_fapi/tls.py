@@ -0,0 +1,10 @@
+import ssl
+from functools import lru_cache
+
+import certifi
+
+
+@lru_cache()
+def ssl_context() -> ssl.SSLContext:
+    # Loading the CA certificates takes a while, so do it once per worker and share it between the clients.
+    return ssl.create_default_context(cafile=certifi.where())